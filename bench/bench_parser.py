@@ -0,0 +1,142 @@
+#pylint: disable=line-too-long
+"""Benchmark of the sequence file parser
+
+Compares the column based parser of stimseq with the previous row by row parser
+on generated sequence files of increasing size.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+#pylint: disable=wrong-import-position
+import stimseq
+
+# Number of rows of the generated sequence files
+SIZES = [10_000, 100_000, 1_000_000]
+
+# Fraction of generated rows with an invalid value, an out of range AO value or a too small time step.
+# Files without invalid rows are converted at once, others column by column
+INVALID_RATES = [0, 0.001]
+
+
+def generate_sequence_file(path:str, n_rows:int, invalid_rate:float, seed:int=0) -> None:
+    """ Write a sequence file with some rows to skip
+
+    Args:
+        path (str): Path of the file to write
+        n_rows (int): Number of rows
+        invalid_rate (float): Fraction of rows to skip for each reason
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    timestamp = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write("*time step (ms),V1,V2,V3,V4,V5,V6,V7,V8,LED Voltage,piezo,comment\n")
+        for i in range(n_rows):
+            timestamp += stimseq.MIN_TIMESTEP + rng.randrange(100)
+            valves = [str(rng.randrange(2)) for _ in range(8)]
+            led = str(rng.randrange(min(stimseq.AO_RANGE), max(stimseq.AO_RANGE) + 1))
+            row = [str(timestamp), *valves, led, str(rng.randrange(2)), f"step {i}"]
+
+            draw = rng.random()
+            if draw < invalid_rate:
+                row[1] = "x"
+            elif draw < 2 * invalid_rate:
+                row[9] = str(max(stimseq.AO_RANGE) + 1)
+            elif draw < 3 * invalid_rate:
+                timestamp -= stimseq.MIN_TIMESTEP
+                row[0] = str(timestamp)
+            f.write(",".join(row) + "\n")
+
+
+def _is_number(value:str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def legacy_parse(path:str) -> list[dict[str, int | float | bool]]:
+    """ Row by row parser, as used by stimseq before the column based parser
+
+    Args:
+        path (str): Path to the sequence file
+
+    Returns:
+        list[dict[str, int | float | bool]]: One dict per kept row
+    """
+    def type_convert(value:str, column:str) -> bool | int | float:
+        if stimseq.SEQUENCE_TYPES[column] == bool:
+            return bool(int(value))
+        return stimseq.SEQUENCE_TYPES[column](value)
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(filter(lambda line: not line.startswith('*'), f),
+                                fieldnames=stimseq.SEQUENCE_COLUMNS, skipinitialspace=True,
+                                restval="MISSING VAL", restkey="Comment")
+        tmp_seq:list[dict[str, int | float | bool]] = []
+        for row in reader:
+            if any(not _is_number(row[col]) for col in stimseq.SEQUENCE_COLUMNS):
+                continue
+            if not all(min(stimseq.AO_RANGE) <= int(row[key]) <= max(stimseq.AO_RANGE) for key in stimseq.AO_DATA_KEYS):
+                continue
+            if tmp_seq:
+                time_increment = stimseq.SEQUENCE_TYPES[stimseq.TIMESTAMP](row[stimseq.TIMESTAMP]) - tmp_seq[-1][stimseq.TIMESTAMP]
+                if time_increment < stimseq.MIN_TIMESTEP:
+                    continue
+            elif stimseq.SEQUENCE_TYPES[stimseq.TIMESTAMP](row[stimseq.TIMESTAMP]) <= 0:
+                row[stimseq.TIMESTAMP] = '0'
+            tmp_seq.append({col: type_convert(row[col], col) for col in stimseq.SEQUENCE_COLUMNS})
+    return tmp_seq
+
+
+def bench(sizes:list[int], invalid_rates:list[float], repeat:int) -> None:
+    """ Time both parsers on each size and print the results
+
+    Args:
+        sizes (list[int]): Number of rows of each generated file
+        invalid_rates (list[float]): Fraction of rows to skip for each reason in the generated files
+        repeat (int): Number of runs, best time is kept
+    """
+    print(f"{'rows':>10} {'invalid':>8} {'legacy (s)':>12} {'columns (s)':>12} {'speedup':>8} {'skipped':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size, invalid_rate in ((size, rate) for size in sizes for rate in invalid_rates):
+            path = os.path.join(tmp_dir, f"sequence_{size}_{invalid_rate}.csv")
+            generate_sequence_file(path, size, invalid_rate)
+
+            legacy_time = min(_timed(legacy_parse, path) for _ in range(repeat))
+            columns_time = min(_timed(stimseq._parse_sequence_file, path) for _ in range(repeat)) #pylint: disable=protected-access
+
+            # Both parsers must keep the same steps
+            legacy = legacy_parse(path)
+            sequence, report = stimseq._parse_sequence_file(path) #pylint: disable=protected-access
+            if len(legacy) != len(sequence) or [step[stimseq.TIMESTAMP] for step in legacy] != sequence.timestamps.tolist():
+                raise AssertionError(f"Parsers disagree on {path}")
+
+            print(f"{size:>10} {invalid_rate:>8} {legacy_time:>12.3f} {columns_time:>12.3f} {legacy_time / columns_time:>7.1f}x {len(report):>8}")
+
+
+def _timed(func, *args) -> float:
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help="Number of rows of the generated sequence files")
+    parser.add_argument('--invalid-rates', type=float, nargs='+', default=INVALID_RATES,
+                        help="Fraction of rows to skip for each reason in the generated files")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of runs per parser, best time is kept")
+    args = parser.parse_args()
+
+    bench(args.sizes, args.invalid_rates, args.repeat)
@@ -0,0 +1,119 @@
+#pylint: disable=line-too-long
+"""Benchmark of sequence plotting
+
+Compares, on generated sequences of increasing size, the time to display a sequence
+with the decimated plotter of the GUI and by plotting every step, then the time to
+redraw after a zoom. Figures are drawn with the Agg backend, without Tk.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import matplotlib
+matplotlib.use("Agg")
+
+#pylint: disable=wrong-import-position
+import matplotlib.pyplot as plot
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import stimseq
+import stimseq_plot
+
+# Number of steps of the generated sequences
+SIZES = [10_000, 100_000, 1_000_000]
+
+# Sequences above this size are not plotted point by point
+LEGACY_MAX_SIZE = 100_000
+
+
+def generate_sequence(n_steps:int, seed:int=0) -> stimseq.CompiledSequence:
+    """ Generate a sequence changing 1 or 2 outputs at every step
+
+    Args:
+        n_steps (int): Number of steps
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        stimseq.CompiledSequence: Generated sequence
+    """
+    rng = np.random.default_rng(seed)
+    do_values = np.zeros((n_steps, len(stimseq.DO_DATA_KEYS)), dtype=bool)
+    do_values[np.arange(n_steps), rng.integers(len(stimseq.DO_DATA_KEYS), size=n_steps)] = True
+    ao_values = rng.integers(min(stimseq.AO_RANGE), max(stimseq.AO_RANGE) + 1, size=(n_steps, len(stimseq.AO_DATA_KEYS)))
+    return stimseq._compile_sequence(np.arange(n_steps) * stimseq.MIN_TIMESTEP, ao_values, do_values) #pylint: disable=protected-access
+
+
+def legacy_plot(sequence:stimseq.CompiledSequence) -> float:
+    """ Plot every step of each column, as the GUI did before the decimated plotter
+
+    Returns:
+        float: Time in s to display the sequence
+    """
+    start = perf_counter()
+    figure, axes = plot.subplots(nrows=len(stimseq_plot.PLOT_COLUMNS), sharex=True)
+    do_values = sequence.do_values()
+    for ax, key in zip(axes, stimseq_plot.PLOT_COLUMNS):
+        if key in stimseq.DO_DATA_KEYS:
+            values = do_values[:, stimseq.DO_DATA_KEYS.index(key)]
+        else:
+            values = sequence.ao[:, stimseq.AO_DATA_KEYS.index(key)]
+        ax.plot(sequence.timestamps, values, 'bo-', drawstyle="steps-post")
+    figure.canvas.draw()
+    plot.close(figure)
+    return perf_counter() - start
+
+
+def decimated_plot(sequence:stimseq.CompiledSequence) -> tuple[float, float]:
+    """ Plot the sequence with the decimated plotter, then zoom on a tenth of it
+
+    Returns:
+        tuple[float, float]: Time in s to display the sequence, and to redraw after the zoom
+    """
+    start = perf_counter()
+    figure, axes = plot.subplots(nrows=len(stimseq_plot.PLOT_COLUMNS), sharex=True)
+    plotter = stimseq_plot.SequencePlotter(figure, axes)
+    plotter.set_sequence(sequence)
+    figure.canvas.draw()
+    display_time = perf_counter() - start
+
+    start = perf_counter()
+    axes[0].set_xlim(0, plotter.end_time / 10)
+    figure.canvas.draw()
+    zoom_time = perf_counter() - start
+    plot.close(figure)
+    return display_time, zoom_time
+
+
+def bench(sizes:list[int], legacy_max_size:int) -> None:
+    """ Time both plots on each size and print the results
+
+    Args:
+        sizes (list[int]): Number of steps of each generated sequence
+        legacy_max_size (int): Largest sequence plotted point by point
+    """
+    # Fonts are loaded by the first drawn text, not counted in the measures
+    figure = plot.figure()
+    figure.suptitle("warm up")
+    figure.canvas.draw()
+    plot.close(figure)
+
+    print(f"{'steps':>10} {'all points (s)':>15} {'decimated (s)':>15} {'zoom (s)':>10}")
+    for size in sizes:
+        sequence = generate_sequence(size)
+        legacy_time = f"{legacy_plot(sequence):.3f}" if size <= legacy_max_size else "-"
+        display_time, zoom_time = decimated_plot(sequence)
+        print(f"{size:>10} {legacy_time:>15} {display_time:>15.3f} {zoom_time:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help="Number of steps of the generated sequences")
+    parser.add_argument('--legacy-max-size', type=int, default=LEGACY_MAX_SIZE,
+                        help="Largest sequence plotted point by point")
+    args = parser.parse_args()
+
+    bench(args.sizes, args.legacy_max_size)
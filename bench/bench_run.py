@@ -0,0 +1,155 @@
+#pylint: disable=line-too-long
+"""Benchmark of sequence preparation and generation on the simulated DAQ
+
+Measures, for sequences of increasing size:
+- preparation: parsing the file, and loading it from the cache
+- channel init: from the call to run_sequence to waiting for the trigger
+- session re-arm: from loading the sequence in an opened StimSeqSession to waiting for the trigger
+- trigger latency: from the trigger signal to the first output transition
+- dispatch overhead: time between two steps sent back to back, without write latency
+- debug log cost: increase of the dispatch overhead when every step is logged at DEBUG level
+
+Runs without NI drivers or DAQ.
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+from time import perf_counter_ns
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+#pylint: disable=wrong-import-position
+import stimseq
+from stimseq_daq import SimulatedBackend
+
+# Number of steps of the generated sequences
+SIZES = [100, 1_000, 10_000, 100_000]
+
+
+def generate_sequence_file(path:str, n_steps:int, time_step:int) -> None:
+    """ Write a sequence file changing outputs at every step
+
+    Args:
+        path (str): Path of the file to write
+        n_steps (int): Number of steps
+        time_step (int): Time between steps in ms
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i in range(n_steps):
+            valves = ",".join("1" if (i + line) % 8 == 0 else "0" for line in range(8))
+            f.write(f"{i * time_step},{valves},{i % 5},{i % 2}\n")
+
+
+def dispatch_times(tmp_dir:str) -> np.ndarray:
+    """ Read and remove the last exported timing records
+
+    Args:
+        tmp_dir (str): Directory of the log file
+
+    Returns:
+        np.ndarray: Time in ns between the DO writes of consecutive steps
+    """
+    timing_file = max((f for f in os.listdir(tmp_dir) if "-timing-" in f),
+                      key=lambda f: os.path.getmtime(os.path.join(tmp_dir, f)))
+    records = np.loadtxt(os.path.join(tmp_dir, timing_file), delimiter=",", skiprows=1, dtype=np.int64, ndmin=2)
+    os.remove(os.path.join(tmp_dir, timing_file))
+    do_start = records[:, stimseq.TIMING_FIELDS.index(stimseq.TIMING_DO_START)]
+    return np.diff(do_start[do_start >= 0])
+
+
+def bench_size(tmp_dir:str, n_steps:int, write_latency:float) -> dict[str, float]:
+    """ Run the measures on one sequence size
+
+    Args:
+        tmp_dir (str): Directory for the sequence, cache and log files
+        n_steps (int): Number of steps
+        write_latency (float): Emulated write latency in ms
+
+    Returns:
+        dict[str, float]: Measures in ms
+    """
+    path = os.path.join(tmp_dir, f"sequence_{n_steps}.csv")
+    log_file = os.path.join(tmp_dir, "stimseq.log")
+    # Steps all due at the trigger, so they are sent back to back
+    generate_sequence_file(path, n_steps, time_step=0)
+
+    start = perf_counter_ns()
+    stimseq.StimSeq(path, log_file=log_file, log_lvl=logging.ERROR, use_cache=False)
+    parse_time = perf_counter_ns() - start
+
+    stimseq.StimSeq(path, log_file=log_file, log_lvl=logging.ERROR)
+    start = perf_counter_ns()
+    seq = stimseq.StimSeq(path, log_file=log_file, log_lvl=logging.ERROR,
+                          backend=(backend := SimulatedBackend(write_latency=write_latency)))
+    cache_time = perf_counter_ns() - start
+
+    start = perf_counter_ns()
+    seq.run_sequence(timing_report=True)
+
+    # Dispatch overhead from the exported timing records
+    dispatch = dispatch_times(tmp_dir)
+    trigger_latency = backend.transitions[0][0] - backend.trigger_ns
+    armed_ns = backend.armed_ns
+
+    # Same run with every step logged, console output discarded. Logging is restarted so the
+    # console handler writes to the discarded stderr, and stopped after the queued records are written
+    stimseq._stop_logging() #pylint: disable=protected-access
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stderr(devnull):
+        stimseq.StimSeq(path, log_file=log_file, log_lvl=logging.DEBUG,
+                        backend=SimulatedBackend(write_latency=write_latency)).run_sequence(timing_report=True)
+        stimseq._stop_logging() #pylint: disable=protected-access
+    dispatch_debug = dispatch_times(tmp_dir)
+
+    # Second run of an opened session, the sequence is loaded from the cache
+    with stimseq.StimSeqSession(path, log_file=log_file, log_lvl=logging.ERROR,
+                                backend=(backend := SimulatedBackend(write_latency=write_latency))) as session:
+        session.run_sequence()
+        rearm_start = perf_counter_ns()
+        session.seq_path = path
+        session.run_sequence()
+    rearm_time = backend.armed_ns - rearm_start
+
+    return {"parse": parse_time / 1e6,
+            "cache load": cache_time / 1e6,
+            "channel init": (armed_ns - start) / 1e6,
+            "session re-arm": rearm_time / 1e6,
+            "trigger latency": trigger_latency / 1e6,
+            "dispatch p50": float(np.median(dispatch)) / 1e6 if n_steps > 1 else 0,
+            "dispatch p99": float(np.percentile(dispatch, 99)) / 1e6 if n_steps > 1 else 0,
+            "debug log cost p50": float(np.median(dispatch_debug) - np.median(dispatch)) / 1e6 if n_steps > 1 else 0}
+
+
+def bench(sizes:list[int], write_latency:float) -> None:
+    """ Run the measures on each size and print the results
+
+    Args:
+        sizes (list[int]): Number of steps of each generated sequence
+        write_latency (float): Emulated write latency in ms
+    """
+    # Steps all at the same time are accepted for the measure of dispatch overhead
+    stimseq.MIN_TIMESTEP = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stimseq.CACHE_DIR = os.path.join(tmp_dir, "cache")
+        stimseq.TIMING_PROFILE_DIR = os.path.join(tmp_dir, "profiles")
+        results = {size: bench_size(tmp_dir, size, write_latency) for size in sizes}
+
+    names = list(results[sizes[0]])
+    print(f"{'steps':>10} " + " ".join(f"{name + ' (ms)':>20}" for name in names))
+    for size, result in results.items():
+        print(f"{size:>10} " + " ".join(f"{result[name]:>20.4f}" for name in names))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help="Number of steps of the generated sequences")
+    parser.add_argument('--write-latency', type=float, default=0,
+                        help="Emulated write latency of the DAQ, in ms")
+    args = parser.parse_args()
+
+    bench(args.sizes, args.write_latency)
@@ -0,0 +1,115 @@
+#pylint: disable=line-too-long
+"""Benchmark of StimSeq startup
+
+Measures the cold start of the entry points, each one in fresh interpreters, as the
+best wall time above the best start of an empty interpreter. Also checks that heavy
+dependencies are only loaded when needed:
+- tkinter: only by the GUI, or the CLI without --path
+- matplotlib: only by the GUI, once the sequence file is chosen
+- nidaqmx: only when a NidaqmxBackend opens its tasks
+
+Exits with status 1 when a start time is above its budget or when a heavy dependency
+is loaded, so it can be used to catch regressions.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Number of interpreters started for each measure
+REPEATS = 15
+
+# Prefix of the line listing the loaded heavy modules
+LOADED_PREFIX = "Loaded modules:"
+
+# Entry points, with the code run in a fresh interpreter and the startup budget in ms above an empty interpreter
+ENTRY_POINTS = {
+    "import stimseq": ("import stimseq", 200),
+    "stimseq.py --help": (f"import runpy, sys; sys.argv = ['stimseq.py', '--help']; runpy.run_path({os.path.join(SRC_DIR, 'stimseq.py')!r}, run_name='__main__')", 250),
+    "import stimseq_batch": ("import stimseq_batch", 200),
+    "import stimseq_gui": ("import stimseq_gui", 250),
+    "import stimseq_validate": ("import stimseq_validate", 200),
+}
+
+# Modules that must not be loaded by each entry point
+LAZY_MODULES = {
+    "import stimseq": ["tkinter", "matplotlib", "nidaqmx"],
+    "stimseq.py --help": ["tkinter", "matplotlib", "nidaqmx"],
+    "import stimseq_batch": ["tkinter", "matplotlib", "nidaqmx"],
+    "import stimseq_gui": ["matplotlib", "nidaqmx"],
+    "import stimseq_validate": ["tkinter", "matplotlib", "nidaqmx"],
+}
+
+
+def start_time(code:str, repeats:int) -> float:
+    """ Best wall time to run code in a fresh interpreter, the least disturbed by other processes
+
+    Args:
+        code (str): Code run with python -c
+        repeats (int): Number of interpreters started
+
+    Returns:
+        float: Time in ms
+    """
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((perf_counter() - start) * 1000)
+    return min(times)
+
+
+def loaded_modules(code:str, modules:list[str]) -> list[str]:
+    """ Modules loaded after running code in a fresh interpreter
+
+    Args:
+        code (str): Code run with python -c
+        modules (list[str]): Modules to look for
+
+    Returns:
+        list[str]: The modules of the list that were loaded
+    """
+    check = f"import sys\ntry:\n    {code}\nexcept SystemExit:\n    pass\nprint({LOADED_PREFIX!r} + ','.join(m for m in {modules!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], cwd=SRC_DIR, check=True, capture_output=True, text=True)
+    line = next(line for line in result.stdout.splitlines() if line.startswith(LOADED_PREFIX))
+    return [module for module in line.removeprefix(LOADED_PREFIX).split(",") if module]
+
+
+def bench(repeats:int, budget_scale:float) -> bool:
+    """ Measure each entry point and print the results
+
+    Args:
+        repeats (int): Number of interpreters started for each measure
+        budget_scale (float): Factor applied to the budgets, for slower machines
+
+    Returns:
+        bool: True if every entry point is within its budget and loads no heavy dependency
+    """
+    baseline = start_time("pass", repeats)
+    print(f"Empty interpreter: {baseline:.1f} ms")
+    print(f"{'entry point':>24} {'start (ms)':>11} {'budget (ms)':>12} {'heavy modules loaded':>22}")
+
+    success = True
+    for name, (code, budget) in ENTRY_POINTS.items():
+        elapsed = start_time(code, repeats) - baseline
+        loaded = loaded_modules(code, LAZY_MODULES[name])
+        budget *= budget_scale
+        ok = elapsed <= budget and not loaded
+        success &= ok
+        print(f"{name:>24} {elapsed:>11.1f} {budget:>12.0f} {', '.join(loaded) or '-':>22}{'' if ok else '  FAILED'}")
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help="Number of interpreters started for each measure")
+    parser.add_argument('--budget-scale', type=float, default=1,
+                        help="Factor applied to the startup budgets, for slower machines")
+    args = parser.parse_args()
+
+    sys.exit(0 if bench(args.repeats, args.budget_scale) else 1)
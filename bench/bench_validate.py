@@ -0,0 +1,64 @@
+#pylint: disable=line-too-long
+"""Benchmark of the validation of many sequence files
+
+Generates a directory of sequence files, and times their validation by
+stimseq_validate with a growing number of processes, as before an experimental day.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+#pylint: disable=wrong-import-position
+import stimseq_validate
+from bench_parser import generate_sequence_file
+
+# Number of generated sequence files
+FILES = 200
+
+# Number of rows of each generated sequence file
+ROWS = 20_000
+
+# Fraction of rows to skip for each reason
+INVALID_RATE = 0.01
+
+
+def bench(n_files:int, n_rows:int, jobs:list[int]) -> None:
+    """ Time the validation of the generated files with each number of processes and print the results
+
+    Args:
+        n_files (int): Number of generated sequence files
+        n_rows (int): Number of rows of each file
+        jobs (list[int]): Numbers of processes
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(n_files):
+            generate_sequence_file(os.path.join(directory, f"sequence_{i:04}.csv"), n_rows, INVALID_RATE, seed=i)
+        paths = stimseq_validate.find_sequence_files([directory])
+
+        print(f"{n_files} files of {n_rows} rows, {os.cpu_count()} processors")
+        print(f"{'processes':>10} {'time (s)':>10} {'speedup':>10}")
+        reference = None
+        for n_jobs in jobs:
+            start = perf_counter()
+            results = stimseq_validate.validate_files(paths, jobs=n_jobs)
+            duration = perf_counter() - start
+            assert len(results) == n_files and all(result.status != stimseq_validate.FAILED for result in results)
+            reference = reference or duration
+            print(f"{n_jobs:>10} {duration:>10.2f} {reference / duration:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=FILES,
+                        help="Number of generated sequence files")
+    parser.add_argument('--rows', type=int, default=ROWS,
+                        help="Number of rows of each file")
+    parser.add_argument('--jobs', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                        help="Numbers of processes to compare")
+    args = parser.parse_args()
+
+    bench(args.files, args.rows, args.jobs)
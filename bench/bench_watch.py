@@ -0,0 +1,107 @@
+#pylint: disable=line-too-long
+"""Benchmark of the reload of an edited sequence file
+
+Edits a generated sequence file in a few ways, and compares the time to show the
+edited sequence by parsing and plotting it whole, as "Change Sequence File", and by
+the file watch of the GUI: parsing again the changed rows and redrawing the changed
+time span. Figures are drawn with the Agg backend, without Tk.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+import matplotlib
+matplotlib.use("Agg")
+
+#pylint: disable=wrong-import-position
+import matplotlib.pyplot as plot
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import stimseq
+import stimseq_plot
+import stimseq_watch
+from bench_parser import generate_sequence_file
+
+# Number of rows of the generated sequence file
+ROWS = 200_000
+
+# Fraction of rows to skip for each reason
+INVALID_RATE = 0.01
+
+
+# Method to edit a row of the file, as a user saving it from an editor
+def edit_file(path:str, edit:str, rng:random.Random) -> None:
+    """ Edit a row in the middle of the file
+
+    Args:
+        path (str): Path of the sequence file
+        edit (str): "value", "insert", "delete" or "timestamp"
+        rng (random.Random): Random generator choosing the row
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = f.readlines()
+    row = len(lines) // 2 + rng.randrange(len(lines) // 4)
+    cells = lines[row].split(",")
+    if edit == "value":
+        cells[1] = str(1 - int(cells[1])) if cells[1] in ("0", "1") else "0"
+        lines[row] = ",".join(cells)
+    elif edit == "insert":
+        lines.insert(row, ",".join([str(int(cells[0]) - 1), *cells[1:]]))
+    elif edit == "delete":
+        del lines[row]
+    else:
+        lines[row] = ",".join([str(int(cells[0]) + stimseq.MIN_TIMESTEP), *cells[1:]])
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.writelines(lines)
+
+
+def bench(n_rows:int) -> None:
+    """ Time the full and the incremental reload of each edit and print the results
+
+    Args:
+        n_rows (int): Number of rows of the generated sequence file
+    """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sequence.csv")
+        generate_sequence_file(path, n_rows, INVALID_RATE)
+
+        figure, axes = plot.subplots(nrows=len(stimseq_plot.PLOT_COLUMNS), sharex=True)
+        plotter = stimseq_plot.SequencePlotter(figure, axes)
+        watcher = stimseq_watch.SequenceWatcher(path)
+        plotter.set_sequence(watcher.compiled)
+        figure.canvas.draw()
+
+        print(f"{n_rows} rows")
+        print(f"{'edit':>10} {'full reload (s)':>16} {'watch (s)':>10} {'rows validated':>15}")
+        for edit in ["value", "insert", "delete", "timestamp"]:
+            edit_file(path, edit, rng)
+
+            start = perf_counter()
+            sequence, _ = stimseq._parse_sequence_file(path) #pylint: disable=protected-access
+            full_figure, full_axes = plot.subplots(nrows=len(stimseq_plot.PLOT_COLUMNS), sharex=True)
+            stimseq_plot.SequencePlotter(full_figure, full_axes).set_sequence(sequence)
+            full_figure.canvas.draw()
+            full_time = perf_counter() - start
+            plot.close(full_figure)
+
+            start = perf_counter()
+            update = watcher.update()
+            if update.t_start is not None:
+                plotter.update_sequence(watcher.compiled, update.t_start, update.t_end)
+            watch_time = perf_counter() - start
+            print(f"{edit:>10} {full_time:>16.3f} {watch_time:>10.3f} {update.validated_rows:>15}")
+        plot.close(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=ROWS,
+                        help="Number of rows of the generated sequence file")
+    args = parser.parse_args()
+
+    bench(args.rows)
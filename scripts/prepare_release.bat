@@ -28,6 +28,17 @@ COPY start_stimseq_gui.bat ..\bin\start_stimseq_gui.bat
 COPY start_stimseq_no_gui.bat ..\bin\start_stimseq_no_gui.bat
 COPY ..\src\stimseq.py ..\bin\stimseq.py
 COPY ..\src\stimseq_gui.py ..\bin\stimseq_gui.py
+COPY ..\src\stimseq_plot.py ..\bin\stimseq_plot.py
+COPY ..\src\stimseq_daq.py ..\bin\stimseq_daq.py
+COPY ..\src\stimseq_batch.py ..\bin\stimseq_batch.py
+COPY ..\src\stimseq_protocol.py ..\bin\stimseq_protocol.py
+COPY ..\src\stimseq_multi.py ..\bin\stimseq_multi.py
+COPY ..\src\stimseq_render.py ..\bin\stimseq_render.py
+COPY ..\src\stimseq_acquire.py ..\bin\stimseq_acquire.py
+COPY ..\src\stimseq_watch.py ..\bin\stimseq_watch.py
+COPY ..\src\stimseq_calibrate.py ..\bin\stimseq_calibrate.py
+COPY ..\src\stimseq_async.py ..\bin\stimseq_async.py
+COPY ..\src\stimseq_validate.py ..\bin\stimseq_validate.py
 COPY ..\requirements.txt ..\bin\requirements.txt
 COPY ..\doc ..\bin\doc
 
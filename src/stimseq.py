@@ -2,17 +2,30 @@
 """_summary_
 """
 import argparse
+import atexit
+import ctypes
 import logging
 import os
+import queue
 import csv
+import hashlib
+import json
+import re
+import shutil
 
-# Import File Dialog
-from tkinter import Tk, filedialog
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime
+from time import perf_counter_ns, sleep
+from threading import Event, Thread
+from typing import TYPE_CHECKING, Callable, NamedTuple
 
-from time import sleep
+import numpy as np
 
-import nidaqmx as ni
-from nidaqmx.constants import LineGrouping, VoltageUnits
+from stimseq_daq import DaqBackend, NidaqmxBackend
+
+if TYPE_CHECKING:
+    from stimseq_acquire import Acquisition
 
 VERSION = "V1.0"
 COMPAT_MODELS = "USB-6001, USB-6002, USB-6003"
@@ -26,6 +39,20 @@ LOG_LEVELS = {"DEBUG": logging.DEBUG,
               "ERROR": logging.ERROR,
               "CRITICAL": logging.CRITICAL}
 LOG_FILE = "stimseq.log"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOGGER_NAME = 'my_logger'
+
+# Const for the cache of parsed sequences
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".stimseq_cache")
+CACHE_MAX_SIZE = 1024**3  # Size in bytes above which least recently used sequences are removed
+CACHE_VERSION = 1  # To increment when the cache format changes
+
+# Const for timing profiles of calibrated devices, see stimseq_calibrate
+TIMING_PROFILE_DIR = os.path.join(os.path.dirname(__file__), "timing_profiles")
+TIMING_PROFILE_VERSION = 1  # To increment when the profile format changes
+
+# Extension of procedural sequence definitions, see stimseq_protocol
+PROTOCOL_EXTENSION = ".toml"
 
 #########################
 # Const for csv parsing #
@@ -47,12 +74,35 @@ SEQUENCE_COLUMNS = [
     PIEZO := "Piezo",
 ]
 
-# Minimum accepted increment between time steps
+# Minimum accepted increment between time steps, for devices without a timing profile
 MIN_TIMESTEP = 50
 
 # Timeout for write operations to the DAQ
 WRITE_TIMEOUT = 10
 
+# Const for step scheduling
+SPIN_WINDOW = 2  # Time in ms before a step during which the wait is a busy loop instead of a sleep
+LATE_TOLERANCE = 5  # Time in ms after which a step is considered late
+CANCEL_CHECK_INTERVAL = 10  # Longest time in ms a wait sleeps without checking for cancellation
+PROGRESS_INTERVAL = 50  # Minimum time in ms between two progress messages of a run
+
+# Records of the timing report, one row per step, times in ns from the trigger (-1 if not sent)
+TIMING_FIELDS = [
+    TIMING_SCHEDULED := "scheduled",
+    TIMING_DO_START := "do_start",
+    TIMING_DO_END := "do_end",
+    TIMING_AO_START := "ao_start",
+    TIMING_AO_END := "ao_end",
+]
+TIMING_HISTOGRAM_BINS = [0, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, np.inf]  # Lateness histogram bins, in ms
+
+# Handling of late steps
+LATE_POLICIES = [
+    LATE_CATCH_UP := "catch-up",  # Late steps are sent as soon as possible
+    LATE_SKIP := "skip",  # Late steps are not sent, outputs keep their previous state until the next step
+    LATE_ABORT := "abort",  # The sequence is stopped and outputs are reset to 0
+]
+
 # Type convertions for each column
 # OUTPUT_ADDITION_SECTION
 SEQUENCE_TYPES = {
@@ -78,6 +128,19 @@ AO_DATA_KEYS = [key for key in SEQUENCE_COLUMNS if SEQUENCE_TYPES[key] == float]
 # Acceptable range for AO data
 AO_RANGE = [-10, 10]
 
+# Reasons for skipping a row of the sequence file, rows are reported with the index of their reason
+SKIP_REASONS = [
+    SKIP_INVALID_VALUE := "an invalid value was found",
+    SKIP_AO_RANGE := f"Analog Output data is out of range (min: {min(AO_RANGE)}, max: {max(AO_RANGE)})",
+    SKIP_TIMESTEP := "time increment with previous steps is below the minimum time step",
+]
+
+# Maximum sample rate for hardware timed AO generation, in samples per second per channel
+AO_MAX_SAMPLE_RATE = 5000
+
+# Number of samples per channel sent at once to the DAQ when streaming a hardware timed AO waveform
+AO_BUFFER_SIZE = 50000
+
 # Name of the DAQ as defined in NI MAX
 DAQ_NAME = "Dev1"
 
@@ -91,22 +154,1096 @@ DAQ_WIRING = [
     HEARBIT_DO := f"{DAQ_NAME}/port1/line1",
 ]
 
+# Terminal used as start trigger for hardware timed AO generation.
+# On USB-600x, PFI0 is the same terminal as P2.0 (TTL_DI), both must be changed together
+TTL_PFI = f"/{DAQ_NAME}/PFI0"
+
+# Columns sent on each digital output wiring, in line order
+# OUTPUT_ADDITION_SECTION
+DO_WIRING = {
+    VALVES_DO: [VALVE1, VALVE2, VALVE3, VALVE4, VALVE5, VALVE6, VALVE7, VALVE8],
+    PIEZO_DO: [PIEZO],
+}
+
 
-# Method to check if string contains a number
-def _is_number(value:str) -> bool:
-    """ Method to check if string contains a number
+# Method to get port and line numbers from a physical lines string
+def _port_lines(physical_lines:str) -> list[tuple[int, int]]:
+    """ Method to get port and line numbers from a physical lines string
+
+    Args:
+        physical_lines (str): physical lines, ex: "Dev1/port0/line0:7"
+
+    Returns:
+        list[tuple[int, int]]: (port, line) for each line, in order
+    """
+    match = re.fullmatch(r".*/port(\d+)/line(\d+)(?::(\d+))?", physical_lines)
+    if match is None:
+        raise ValueError(f"{physical_lines} is not a digital line")
+    port, first, last = int(match[1]), int(match[2]), int(match[3] or match[2])
+    step = 1 if last >= first else -1
+    return [(port, line) for line in range(first, last + step, step)]
+
+
+# (port, line) of each DO column and of the heartbeat, used to pack DO data into one word per port
+DO_LINES = {key: line for wiring, keys in DO_WIRING.items() for key, line in zip(keys, _port_lines(wiring), strict=True)}
+HEARTBEAT_LINE = _port_lines(HEARBIT_DO)[0]
+DO_PORTS = sorted({port for port, _ in [*DO_LINES.values(), HEARTBEAT_LINE]})
+
+
+# Method to use the wiring of DAQ_NAME on another device wired the same way
+def _device_channel(channel:str, device:str) -> str:
+    """ Replace DAQ_NAME by another device in a physical channel or terminal
+
+    Args:
+        channel (str): Physical channel or terminal of DAQ_NAME, ex: "Dev1/ao0" or "/Dev1/PFI0"
+        device (str): Name of the device as defined in NI MAX
+
+    Returns:
+        str: The same channel on the device
+    """
+    return re.sub(rf"^(/?){re.escape(DAQ_NAME)}/", lambda match: f"{match[1]}{device}/", channel)
+
+
+# Kinds of channels added to the DAQ tasks for a run
+CHANNEL_KINDS = [
+    CHANNEL_DO := "do",
+    CHANNEL_AO := "ao",
+    CHANNEL_TRIGGER := "trigger",
+]
+
+
+# Method to get the channels of a run on a device
+def _channel_wiring(device:str, enable_heartbeat:bool=True) -> list[tuple[str, str, str]]:
+    """ Channels added to the DAQ tasks for a run, one DO channel per port
+
+    Args:
+        device (str): Name of the device as defined in NI MAX
+        enable_heartbeat (bool, optional): Add the heartbeat line to its DO port. Defaults to True.
+
+    Returns:
+        list[tuple[str, str, str]]: Kind (one of CHANNEL_KINDS), physical channel and name of each channel, in order
+    """
+    channels = []
+    for port in DO_PORTS:
+        lines = [line for key, (key_port, line) in DO_LINES.items() if key_port == port]
+        if enable_heartbeat and HEARTBEAT_LINE[0] == port:
+            lines.append(HEARTBEAT_LINE[1])
+        channels.append((CHANNEL_DO, ",".join(f"{device}/port{port}/line{line}" for line in sorted(lines)), f"Port{port}"))
+    # OUTPUT_ADDITION_SECTION
+    channels.append((CHANNEL_AO, _device_channel(LED_AO, device), "LED"))
+    channels.append((CHANNEL_TRIGGER, _device_channel(TTL_DI, device), "TTL IN"))
+    return channels
+
+
+class CompiledSequence(NamedTuple):
+    """ Columnar representation of a parsed sequence, built once and used for generation
+
+    Attributes:
+        timestamps (np.ndarray): Timestamp of each step in ms, int64 of shape (steps,)
+        ao (np.ndarray): AO values, float64 of shape (steps, len(AO_DATA_KEYS))
+        do_ports (np.ndarray): DO values packed in one word per port (bit n is line n),
+            uint32 of shape (steps, len(DO_PORTS)). Heartbeat bit is not set.
+    """
+    timestamps: np.ndarray
+    ao: np.ndarray
+    do_ports: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def time_increments(self) -> np.ndarray:
+        """ Time to wait before each step in ms, the first one is counted from the trigger """
+        return np.diff(self.timestamps, prepend=0)
+
+    def do_values(self) -> np.ndarray:
+        """ Unpack DO values
+
+        Returns:
+            np.ndarray: bool array of shape (steps, len(DO_DATA_KEYS))
+        """
+        values = np.empty((len(self), len(DO_DATA_KEYS)), dtype=bool)
+        for i, key in enumerate(DO_DATA_KEYS):
+            port, line = DO_LINES[key]
+            values[:, i] = (self.do_ports[:, DO_PORTS.index(port)] >> line) & 1
+        return values
+
+
+def _compile_sequence(timestamps:np.ndarray, ao_values:np.ndarray, do_values:np.ndarray) -> CompiledSequence:
+    """ Build the columnar representation of a sequence
+
+    Args:
+        timestamps (np.ndarray): Timestamp of each step in ms, of shape (steps,)
+        ao_values (np.ndarray): AO values of each step in AO_DATA_KEYS order, of shape (steps, len(AO_DATA_KEYS))
+        do_values (np.ndarray): DO values of each step in DO_DATA_KEYS order, of shape (steps, len(DO_DATA_KEYS))
+
+    Returns:
+        CompiledSequence: Compiled sequence
+    """
+    n_steps = len(timestamps)
+    do_array = np.asarray(do_values, dtype=np.uint32).reshape(n_steps, len(DO_DATA_KEYS))
+    do_ports = np.zeros((n_steps, len(DO_PORTS)), dtype=np.uint32)
+    for i, key in enumerate(DO_DATA_KEYS):
+        port, line = DO_LINES[key]
+        do_ports[:, DO_PORTS.index(port)] |= do_array[:, i] << np.uint32(line)
+
+    return CompiledSequence(timestamps=np.asarray(timestamps, dtype=np.int64).reshape(n_steps),
+                            ao=np.asarray(ao_values, dtype=np.float64).reshape(n_steps, len(AO_DATA_KEYS)),
+                            do_ports=do_ports)
+
+
+class DispatchPlan(NamedTuple):
+    """ Steps of a compiled sequence to send, with the tasks to write at each one
+
+    Steps changing no output are merged with the previous one, and a task is only
+    written at steps changing its outputs.
+
+    Attributes:
+        steps (np.ndarray): Index in the compiled sequence of each dispatched step, int64 of shape (dispatched,)
+        timestamps (np.ndarray): Timestamp of each dispatched step in ms, int64 of shape (dispatched,)
+        do_ports (np.ndarray): DO port words, with the heartbeat bit if enabled, uint32 of shape (dispatched, len(DO_PORTS))
+        ao (np.ndarray): AO values, float64 of shape (dispatched, len(AO_DATA_KEYS))
+        write_do (np.ndarray): True at steps where DO must be written, bool of shape (dispatched,)
+        write_ao (np.ndarray): True at steps where AO must be written, bool of shape (dispatched,)
+        sequence_steps (int): Number of steps of the compiled sequence
+        include_ao (bool): False if AO are not sent step by step (hardware timed AO)
+    """
+    steps: np.ndarray
+    timestamps: np.ndarray
+    do_ports: np.ndarray
+    ao: np.ndarray
+    write_do: np.ndarray
+    write_ao: np.ndarray
+    sequence_steps: int
+    include_ao: bool
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def stats(self) -> dict[str, int]:
+        """ Writes and bytes saved compared to writing every task at every step
+
+        Returns:
+            dict[str, int]: Number of steps, writes and bytes of the plan, and saved by it
+        """
+        do_bytes = self.do_ports.shape[1] * self.do_ports.itemsize
+        ao_bytes = self.ao.shape[1] * self.ao.itemsize if self.include_ao else 0
+        do_writes = int(np.count_nonzero(self.write_do))
+        ao_writes = int(np.count_nonzero(self.write_ao))
+        full_writes = self.sequence_steps * (2 if self.include_ao else 1)
+        return {"steps": self.sequence_steps,
+                "dispatched_steps": len(self),
+                "do_writes": do_writes,
+                "ao_writes": ao_writes,
+                "writes_saved": full_writes - do_writes - ao_writes,
+                "bytes_saved": self.sequence_steps * (do_bytes + ao_bytes) - do_writes * do_bytes - ao_writes * ao_bytes}
+
+
+# Method to plan the writes of a sequence
+def _plan_dispatch(sequence:CompiledSequence, enable_heartbeat:bool=True, include_ao:bool=True) -> DispatchPlan:
+    """ Merge steps changing no output, and mark the tasks to write at each step
+
+    Both tasks are written at the first step. The heartbeat bit toggles at every DO
+    write, starting high, so it does not force writes of unchanged DO.
+
+    Args:
+        sequence (CompiledSequence): Compiled sequence
+        enable_heartbeat (bool, optional): Set the heartbeat bit on DO words. Defaults to True.
+        include_ao (bool, optional): AO are sent step by step, False for hardware timed AO. Defaults to True.
+
+    Returns:
+        DispatchPlan: Steps to send
+    """
+    n_steps = len(sequence)
+    do_changed = np.ones(n_steps, dtype=bool)
+    do_changed[1:] = np.any(sequence.do_ports[1:] != sequence.do_ports[:-1], axis=1)
+    ao_changed = np.zeros(n_steps, dtype=bool)
+    if include_ao:
+        ao_changed[0] = True
+        ao_changed[1:] = np.any(sequence.ao[1:] != sequence.ao[:-1], axis=1)
+
+    steps = np.flatnonzero(do_changed | ao_changed)
+    write_do = do_changed[steps]
+    do_ports = sequence.do_ports[steps]
+    if enable_heartbeat:
+        # Heartbeat is high after odd numbers of DO writes, and kept at steps only writing AO
+        port, line = HEARTBEAT_LINE
+        high = np.cumsum(write_do) % 2 == 1
+        do_ports[high, DO_PORTS.index(port)] |= np.uint32(1 << line)
+
+    return DispatchPlan(steps=steps, timestamps=sequence.timestamps[steps], do_ports=do_ports, ao=sequence.ao[steps],
+                        write_do=write_do, write_ao=ao_changed[steps], sequence_steps=n_steps, include_ao=include_ao)
+
+
+# Method to convert a string to a number
+def _to_float(value:str) -> float:
+    """ Method to convert a string to a number
 
     Args:
         value (str): input string
 
     Returns:
-        bool: Returns True if string represent a number.
+        float: The number, NaN if the string does not represent a number.
     """
     try:
-        float(value)
+        return float(value)
     except ValueError:
-        return False
-    return True
+        return np.nan
+
+
+class ValidationReport(NamedTuple):
+    """ Rows skipped while parsing a sequence file
+
+    Attributes:
+        rows (np.ndarray): Index of each skipped row, counted like csv.DictReader (comments and empty lines excluded)
+        reasons (np.ndarray): Index in SKIP_REASONS of the reason each row was skipped
+        first_timestamp_forced (bool): True if the first valid row had a negative timestamp, forced to 0
+    """
+    rows: np.ndarray
+    reasons: np.ndarray
+    first_timestamp_forced: bool = False
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def skipped_rows(self, reason:str) -> np.ndarray:
+        """ Index of the rows skipped for a reason
+
+        Args:
+            reason (str): One of SKIP_REASONS
+
+        Returns:
+            np.ndarray: Row indexes
+        """
+        return self.rows[self.reasons == SKIP_REASONS.index(reason)]
+
+    def summary(self) -> str:
+        """ One line summary of the skipped rows, grouped by reason """
+        counts = [f"{len(self.skipped_rows(reason))} because {reason}" for reason in SKIP_REASONS
+                  if len(self.skipped_rows(reason))]
+        return f"Skipped {len(self)} rows" + (f": {', '.join(counts)}" if counts else "")
+
+
+def _read_sequence_lines(path:str) -> list[str]:
+    """ Read the rows of a sequence file, skipping comments and empty lines
+
+    Args:
+        path (str): Path to the sequence file
+
+    Returns:
+        list[str]: One line per row
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [line for line in f if not line.startswith('*') and line.strip('\r\n')]
+
+
+def _read_sequence_values(path:str) -> np.ndarray:
+    """ Read the values of the sequence columns, skipping comments and empty lines
+
+    Args:
+        path (str): Path to the sequence file
+
+    Returns:
+        np.ndarray: Values of shape (rows, len(SEQUENCE_COLUMNS)). Missing or invalid values are NaN.
+    """
+    return _parse_sequence_lines(_read_sequence_lines(path))
+
+
+def _parse_sequence_lines(lines:list[str]) -> np.ndarray:
+    """ Convert rows of a sequence file to the values of the sequence columns
+
+    Args:
+        lines (list[str]): Rows, without comments and empty lines
+
+    Returns:
+        np.ndarray: Values of shape (rows, len(SEQUENCE_COLUMNS)). Missing or invalid values are NaN.
+    """
+    n_columns = len(SEQUENCE_COLUMNS)
+    if not lines:
+        return np.empty((0, n_columns), dtype=np.float64)
+
+    # Fast path, the whole file is converted at once when every value is valid
+    try:
+        return np.loadtxt(lines, delimiter=',', usecols=range(n_columns), dtype=np.float64,
+                          comments=None, quotechar='"', ndmin=2)
+    except ValueError:
+        pass
+
+    # Column by column conversion, cell by cell only for the columns holding invalid values
+    rows = [row[:n_columns] if len(row) >= n_columns else row + [""] * (n_columns - len(row))
+            for row in csv.reader(lines, skipinitialspace=True)]
+    values = np.empty((len(rows), n_columns), dtype=np.float64)
+    for col, cells in enumerate(zip(*rows)):
+        try:
+            values[:, col] = np.array(cells, dtype=np.float64)
+        except ValueError:
+            values[:, col] = [_to_float(value) for value in cells]
+    return values
+
+
+def _parse_sequence_file(path:str, min_timestep:int|None=None) -> tuple[CompiledSequence, ValidationReport]:
+    """ Parse and validate a sequence file, column by column
+
+    Rows are skipped when a value is not a number, when an AO value is out of AO_RANGE,
+    or when the time increment with the previous kept row is below the minimum time step.
+    A negative timestamp on the first kept row is forced to 0.
+
+    Args:
+        path (str): Path to the sequence file
+        min_timestep (int | None, optional): Minimum time step in ms, ex: from the timing profile of the device.
+            Defaults to MIN_TIMESTEP.
+
+    Returns:
+        tuple[CompiledSequence, ValidationReport]: The valid steps and the skipped rows
+    """
+    return _validate_values(_read_sequence_values(path), min_timestep=min_timestep)
+
+
+def _validate_values(values:np.ndarray, last_timestamp:int|None=None, first_row:int=0,
+                     min_timestep:int|None=None) -> tuple[CompiledSequence, ValidationReport]:
+    """ Validate rows of a sequence, column by column, see _parse_sequence_file for the rules
+
+    Rows can be validated in consecutive chunks, each one checked against the last kept step of the previous ones.
+
+    Args:
+        values (np.ndarray): float64 array of shape (rows, len(SEQUENCE_COLUMNS)), NaN for invalid values
+        last_timestamp (int | None, optional): Timestamp of the last kept step before these rows,
+            None if they start the sequence. Defaults to None.
+        first_row (int, optional): Index of the first row in the sequence, for the report. Defaults to 0.
+        min_timestep (int | None, optional): Minimum time step in ms. Defaults to MIN_TIMESTEP.
+
+    Returns:
+        tuple[CompiledSequence, ValidationReport]: The valid steps and the skipped rows
+    """
+    min_timestep = MIN_TIMESTEP if min_timestep is None else min_timestep
+    ts_col = SEQUENCE_COLUMNS.index(TIMESTAMP)
+    ao_cols = [SEQUENCE_COLUMNS.index(key) for key in AO_DATA_KEYS]
+    do_cols = [SEQUENCE_COLUMNS.index(key) for key in DO_DATA_KEYS]
+
+    # Reason for skipping each row, -1 for kept rows
+    reasons = np.full(len(values), -1, dtype=np.int8)
+    invalid = ~np.isfinite(values).all(axis=1) | (values[:, ts_col] != np.trunc(values[:, ts_col]))
+    reasons[invalid] = SKIP_REASONS.index(SKIP_INVALID_VALUE)
+    out_of_range = ((values[:, ao_cols] < min(AO_RANGE)) | (values[:, ao_cols] > max(AO_RANGE))).any(axis=1)
+    reasons[~invalid & out_of_range] = SKIP_REASONS.index(SKIP_AO_RANGE)
+
+    timestamps = np.zeros(len(values), dtype=np.int64)
+    candidates = np.flatnonzero(reasons < 0)
+    timestamps[candidates] = values[candidates, ts_col]
+
+    # Force 0 if first valid row has a negative Timestep
+    first_timestamp_forced = bool(last_timestamp is None and len(candidates) and timestamps[candidates[0]] <= 0)
+    if first_timestamp_forced:
+        timestamps[candidates[0]] = 0
+
+    # Check Time Steps Validity against the previous kept row.
+    # Each skipped row changes the reference of the next one, so rows after
+    # the first too small increment are checked one by one
+    if last_timestamp is None:
+        reference = timestamps[candidates]
+        checked = candidates[1:]
+    else:
+        reference = np.concatenate(([last_timestamp], timestamps[candidates]))
+        checked = candidates
+    too_small = np.flatnonzero(np.diff(reference) < min_timestep)
+    if len(too_small):
+        kept_ts = reference[too_small[0]]
+        for row in checked[too_small[0]:].tolist():
+            if timestamps[row] - kept_ts < min_timestep:
+                reasons[row] = SKIP_REASONS.index(SKIP_TIMESTEP)
+            else:
+                kept_ts = timestamps[row]
+
+    kept = reasons < 0
+    sequence = _compile_sequence(timestamps=timestamps[kept],
+                                 ao_values=values[kept][:, ao_cols],
+                                 do_values=values[kept][:, do_cols] != 0)
+    report = ValidationReport(rows=first_row + np.flatnonzero(~kept), reasons=reasons[~kept],
+                              first_timestamp_forced=first_timestamp_forced)
+    return sequence, report
+
+
+# Arrays saved for each cached sequence
+_CACHE_ARRAYS = ["timestamps", "ao", "do_ports", "rows", "reasons", "first_timestamp_forced"]
+
+
+def _cache_key(path:str, min_timestep:int) -> str:
+    """ Key of a sequence file in the cache
+
+    The key depends on the file content and on the parsing configuration, so
+    any change to either gives a new key.
+
+    Args:
+        path (str): Path to the sequence file
+        min_timestep (int): Minimum time step the file is validated against
+
+    Returns:
+        str: Hexadecimal key
+    """
+    config = repr((CACHE_VERSION, SEQUENCE_COLUMNS, {key: type_.__name__ for key, type_ in SEQUENCE_TYPES.items()},
+                   min_timestep, AO_RANGE, DO_LINES, DO_PORTS))
+    digest = hashlib.blake2b(config.encode(), digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024**2):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_load(key:str) -> tuple[CompiledSequence, ValidationReport] | None:
+    """ Load a parsed sequence from the cache, arrays are memory mapped
+
+    Args:
+        key (str): Key of the sequence file
+
+    Returns:
+        tuple[CompiledSequence, ValidationReport] | None: The cached sequence and report, None if not in cache
+    """
+    entry = os.path.join(CACHE_DIR, key)
+    if not os.path.isdir(entry):
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode='r') for name in _CACHE_ARRAYS}
+        # Mark entry as recently used
+        os.utime(entry)
+    except (OSError, ValueError):
+        # Invalid entry, it will be replaced
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    return (CompiledSequence(timestamps=arrays["timestamps"], ao=arrays["ao"], do_ports=arrays["do_ports"]),
+            ValidationReport(rows=arrays["rows"], reasons=arrays["reasons"],
+                             first_timestamp_forced=bool(arrays["first_timestamp_forced"])))
+
+
+def _cache_store(key:str, sequence:CompiledSequence, report:ValidationReport) -> None:
+    """ Save a parsed sequence to the cache, then remove least recently used sequences above CACHE_MAX_SIZE
+
+    Args:
+        key (str): Key of the sequence file
+        sequence (CompiledSequence): The parsed sequence
+        report (ValidationReport): Its validation report
+    """
+    arrays = {**sequence._asdict(), "rows": report.rows, "reasons": report.reasons,
+              "first_timestamp_forced": np.array(report.first_timestamp_forced)}
+
+    # Write to a temporary directory then rename it, so an entry is either complete or missing
+    entry = os.path.join(CACHE_DIR, key)
+    tmp_entry = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(tmp_entry, exist_ok=True)
+    try:
+        for name in _CACHE_ARRAYS:
+            np.save(os.path.join(tmp_entry, f"{name}.npy"), arrays[name])
+        os.replace(tmp_entry, entry)
+    except OSError:
+        # Entry already stored by another process
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    _cache_evict()
+
+
+def _cache_evict() -> None:
+    """ Remove least recently used sequences until the cache is below CACHE_MAX_SIZE """
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_dir() and not entry.name.endswith(".tmp"):
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= CACHE_MAX_SIZE:
+            break
+        # Entries memory mapped by another process may not be removable, they stay for now
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            total_size -= size
+
+
+def _ao_waveform(sequence:CompiledSequence, sample_rate:float,
+                 first_sample:int=0, last_sample:int|None=None) -> np.ndarray:
+    """ Expand AO steps into a sampled waveform for hardware timed generation
+
+    Each sample holds the value of the last step started at its time. The waveform
+    lasts until the outputs reset (one last time step after the last step) and its
+    last sample is 0 for every channel.
+
+    Args:
+        sequence (CompiledSequence): The sequence to expand
+        sample_rate (float): Sample rate of the waveform, in samples per second
+        first_sample (int, optional): Index of the first sample to compute. Defaults to 0.
+        last_sample (int | None, optional): Index after the last sample to compute. Defaults to the whole waveform.
+
+    Returns:
+        np.ndarray: Waveform with one row per AO channel
+    """
+    n_samples = _ao_waveform_size(sequence, sample_rate)
+    last_sample = n_samples if last_sample is None else min(last_sample, n_samples)
+    step_index = _sample_steps(sequence.timestamps, sample_rate, first_sample, last_sample)
+
+    waveform = np.zeros((sequence.ao.shape[1], len(step_index)), dtype=np.float64)
+    active = step_index >= 0
+    waveform[:, active] = sequence.ao[step_index[active]].T
+
+    # Outputs are reset to 0 with the last sample
+    if last_sample == n_samples and len(step_index):
+        waveform[:, -1] = 0
+    return waveform
+
+
+# Method to find the step active at each sample of a waveform
+def _sample_steps(timestamps:np.ndarray, sample_rate:float, first_sample:int, last_sample:int) -> np.ndarray:
+    """ Index of the step active at each sample time, the last step started at or before it
+
+    Args:
+        timestamps (np.ndarray): Timestamp of each step in ms, sorted
+        sample_rate (float): Sample rate of the waveform, in samples per second
+        first_sample (int): Index of the first sample
+        last_sample (int): Index after the last sample
+
+    Returns:
+        np.ndarray: Step index of each sample, -1 before the first step
+    """
+    sample_times = np.arange(first_sample, last_sample, dtype=np.float64) * 1000 / sample_rate
+    return np.searchsorted(timestamps, sample_times, side='right') - 1
+
+
+def _ao_waveform_size(sequence:CompiledSequence, sample_rate:float) -> int:
+    """ Number of samples per channel of the hardware timed AO waveform, and of rendered timelines (see stimseq_render)
+
+    Args:
+        sequence (CompiledSequence): The sequence to expand
+        sample_rate (float): Sample rate of the waveform, in samples per second
+
+    Returns:
+        int: Number of samples, including the final reset sample
+    """
+    end_time = sequence.timestamps[-1] + sequence.time_increments[-1]
+    return round(end_time * sample_rate / 1000) + 1
+
+
+class SequenceAbortedError(RuntimeError):
+    """ Raised when a sequence is stopped before its end """
+
+
+class RunTiming(NamedTuple):
+    """ Timing of the last completed run
+
+    Attributes:
+        start_ns (int): Reference of the step deadlines, perf_counter_ns of the trigger or of the shared start
+        first_write_ns (int | None): End of the first write, None if no step was sent
+        first_write_lateness (float | None): Lateness of the first write in ms, from its scheduled time to its end
+        late_steps (int): Number of steps later than LATE_TOLERANCE
+        max_lateness (float): Maximum lateness in ms
+        summary (dict | None): Timing summary of TimingRecorder, None without timing report
+        iterations (int): Number of iterations of the sequence started, the last one is stopped by the cancel event when looping until cancelled
+    """
+    start_ns: int
+    first_write_ns: int | None
+    first_write_lateness: float | None
+    late_steps: int
+    max_lateness: float
+    summary: dict | None
+    iterations: int = 1
+
+
+class Progress(NamedTuple):
+    """ Progress of a run, sent at most every PROGRESS_INTERVAL
+
+    Attributes:
+        steps_done (int): Number of steps of the sequence passed, sent or merged
+        steps (int): Number of steps of the sequence
+        time (float): Time of the last sent step in ms from the trigger
+        lateness (float): Lateness of the last sent step in ms
+        late_steps (int): Number of steps later than LATE_TOLERANCE so far
+        max_lateness (float): Maximum lateness so far in ms
+        iteration (int): Index of the iteration of a looped sequence, from 0
+    """
+    steps_done: int
+    steps: int
+    time: float
+    lateness: float
+    late_steps: int
+    max_lateness: float
+    iteration: int = 0
+
+
+@contextmanager
+def _high_priority(enabled:bool=True):
+    """ Raise the scheduling priority of the current thread, restored on exit
+
+    Priority is raised on a best effort basis, failure is not an error.
+
+    Args:
+        enabled (bool, optional): Priority is left unchanged if False. Defaults to True.
+
+    Yields:
+        bool: True if priority was raised
+    """
+    if not enabled:
+        yield False
+        return
+
+    if os.name == "nt":
+        kernel32 = ctypes.windll.kernel32
+        winmm = ctypes.windll.winmm
+        thread = kernel32.GetCurrentThread()
+        previous = kernel32.GetThreadPriority(thread)
+        # 1 ms timer resolution for sleep, and THREAD_PRIORITY_TIME_CRITICAL
+        winmm.timeBeginPeriod(1)
+        raised = bool(kernel32.SetThreadPriority(thread, 15))
+        try:
+            yield raised
+        finally:
+            kernel32.SetThreadPriority(thread, previous)
+            winmm.timeEndPeriod(1)
+        return
+
+    try:
+        previous_policy = os.sched_getscheduler(0)
+        previous_param = os.sched_getparam(0)
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+    except (AttributeError, OSError):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        os.sched_setscheduler(0, previous_policy, previous_param)
+
+
+# Method to run an acquisition around a run, see stimseq_acquire
+@contextmanager
+def _acquiring(acquisition:"Acquisition | None", daq:DaqBackend, device:str, sequence:str,
+               logger:logging.Logger|logging.LoggerAdapter):
+    """ Start an acquisition before the run and stop it after the outputs are reset
+
+    Args:
+        acquisition (Acquisition | None): The acquisition, None to run without
+        daq (DaqBackend): Opened backend, with its channels configured
+        device (str): Device of the run
+        sequence (str): Path of the run sequence
+        logger (logging.Logger | logging.LoggerAdapter): Logger of the run
+    """
+    if acquisition is None:
+        yield
+        return
+    acquisition.start(daq, device=device, sequence=sequence, logger=logger)
+    try:
+        yield
+    finally:
+        acquisition.stop()
+
+
+class DeadlineScheduler():
+    """ Wait for steps at absolute deadlines, measured from a start time
+
+    Each wait sleeps until SPIN_WINDOW before the deadline then busy loops, so
+    errors of a step do not add up on the following ones. Sleeps are cut in slices
+    of CANCEL_CHECK_INTERVAL to stop the wait when the cancel event is set.
+    """
+    def __init__(self, spin_window:float=SPIN_WINDOW, late_policy:str=LATE_CATCH_UP,
+                 late_tolerance:float=LATE_TOLERANCE, cancel_event:Event|None=None) -> None:
+        if late_policy not in LATE_POLICIES:
+            raise ValueError(f"Late policy must be one of {LATE_POLICIES}, got {late_policy}")
+
+        self.__spin_window_ns = int(spin_window * 1e6)
+        self.__late_policy = late_policy
+        self.__late_tolerance_ns = int(late_tolerance * 1e6)
+        self.__cancel_event = cancel_event
+        self.__abort_reason:str|None = None
+        self.__start_ns = 0
+        self.__late_steps = 0
+        self.__max_lateness_ns = 0
+
+    @property
+    def late_policy(self) -> str:
+        """ Reader for __late_policy """
+        return self.__late_policy
+
+    @property
+    def start_ns(self) -> int:
+        """ Reader for __start_ns, the perf_counter_ns() value deadlines are measured from """
+        return self.__start_ns
+
+    @property
+    def late_steps(self) -> int:
+        """ Reader for __late_steps, the number of steps later than the tolerance """
+        return self.__late_steps
+
+    @property
+    def max_lateness(self) -> float:
+        """ Maximum lateness of a step, in ms """
+        return self.__max_lateness_ns / 1e6
+
+    def start(self, start_ns:int|None=None) -> None:
+        """ Set the time deadlines are measured from
+
+        Args:
+            start_ns (int | None, optional): perf_counter_ns() value of the start. Defaults to now.
+        """
+        self.__start_ns = perf_counter_ns() if start_ns is None else start_ns
+        self.__late_steps = 0
+        self.__max_lateness_ns = 0
+
+    def abort(self, reason:str) -> None:
+        """ Stop the current wait and the next ones, ex: from a thread failing during the run
+
+        Args:
+            reason (str): Message of the SequenceAbortedError raised by the waits
+        """
+        self.__abort_reason = reason
+
+    def wait(self, deadline:float) -> bool:
+        """ Wait for a deadline and apply the late policy
+
+        Args:
+            deadline (float): Deadline in ms from the start
+
+        Raises:
+            SequenceAbortedError: If the deadline is missed with the abort policy, or if the wait is cancelled or aborted
+
+        Returns:
+            bool: True if the step must be sent, False if it must be skipped
+        """
+        deadline_ns = self.__start_ns + int(deadline * 1e6)
+
+        # Coarse sleep, then busy loop until the deadline
+        while True:
+            if self.__abort_reason is not None:
+                raise SequenceAbortedError(self.__abort_reason)
+            if (remaining_ns := deadline_ns - perf_counter_ns() - self.__spin_window_ns) <= 0:
+                break
+            if self.__cancel_event is not None and self.__cancel_event.is_set():
+                raise SequenceAbortedError(f"Cancelled while waiting for step at {deadline} ms")
+            sleep(min(remaining_ns, CANCEL_CHECK_INTERVAL * 1_000_000) / 1e9)
+        while (now_ns := perf_counter_ns()) < deadline_ns:
+            pass
+
+        lateness_ns = now_ns - deadline_ns
+        self.__max_lateness_ns = max(self.__max_lateness_ns, lateness_ns)
+        if lateness_ns <= self.__late_tolerance_ns:
+            return True
+
+        self.__late_steps += 1
+        if self.__late_policy == LATE_ABORT:
+            raise SequenceAbortedError(f"Step at {deadline} ms is late by {lateness_ns / 1e6:.3f} ms")
+        return self.__late_policy == LATE_CATCH_UP
+
+
+class TimingRecorder():
+    """ Preallocated records of when each step was sent, for a post run timing report """
+    def __init__(self, deadlines:np.ndarray) -> None:
+        """
+        Args:
+            deadlines (np.ndarray): Deadline of each step in ms from the trigger
+        """
+        self.__deadlines_ns = np.asarray(deadlines, dtype=np.int64) * 1_000_000
+        self.__records = np.full((len(deadlines), len(TIMING_FIELDS)), -1, dtype=np.int64)
+        self.__start_ns = 0
+
+    @property
+    def records(self) -> np.ndarray:
+        """ Reader for __records, one row per step with the perf_counter_ns() values of TIMING_FIELDS """
+        return self.__records
+
+    def start(self, start_ns:int) -> None:
+        """ Set the trigger time and the scheduled time of every step
+
+        Args:
+            start_ns (int): perf_counter_ns() value of the trigger
+        """
+        self.__start_ns = start_ns
+        self.__records[:, TIMING_FIELDS.index(TIMING_SCHEDULED)] = start_ns + self.__deadlines_ns
+
+    def relative_records(self) -> np.ndarray:
+        """ Records in ns from the trigger, -1 for steps not sent
+
+        Returns:
+            np.ndarray: int64 array of shape (steps, len(TIMING_FIELDS))
+        """
+        return np.where(self.__records >= 0, self.__records - self.__start_ns, -1)
+
+    def summary(self) -> dict[str, float | int | list[int]]:
+        """ Statistics of the sent steps, times in ms
+
+        Returns:
+            dict[str, float | int | list[int]]: Lateness percentiles, write durations, DO/AO skew and lateness histogram
+        """
+        records = self.__records
+        do_sent = records[:, TIMING_FIELDS.index(TIMING_DO_START)] >= 0
+        ao_sent = records[:, TIMING_FIELDS.index(TIMING_AO_START)] >= 0
+        sent = do_sent | ao_sent
+
+        def delta(end:str, start:str, rows:np.ndarray) -> np.ndarray:
+            return (records[rows, TIMING_FIELDS.index(end)] - records[rows, TIMING_FIELDS.index(start)]) / 1e6
+
+        # Steps only writing AO start with the AO write
+        step_start = np.where(do_sent, records[:, TIMING_FIELDS.index(TIMING_DO_START)], records[:, TIMING_FIELDS.index(TIMING_AO_START)])
+        lateness = (step_start[sent] - records[sent, TIMING_FIELDS.index(TIMING_SCHEDULED)]) / 1e6
+        do_duration = delta(TIMING_DO_END, TIMING_DO_START, do_sent)
+        ao_duration = delta(TIMING_AO_END, TIMING_AO_START, ao_sent)
+        skew = delta(TIMING_AO_END, TIMING_DO_END, do_sent & ao_sent)
+
+        def percentiles(values:np.ndarray, name:str) -> dict[str, float]:
+            if not len(values):
+                return {}
+            return {f"{name}_p50": float(np.percentile(values, 50)),
+                    f"{name}_p99": float(np.percentile(values, 99)),
+                    f"{name}_max": float(values.max())}
+
+        return {"steps": len(records), "sent": int(sent.sum()),
+                "do_writes": int(do_sent.sum()), "ao_writes": int(ao_sent.sum()),
+                **percentiles(lateness, "lateness"),
+                **percentiles(do_duration, "do_write"),
+                **percentiles(ao_duration, "ao_write"),
+                **percentiles(np.abs(skew), "do_ao_skew"),
+                "lateness_histogram": np.histogram(lateness, bins=TIMING_HISTOGRAM_BINS)[0].tolist()}
+
+    def export(self, path:str) -> None:
+        """ Export the records to a csv file, in ns from the trigger
+
+        Args:
+            path (str): Path of the csv file
+        """
+        np.savetxt(path, self.relative_records(), fmt="%d", delimiter=",", header=",".join(TIMING_FIELDS), comments="")
+
+
+class _AoStreamer(Thread):
+    """ Thread writing the rest of a hardware timed AO waveform while the DAQ generates it
+
+    The error of a write is kept, to be raised by the run once the thread is joined, and
+    reported right away to on_error so the run does not wait for steps of a broken waveform.
+    """
+    def __init__(self, daq:DaqBackend, sequence:CompiledSequence, sample_rate:float, n_samples:int,
+                 on_error:Callable[[str], None]) -> None:
+        """
+        Args:
+            daq (DaqBackend): Backend with an armed streamed waveform, its first AO_BUFFER_SIZE samples written
+            sequence (CompiledSequence): The sequence generated
+            sample_rate (float): Sample rate of the waveform, in samples per second
+            n_samples (int): Number of samples of the waveform
+            on_error (Callable[[str], None]): Called with the reason when a write fails, ex: DeadlineScheduler.abort
+        """
+        super().__init__(name="AO Streaming", daemon=True)
+        self.__daq = daq
+        self.__sequence = sequence
+        self.__sample_rate = sample_rate
+        self.__n_samples = n_samples
+        self.__on_error = on_error
+        self.__stop_event = Event()
+        self.__error:Exception|None = None
+
+    @property
+    def error(self) -> Exception | None:
+        """ Reader for __error, the error of the failed write if any """
+        return self.__error
+
+    def stop(self) -> None:
+        """ Stop streaming once the chunk being written is accepted by the DAQ """
+        self.__stop_event.set()
+
+    def run(self) -> None:
+        try:
+            for first_sample in range(AO_BUFFER_SIZE, self.__n_samples, AO_BUFFER_SIZE):
+                if self.__stop_event.is_set():
+                    return
+                chunk = _ao_waveform(self.__sequence, self.__sample_rate,
+                                     first_sample=first_sample, last_sample=first_sample + AO_BUFFER_SIZE)
+                # Blocks until the DAQ buffer has room for the chunk
+                self.__daq.write_ao_waveform(chunk, timeout=WRITE_TIMEOUT + AO_BUFFER_SIZE / self.__sample_rate)
+        except Exception as error: #pylint: disable=broad-exception-caught
+            self.__error = error
+            self.__on_error(f"AO streaming failed: {type(error).__name__}: {error}")
+
+
+# Method to read the timing profile of a device, saved by stimseq_calibrate
+def load_timing_profile(device:str) -> dict | None:
+    """ Timing profile of a device, measured by stimseq_calibrate
+
+    A profile is only valid for the channels it was measured with, it must be
+    measured again when the wiring changes.
+
+    Args:
+        device (str): Name of the device as defined in NI MAX
+
+    Raises:
+        ValueError: If the profile is not readable, or was measured with other channels than the current wiring
+
+    Returns:
+        dict | None: The profile, with the calibrated "min_timestep" in ms. None if the device was not calibrated
+    """
+    path = os.path.join(TIMING_PROFILE_DIR, f"{device}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as error:
+        raise ValueError(f"Timing profile {path} is not readable: {error}") from error
+
+    if not isinstance(profile, dict) or profile.get("version") != TIMING_PROFILE_VERSION:
+        raise ValueError(f"Timing profile {path} is not a version {TIMING_PROFILE_VERSION} profile")
+    if profile.get("channels") != [list(channel) for channel in _channel_wiring(device)]:
+        raise ValueError(f"Timing profile {path} was measured with other channels than the current wiring")
+    if not isinstance(profile.get("min_timestep"), int) or profile["min_timestep"] < 1:
+        raise ValueError(f"Timing profile {path} has no valid min_timestep")
+    return profile
+
+
+# Method to parse a sequence file or expand a protocol file
+def _parse_file(path:str, min_timestep:int) -> tuple[CompiledSequence, ValidationReport]:
+    """ Parse a csv sequence file, or expand a protocol file (see stimseq_protocol), without the cache
+
+    Args:
+        path (str): Path to the sequence or protocol file
+        min_timestep (int): Minimum time step in ms
+
+    Returns:
+        tuple[CompiledSequence, ValidationReport]: Parsed sequence, possibly without any step, and report of the skipped rows
+    """
+    if os.path.splitext(path)[1].lower() == PROTOCOL_EXTENSION:
+        # Imported here, stimseq_protocol depends on this module
+        from stimseq_protocol import parse_protocol_file #pylint: disable=import-outside-toplevel
+        return parse_protocol_file(path, min_timestep=min_timestep)
+    return _parse_sequence_file(path, min_timestep=min_timestep)
+
+
+# Method to load a sequence from the cache, or parse it and save it to the cache
+def load_sequence(path:str, use_cache:bool, logger:logging.Logger,
+                  min_timestep:int|None=None) -> tuple[CompiledSequence, ValidationReport]:
+    """ Load a parsed sequence from the cache, parse the file if it is not cached
+
+    Protocol files (see stimseq_protocol) are expanded, other files are parsed as csv sequence files.
+
+    Args:
+        path (str): Path to the sequence or protocol file
+        use_cache (bool): Use the cache of parsed sequences
+        logger (logging.Logger): Logger for cache messages
+        min_timestep (int | None, optional): Minimum time step in ms, ex: StimSeq.min_timestep. Defaults to MIN_TIMESTEP.
+
+    Raises:
+        ValueError: If the file has no valid step, or is not a valid protocol file
+
+    Returns:
+        tuple[CompiledSequence, ValidationReport]: Parsed sequence and report of the skipped rows
+    """
+    min_timestep = MIN_TIMESTEP if min_timestep is None else min_timestep
+
+    # Already validated files are loaded from the cache
+    if use_cache:
+        key = _cache_key(path, min_timestep)
+        cached = _cache_load(key)
+        if cached is not None:
+            logger.info("Loaded parsed sequence from cache: %s", key)
+            return cached
+
+    parsed = _parse_file(path, min_timestep)
+    if not len(parsed[0]):
+        raise ValueError(f"No valid step in {path} ({parsed[1].summary()})")
+    if use_cache:
+        try:
+            _cache_store(key, *parsed)
+        except OSError as error:
+            logger.warning("Could not save parsed sequence to cache: %s", error)
+    return parsed
+
+
+# Method to add the channels of a run to the tasks of an opened backend
+def _add_channels(daq:DaqBackend, device:str, enable_heartbeat:bool=True) -> None:
+    """ Add the DO, AO and trigger channels of _channel_wiring to the tasks of an opened backend
+
+    Args:
+        daq (DaqBackend): Opened backend
+        device (str): Name of the device as defined in NI MAX
+        enable_heartbeat (bool, optional): Add the heartbeat line to its DO port. Defaults to True.
+    """
+    for kind, physical_channel, name in _channel_wiring(device, enable_heartbeat=enable_heartbeat):
+        if kind == CHANNEL_DO:
+            daq.add_do_port(lines=physical_channel, name=name)
+        elif kind == CHANNEL_AO:
+            daq.add_ao_channel(physical_channel=physical_channel, name=name, min_val=min(AO_RANGE), max_val=max(AO_RANGE))
+        else:
+            daq.add_trigger(lines=physical_channel, name=name)
+
+
+class _DeviceLoggerAdapter(logging.LoggerAdapter):
+    """ Logger prefixing messages with the name of a device, when several devices log to the same file """
+
+    def process(self, msg, kwargs):
+        return f"{self.extra['device']}: {msg}", kwargs
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """ Queue handler leaving the formatting of records to the listener thread
+
+    The default QueueHandler formats the message before putting the record in the queue,
+    in the thread logging it. Arguments of records must then not be modified after the call.
+    """
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Listener writing queued records to the handlers, shared by all StimSeq instances
+_log_listener:QueueListener | None = None
+
+
+# Method to configure the logger once, file and console outputs are written by a background thread
+def _init_logging(log_file:str, log_lvl:int) -> logging.Logger:
+    """ Configure the StimSeq logger, queuing records to a listener thread
+
+    Calling it again only updates the level, or replaces the handlers if the log file changed,
+    so records are never duplicated.
+
+    Args:
+        log_file (str): Path of the log file
+        log_lvl (int): Logging level
+
+    Returns:
+        logging.Logger: The StimSeq logger
+    """
+    global _log_listener #pylint: disable=global-statement
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(log_lvl)
+
+    if _log_listener is not None:
+        file_handler = _log_listener.handlers[0]
+        if file_handler.baseFilename == os.path.abspath(log_file):
+            for handler in _log_listener.handlers:
+                handler.setLevel(log_lvl)
+            return logger
+        _stop_logging()
+
+    # Create a formatter to define the log format
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    # Create a file handler to write logs to a file, and a stream handler to print them to the console
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setLevel(log_lvl)
+        handler.setFormatter(formatter)
+
+    # The logger only puts records in the queue, the listener thread does the I/O
+    log_queue:queue.SimpleQueue = queue.SimpleQueue()
+    for handler in [h for h in logger.handlers if isinstance(h, QueueHandler)]:
+        logger.removeHandler(handler)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return logger
+
+
+# Method to write the queued records and close the log handlers
+def _stop_logging() -> None:
+    """ Stop the listener thread after it has written all queued records """
+    global _log_listener #pylint: disable=global-statement
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
+
+
+atexit.register(_stop_logging)
 
 
 class StimSeq():
@@ -116,17 +1253,31 @@ class StimSeq():
             self,
             path_to_sequence:str,
             log_file:str=os.path.join(os.path.dirname(__file__), LOG_FILE),
-            log_lvl=logging.INFO
+            log_lvl=logging.INFO,
+            use_cache:bool=True,
+            backend:DaqBackend|None=None,
+            device:str|None=None,
+            min_timestep:int|None=None,
         ) -> None:
 
         # Save argyments as attributes
         self.__log_file = log_file
         self.__log_lvl = log_lvl
-        self.__sequence:tuple[dict[str, int | float | bool]]
+        self.__use_cache = use_cache
+        self.__backend = backend if backend is not None else NidaqmxBackend()
+        # Messages of a given device are prefixed with its name
+        self.__device = device
+        self.__compiled:CompiledSequence
+        self.__report:ValidationReport
+        self.__last_run:RunTiming | None = None
 
         # Init Logger
         self.__init_logger()
 
+        # Steps closer than the device can keep up with are skipped
+        self.__min_timestep = min_timestep if min_timestep is not None else self.__calibrated_min_timestep()
+        self.__logger.info("Minimum time step: %i ms", self.__min_timestep)
+
         # Parse the Sequence
         self.seq_path = path_to_sequence
 
@@ -148,32 +1299,43 @@ class StimSeq():
         self._parse_sequence()
 
     def __init_logger(self) -> None:
-        # Create a logger
-        self.__logger = logging.getLogger('my_logger')
-        self.__logger.setLevel(self.__log_lvl)
-
-        # Create a formatter to define the log format
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',)
-
-        # Create a file handler to write logs to a file
-        file_handler = logging.FileHandler(self.__log_file)
-        file_handler.setLevel(self.__log_lvl)
-        file_handler.setFormatter(formatter)
-
-        # Create a stream handler to print logs to the console
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(self.__log_lvl)
-        console_handler.setFormatter(formatter)
-
-        # Add the handlers to the logger
-        self.__logger.addHandler(file_handler)
-        self.__logger.addHandler(console_handler)
+        # Records are written by a background thread, handlers are shared by all instances
+        self.__logger = _init_logging(self.__log_file, self.__log_lvl)
+        if self.__device is not None:
+            self.__logger = _DeviceLoggerAdapter(self.__logger, {"device": self.__device})
+
+    def __calibrated_min_timestep(self) -> int:
+        # Minimum time step of the timing profile of the device, MIN_TIMESTEP if it was not calibrated
+        try:
+            profile = load_timing_profile(self.device)
+        except ValueError as error:
+            self.__logger.warning("%s, using MIN_TIMESTEP", error)
+            return MIN_TIMESTEP
+        if profile is None:
+            return MIN_TIMESTEP
+        self.__logger.info("Loaded timing profile of %s, calibrated on %s", self.device, profile.get("date"))
+        return profile["min_timestep"]
 
     @property
     def logger(self) -> logging.Logger:
         """ Reader for __logger """
         return self.__logger
 
+    @property
+    def device(self) -> str:
+        """ Reader for __device, name of the DAQ in NI MAX """
+        return self.__device if self.__device is not None else DAQ_NAME
+
+    @property
+    def min_timestep(self) -> int:
+        """ Reader for __min_timestep, in ms, from the timing profile of the device or MIN_TIMESTEP """
+        return self.__min_timestep
+
+    @property
+    def last_run(self) -> RunTiming | None:
+        """ Reader for __last_run, timing of the last completed run """
+        return self.__last_run
+
     @property
     def log_file(self) -> str:
         """ Reader for __log_file """
@@ -186,165 +1348,473 @@ class StimSeq():
 
     @property
     def sequence(self) -> tuple[dict[str, int | float | bool]]:
-        """ Reader for __sequence """
-        return self.__sequence
+        """ Reader for the sequence as one dict per step, rebuilt from __compiled on each call """
+        do_values = self.__compiled.do_values()
+        return tuple({TIMESTAMP: int(self.__compiled.timestamps[i]),
+                      **{key: bool(do_values[i, j]) for j, key in enumerate(DO_DATA_KEYS)},
+                      **{key: float(self.__compiled.ao[i, j]) for j, key in enumerate(AO_DATA_KEYS)}}
+                     for i in range(len(self.__compiled)))
 
-    def __type_convert(self, value:str, column:str) -> bool | int | float:
-        """ Method to ensure proper conversion of data from csv"""
-        if SEQUENCE_TYPES[column] == bool:
-            return bool(int(value))
-        return SEQUENCE_TYPES[column](value)
+    @property
+    def compiled(self) -> CompiledSequence:
+        """ Reader for __compiled """
+        return self.__compiled
+
+    @property
+    def backend(self) -> DaqBackend:
+        """ Reader for __backend """
+        return self.__backend
+
+    @property
+    def use_cache(self) -> bool:
+        """ Reader for __use_cache """
+        return self.__use_cache
+
+    @property
+    def report(self) -> ValidationReport:
+        """ Reader for __report """
+        return self.__report
 
     def _parse_sequence(self) -> None:
         """ Parse the sequence file.
         """
         self.__logger.info("Parsing sequence file: %s", self.__seq_path)
+        self.__compiled, self.__report = load_sequence(self.__seq_path, self.__use_cache, self.__logger, self.__min_timestep)
+        self.__log_report()
+
+    def set_parsed_sequence(self, path_to_sequence:str, compiled:CompiledSequence, report:ValidationReport) -> None:
+        """ Use a sequence parsed beforehand, ex: by a background thread, instead of parsing it again
+
+        Args:
+            path_to_sequence (str): Path to the sequence file
+            compiled (CompiledSequence): Parsed sequence, as returned by load_sequence
+            report (ValidationReport): Report of the skipped rows
 
-        with open(self.__seq_path, 'r', encoding='utf-8', newline='') as f:
-            # Load into a dict reader while skipping line starting with a *
-            reader = csv.DictReader(filter(lambda line: not line.startswith('*'), f),
-                                    fieldnames=SEQUENCE_COLUMNS, skipinitialspace=True,
-                                    restval="MISSING VAL", restkey="Comment")
-
-            # tmp dict to save sequence
-            tmp_seq:list[dict[str, int | float | bool]] = []
-
-            # For loop through csv row by row
-            for i, row in enumerate(reader):
-                self.__logger.debug("Parsing row: %s", row)
-                # Skip rows when a column has an invalid value (Empty or not an integer)
-                if any(not _is_number(row[col]) for col in SEQUENCE_COLUMNS):
-                    self.__logger.warning("Skipped Row %i because an invalid value was found", i)
-                    continue
-
-                # Skip line if analog value outside acceptable range is found
-                if not all(min(AO_RANGE) <= int(row[key]) <= max(AO_RANGE) for key in AO_DATA_KEYS):
-                    self.__logger.warning("Skipped Row %i because Analog Output data is out of range (min: %s, max: %s)",
-                                            i, min(AO_RANGE), max(AO_RANGE))
-                    continue
-
-                # Check Time Steps Validity
-                if tmp_seq:
-                    # Compute time increment with previous parsed row
-                    time_increment = SEQUENCE_TYPES[TIMESTAMP](row[TIMESTAMP]) - tmp_seq[-1][TIMESTAMP]
-
-                    # Skip rows when time step are incoherent
-                    if  time_increment < MIN_TIMESTEP :
-                        self.__logger.warning("Skipped Row %i because time increment with previous steps is too small (got: %s, min: %s)",
-                                            i, time_increment, MIN_TIMESTEP)
-                        continue
-                else :
-                    # Force 0 if first valid row has a negative Timestep
-                    if  SEQUENCE_TYPES[TIMESTAMP](row[TIMESTAMP]) <= 0 :
-                        self.__logger.warning("Time step for first row has negative value: forcing zero")
-                        row[TIMESTAMP] = '0'
-
-                # Append line to list
-                tmp_seq.append({col: self.__type_convert(row[col], col) for col in SEQUENCE_COLUMNS})
-
-            # Save sequence to a tuple in order to prevent editing by mistake
-            self.__sequence = tuple(tmp_seq)
-            if self.__logger.isEnabledFor(logging.DEBUG):
-                for step in self.__sequence:
-                    self.__logger.debug("Parsed sequence: %s", step)
+        Raises:
+            ValueError: If the sequence has no step, the previous sequence is kept
+        """
+        if not len(compiled):
+            raise ValueError(f"No valid step in {path_to_sequence} ({report.summary()})")
+        self.__seq_path = path_to_sequence
+        self.__compiled, self.__report = compiled, report
+        self.__logger.info("Loaded parsed sequence: %s", path_to_sequence)
+        self.__log_report()
+
+    def __log_report(self) -> None:
+        # Report skipped rows at once
+        if self.__report.first_timestamp_forced:
+            self.__logger.warning("Time step for first row has negative value: forcing zero")
+        if len(self.__report):
+            self.__logger.warning(self.__report.summary())
+            for reason in SKIP_REASONS:
+                if len(rows := self.__report.skipped_rows(reason)):
+                    self.__logger.debug("Skipped rows because %s: %s", reason, rows)
+        self.__logger.info("Parsed %i steps", len(self.__compiled))
+        self.__logger.debug("Parsed sequence: %s", self.__compiled)
 
     #pylint: disable=too-many-locals
-    def run_sequence(self, enable_heartbeat:bool=True) -> None:
+    def run_sequence(self, enable_heartbeat:bool=True, ao_sample_rate:float|None=None,
+                     late_policy:str=LATE_CATCH_UP, spin_window:float=SPIN_WINDOW, raise_priority:bool=False,
+                     timing_report:bool=False, trigger_timeout:float|None=None,
+                     cancel_event:Event|None=None, progress:queue.SimpleQueue|None=None,
+                     wait_start:Callable[[DaqBackend, float | None, Event | None], int | None]|None=None,
+                     acquisition:"Acquisition | None"=None, loops:int|None=1) -> None:
         """Execute the sequence from the computer
 
+        Steps are sent at their timestamp measured from the trigger signal, so timing
+        errors do not accumulate over the sequence.
+
         Args:
-            enable_heartbeat (bool, optional): Enables a heartbeat signal, changing state with every new generated sample. Defaults to True.
+            enable_heartbeat (bool, optional): Enables a heartbeat signal, changing state with every DO write. Defaults to True.
+            ao_sample_rate (float | None, optional): Enables hardware timed AO generation at the given sample rate (samples per second).
+                The AO waveform is then started by the trigger signal on TTL_PFI. Defaults to None (software timed AO).
+            late_policy (str, optional): Handling of steps later than LATE_TOLERANCE, one of LATE_POLICIES. Defaults to LATE_CATCH_UP.
+            spin_window (float, optional): Time in ms before each step during which the wait is a busy loop. Defaults to SPIN_WINDOW.
+            raise_priority (bool, optional): Raise the scheduling priority of the thread while sending the sequence. Defaults to False.
+            timing_report (bool, optional): Record when each step is sent, log a summary and export the records
+                to a csv file next to the log file. Defaults to False.
+            trigger_timeout (float | None, optional): Time in s to wait for the trigger signal. Defaults to None (no timeout).
+            cancel_event (Event | None, optional): Event stopping the sequence when set, while waiting
+                for the trigger or between steps. Defaults to None.
+            progress (queue.SimpleQueue | None, optional): Queue receiving Progress messages during the run,
+                at most every PROGRESS_INTERVAL. Defaults to None.
+            wait_start (Callable | None, optional): Replaces the wait for the trigger signal, ex: to start several devices together
+                (see stimseq_multi). Called with the backend, trigger_timeout and cancel_event, returns the start time
+                (perf_counter_ns) or None to abort. Defaults to None.
+            acquisition (Acquisition | None, optional): Acquisition of the trigger and output signals from before the trigger
+                to after the reset of the outputs, streamed to a file by its own threads (see stimseq_acquire). Defaults to None.
+            loops (int | None, optional): Number of times the sequence is run back to back from the trigger, or None to loop
+                until the cancel event is set, which then ends the run without error. Hardware timed AO regenerate the
+                uploaded waveform on the device. Timing reports are not supported for looped runs. Defaults to 1.
+
+        Raises:
+            SequenceAbortedError: If a step is late with LATE_ABORT policy, if the trigger is not received
+                or if the sequence is cancelled. Outputs are reset to 0 before
         """
+        with self.__backend as daq:
+            self._configure_channels(daq, enable_heartbeat=enable_heartbeat)
+            with _acquiring(acquisition, daq, self.device, self.__seq_path, self.__logger):
+                self._send_sequence(daq, enable_heartbeat=enable_heartbeat, ao_sample_rate=ao_sample_rate,
+                                    late_policy=late_policy, spin_window=spin_window, raise_priority=raise_priority,
+                                    timing_report=timing_report, trigger_timeout=trigger_timeout, cancel_event=cancel_event,
+                                    progress=progress, wait_start=wait_start, acquisition=acquisition, loops=loops)
 
-        with (
-            ni.Task("Digital Outputs") as task_do,
-            ni.Task("Trigger") as task_trig,
-            ni.Task("Analog Outputs") as task_ao,
-        ):
-            time_data:list[float] = []
-            do_data:list[int] = []
-            ao_data:list[float] = []
-            heartbit_value = False
-
-            # Prepare data arrangement
-            do_data_step_size = len(DO_DATA_KEYS) + (1 if enable_heartbeat else 0)
-            ao_data_step_size = len(AO_DATA_KEYS)
-
-            # Prepare sequence data for DAQ Generation
-            self.__logger.info("Prepare sequence data for DAQ Generation")
-            for i, step in enumerate(self.__sequence):
-                time_data.append((step[TIMESTAMP] - self.__sequence[i - 1][TIMESTAMP]) if i else step[TIMESTAMP])
-
-                # Prepare digital output values
-                for key in DO_DATA_KEYS:
-                    do_data.append(step[key])
-
-                # If heartbit enabled, add heartbit signal to digital output
-                # changing from True to False with every time step
-                if enable_heartbeat:
-                    do_data.append(heartbit_value := not heartbit_value)
-
-                # preapre Analog output Values
-                for key in AO_DATA_KEYS:
-                    ao_data.append(step[key])
-            self.__logger.debug("time_data: %s", time_data)
-            self.__logger.debug("do_data: %s", do_data)
-            self.__logger.debug("ao_data: %s", ao_data)
-
-            # Compute sequence size
-            seq_size = len(time_data)
-
-            # Check all data lists are of the same size
-            if not all((seq_size == len(ao_data)/ao_data_step_size, len(do_data)/do_data_step_size)):
-                self.__logger.critical("Incoherent size between prepared output data")
-                raise ValueError
-
-
-            self.__logger.info("Init DAQ Channels")
-            # Init Digital Output Channels
-            # OUTPUT_ADDITION_SECTION
-            task_do.do_channels.add_do_chan(lines=VALVES_DO, name_to_assign_to_lines="Valves",
-                                            line_grouping=LineGrouping.CHAN_PER_LINE)
-            task_do.do_channels.add_do_chan(lines=PIEZO_DO, name_to_assign_to_lines="Piezo",
-                                            line_grouping=LineGrouping.CHAN_PER_LINE)
-
-            # Init Analog Output Channels
-            # OUTPUT_ADDITION_SECTION
-            task_ao.ao_channels.add_ao_voltage_chan(physical_channel=LED_AO, name_to_assign_to_channel="LED",
-                                                    min_val=min(AO_RANGE), max_val=max(AO_RANGE), units=VoltageUnits.VOLTS)
-
-            # Add Heartbeat to digital output channels
-            if enable_heartbeat:
-                task_do.do_channels.add_do_chan(lines=HEARBIT_DO, name_to_assign_to_lines="HeartBeat",
-                                                line_grouping=LineGrouping.CHAN_PER_LINE)
-
-            # Init digital input channel for trigger signal
-            task_trig.di_channels.add_di_chan(lines=TTL_DI, name_to_assign_to_lines="TTL IN",
-                                              line_grouping=LineGrouping.CHAN_PER_LINE)
+    def _configure_channels(self, daq:DaqBackend, enable_heartbeat:bool=True) -> None:
+        """ Add the DO, AO and trigger channels to the tasks of an opened backend
+
+        Args:
+            daq (DaqBackend): Opened backend
+            enable_heartbeat (bool, optional): Add the heartbeat line to its DO port. Defaults to True.
+        """
+        self.__logger.info("Init DAQ Channels")
+        _add_channels(daq, self.device, enable_heartbeat=enable_heartbeat)
+
+    def _send_sequence(self, daq:DaqBackend, enable_heartbeat:bool, ao_sample_rate:float|None, late_policy:str,
+                       spin_window:float, raise_priority:bool, timing_report:bool, trigger_timeout:float|None,
+                       cancel_event:Event|None, progress:queue.SimpleQueue|None=None,
+                       wait_start:Callable[[DaqBackend, float | None, Event | None], int | None]|None=None,
+                       acquisition:"Acquisition | None"=None, loops:int|None=1) -> None:
+        """ Wait for the trigger and send the sequence on the channels of an opened backend, see run_sequence
+
+        A running acquisition only receives the trigger time, it is started and stopped by the caller.
+        Iterations of a looped sequence reuse the same dispatch plan, with deadlines offset by the
+        duration of the sequence.
+        """
+        if ao_sample_rate is not None and not 0 < ao_sample_rate <= AO_MAX_SAMPLE_RATE:
+            raise ValueError(f"AO sample rate must be in ]0, {AO_MAX_SAMPLE_RATE}], got {ao_sample_rate}")
+        if loops is not None and loops < 1:
+            raise ValueError(f"Number of loops must be positive, got {loops}")
+        if timing_report and loops != 1:
+            raise ValueError("Timing reports are not supported for looped sequences")
+        scheduler = DeadlineScheduler(spin_window=spin_window, late_policy=late_policy, cancel_event=cancel_event)
+        recorder = TimingRecorder(self.__compiled.timestamps) if timing_report else None
+        records = recorder.records if recorder is not None else None
+        self.__last_run = None
+
+        # Prepare sequence data for DAQ Generation
+        self.__logger.info("Prepare sequence data for DAQ Generation")
+        sequence = self.__compiled
+        end_time = int(sequence.timestamps[-1] + sequence.time_increments[-1])
+
+        # Only steps and tasks with changed outputs are written
+        plan = _plan_dispatch(sequence, enable_heartbeat=enable_heartbeat, include_ao=ao_sample_rate is None)
+        stats = plan.stats()
+        self.__logger.info("Dispatch plan: %i/%i steps, %i DO and %i AO writes, %i writes and %i bytes saved",
+                           stats["dispatched_steps"], stats["steps"], stats["do_writes"], stats["ao_writes"],
+                           stats["writes_saved"], stats["bytes_saved"])
+        time_data = plan.timestamps.tolist()
+        steps = plan.steps.tolist()
+        write_do = plan.write_do.tolist()
+        write_ao = plan.write_ao.tolist()
+        do_data = plan.do_ports
+        ao_data = plan.ao
+        self.__logger.debug("time_data: %s", time_data)
+        self.__logger.debug("do_data: %s", do_data)
+        self.__logger.debug("ao_data: %s", ao_data)
+
+        # Outputs are reset between iterations when the first step is after the trigger, as before the first one
+        reset_iterations = time_data[0] > 0
+        do_iterations = [do_data]
+        if enable_heartbeat and not reset_iterations and np.count_nonzero(plan.write_do) % 2:
+            # Heartbeat would not toggle at the first write of odd iterations, their words have it inverted
+            port, line = HEARTBEAT_LINE
+            heartbeat_mask = np.zeros(len(DO_PORTS), dtype=np.uint32)
+            heartbeat_mask[DO_PORTS.index(port)] = 1 << line
+            do_iterations.append(do_data ^ heartbeat_mask)
+        if loops != 1:
+            self.__logger.info("Loop sequence of %i ms %s", end_time, f"{loops} times" if loops is not None else "until cancelled")
+
+        # Arm hardware timed AO generation, it will start with the trigger signal
+        ao_streamer = None
+        if ao_sample_rate is not None:
+            ao_streamer = self.__arm_hardware_timed_ao(daq, sequence, ao_sample_rate, scheduler.abort, loops)
+
+        with _high_priority(raise_priority) as raised:
+            if raise_priority and not raised:
+                self.__logger.warning("Could not raise thread priority")
 
             # Wait for trigger signal
-            self.__logger.info("Waiting for trigger signal on %s", TTL_DI)
-            trig = 0
-            while trig == 0:
-                trig = task_trig.read()
-            self.__logger.info("Trigger signal received")
-
-            # Execute sequence
-            for i in range(seq_size):
-                sleep(time_data[i] / 1000)
-                task_do.write(do_data[i*do_data_step_size : i*do_data_step_size + do_data_step_size])
-                task_ao.write(ao_data[i*ao_data_step_size : i*ao_data_step_size + ao_data_step_size])
-                self.__logger.debug("Sent do: %s", do_data[i*do_data_step_size : i*do_data_step_size + do_data_step_size])
-                self.__logger.debug("Sent ao: %s", ao_data[i*ao_data_step_size : i*ao_data_step_size + ao_data_step_size])
-
-            # Reset outputs to 0 for safety reasons
-            # The reset occurs after a pause equals to last timesteps
-            sleep(time_data[-1] / 1000)
-            task_do.write([False,]* do_data_step_size)
-            task_ao.write([0,]* ao_data_step_size)
-            self.__logger.info("Reseted outputs to O")
-
-            self.__logger.info("Finished sending sequence")
+            if wait_start is None:
+                self.__logger.info("Waiting for trigger signal on %s", _device_channel(TTL_DI, self.device))
+                trigger_ns = daq.wait_trigger(timeout=trigger_timeout, cancel_event=cancel_event)
+            else:
+                self.__logger.info("Waiting for shared start")
+                trigger_ns = wait_start(daq, trigger_timeout, cancel_event)
+            if trigger_ns is None:
+                # Nothing was written yet, only the armed AO generation must be stopped
+                if ao_sample_rate is not None:
+                    daq.stop_ao()
+                reason = "cancelled" if cancel_event is not None and cancel_event.is_set() else f"not received within {trigger_timeout} s"
+                self.__logger.critical("Sequence aborted: trigger signal %s", reason)
+                raise SequenceAbortedError(f"Trigger signal {reason}")
+            scheduler.start(trigger_ns)
+            if acquisition is not None:
+                acquisition.mark_trigger(trigger_ns)
+            if recorder is not None:
+                recorder.start(scheduler.start_ns)
+            self.__logger.info("Trigger signal received" if wait_start is None else "Shared start received")
+
+            # Send the rest of the AO waveform while the DAQ generates it
+            if ao_streamer is not None:
+                ao_streamer.start()
+
+            completed = False
+            first_write_ns = first_write_lateness = None
+            force_write = False
+            next_progress_ns = 0
+            log_steps = self.__logger.isEnabledFor(logging.DEBUG)
+            iteration = 0
+            try:
+                while loops is None or iteration < loops:
+                    offset = iteration * end_time
+                    if log_steps and loops != 1:
+                        self.__logger.debug("Iteration %i/%s at %i ms", iteration + 1, loops or "-", offset)
+                    if iteration and reset_iterations and scheduler.wait(offset):
+                        daq.write_do(np.zeros(len(DO_PORTS), dtype=np.uint32), timeout=WRITE_TIMEOUT)
+                        if plan.include_ao:
+                            daq.write_ao(np.zeros(len(AO_DATA_KEYS)), timeout=WRITE_TIMEOUT)
+                    do_data = do_iterations[iteration % len(do_iterations)]
+
+                    # Execute sequence, each step at its timestamp from the trigger
+                    for i in range(len(plan)):
+                        if not scheduler.wait(deadline := offset + time_data[i]):
+                            # Outputs of a skipped step may differ from the previous one, next step writes all tasks
+                            force_write = True
+                            continue
+                        do_start = do_end = ao_start = ao_end = -1
+                        if write_do[i] or force_write:
+                            do_start = perf_counter_ns()
+                            daq.write_do(do_data[i], timeout=WRITE_TIMEOUT)
+                            do_end = perf_counter_ns()
+                            if first_write_ns is None:
+                                first_write_ns = do_end
+                                first_write_lateness = (do_end - trigger_ns) / 1e6 - deadline
+                        if write_ao[i] or (force_write and plan.include_ao):
+                            ao_start = perf_counter_ns()
+                            daq.write_ao(ao_data[i], timeout=WRITE_TIMEOUT)
+                            ao_end = perf_counter_ns()
+                        force_write = False
+                        if records is not None:
+                            # Every field of TIMING_FIELDS after TIMING_SCHEDULED
+                            records[steps[i], 1:] = (do_start, do_end, ao_start, ao_end)
+                        if progress is not None and (step_end := max(do_end, ao_end)) >= next_progress_ns:
+                            # Throttled, so the consumer of the queue is not woken up at every step
+                            next_progress_ns = step_end + PROGRESS_INTERVAL * 1_000_000
+                            step_start = do_start if do_start >= 0 else ao_start
+                            progress.put(Progress(steps[i] + 1, len(sequence), (step_start - trigger_ns) / 1e6,
+                                                  (step_start - trigger_ns) / 1e6 - deadline,
+                                                  scheduler.late_steps, scheduler.max_lateness, iteration))
+                        if log_steps:
+                            # Formatted by the logging thread, rows of do_data and ao_data are not modified
+                            self.__logger.debug("Sent step %i: do %s, ao %s", steps[i],
+                                                do_data[i] if do_start >= 0 else "unchanged", ao_data[i] if ao_start >= 0 else "unchanged")
+                    iteration += 1
+
+                # The reset occurs after a pause equals to last timesteps
+                scheduler.wait(iteration * end_time)
+                completed = True
+                if progress is not None:
+                    progress.put(Progress(len(sequence), len(sequence), float(iteration * end_time), 0.0,
+                                          scheduler.late_steps, scheduler.max_lateness, iteration - 1))
+            except SequenceAbortedError as error:
+                if loops is not None or cancel_event is None or not cancel_event.is_set():
+                    self.__logger.critical("Sequence aborted (%s policy): %s", late_policy, error)
+                    raise
+                # Looping until cancelled, the cancel event is the end of the run
+                iteration += 1
+                self.__logger.info("Loop stopped by the cancel event during iteration %i", iteration)
+            finally:
+                # Reset outputs to 0 for safety reasons, even if the sequence was aborted
+                daq.write_do(np.zeros(len(DO_PORTS), dtype=np.uint32), timeout=WRITE_TIMEOUT)
+                if ao_sample_rate is None:
+                    daq.write_ao(np.zeros(len(AO_DATA_KEYS)), timeout=WRITE_TIMEOUT)
+                else:
+                    if ao_streamer is not None:
+                        if not completed:
+                            ao_streamer.stop()
+                        # The streamer may be blocked in a write to the AO task, it ends before the task is stopped
+                        ao_streamer.join()
+                    if completed and (ao_streamer is None or ao_streamer.error is None):
+                        # Hardware timed waveform ends with a 0 sample, except a regenerated one
+                        daq.wait_ao_done(timeout=WRITE_TIMEOUT)
+                        if loops != 1:
+                            daq.write_ao(np.zeros(len(AO_DATA_KEYS)), timeout=WRITE_TIMEOUT)
+                    else:
+                        daq.stop_ao()
+                        daq.write_ao(np.zeros(len(AO_DATA_KEYS)), timeout=WRITE_TIMEOUT)
+                self.__logger.info("Reseted outputs to O")
+                if ao_streamer is not None and ao_streamer.error is not None:
+                    # Root cause of the run failure, rather than the abort of the waits it caused
+                    raise ao_streamer.error
+
+        if scheduler.late_steps:
+            self.__logger.warning("%i steps were late by more than %s ms (policy: %s), max lateness: %.3f ms",
+                                  scheduler.late_steps, LATE_TOLERANCE, late_policy, scheduler.max_lateness)
+        self.__logger.info("Max lateness of steps: %.3f ms", scheduler.max_lateness)
+        if first_write_ns is not None:
+            self.__logger.info("Trigger to first write latency: %.3f ms", (first_write_ns - trigger_ns) / 1e6)
+        if loops != 1:
+            self.__logger.info("Iterations run: %i, starting every %i ms from the trigger", iteration, end_time)
+
+        summary = None
+        if recorder is not None:
+            summary = self.__report_timing(recorder)
+        self.__last_run = RunTiming(start_ns=trigger_ns, first_write_ns=first_write_ns, first_write_lateness=first_write_lateness,
+                                    late_steps=scheduler.late_steps, max_lateness=scheduler.max_lateness, summary=summary,
+                                    iterations=iteration)
+
+        self.__logger.info("Finished sending sequence")
+
+    def __report_timing(self, recorder:TimingRecorder) -> dict:
+        """ Log the timing summary and export the records next to the log file
+
+        Args:
+            recorder (TimingRecorder): Records of the run
+
+        Returns:
+            dict: The timing summary
+        """
+        summary = recorder.summary()
+        self.__logger.info("Timing summary (ms): %s",
+                           ", ".join(f"{key}: {value:.3f}" for key, value in summary.items() if isinstance(value, float)))
+        self.__logger.info("Lateness histogram (ms): %s",
+                           ", ".join(f"[{low}, {high}[: {count}" for low, high, count
+                                     in zip(TIMING_HISTOGRAM_BINS, TIMING_HISTOGRAM_BINS[1:], summary["lateness_histogram"])))
+
+        # Records of a given device are exported to their own file
+        device = f"{self.__device}-" if self.__device is not None else ""
+        path = os.path.join(os.path.dirname(os.path.abspath(self.__log_file)),
+                            f"{datetime.now().strftime('%Y-%m-%d_%H.%M.%S')}-timing-{device}{os.path.basename(self.__seq_path)}")
+        recorder.export(path)
+        self.__logger.info("Timing records exported to %s", path)
+        return summary
+
+    def __arm_hardware_timed_ao(self, daq:DaqBackend, sequence:CompiledSequence, sample_rate:float,
+                                on_error:Callable[[str], None], loops:int|None=1) -> _AoStreamer | None:
+        """ Configure a sample clocked AO generation started by the trigger signal
+
+        The first AO_BUFFER_SIZE samples are written before arming the generation. Longer
+        waveforms are streamed by the returned thread, to start once triggered. A looped
+        sequence is written once, without its final reset sample, and regenerated by the device.
+
+        Args:
+            daq (DaqBackend): Opened backend holding the AO channels
+            sequence (CompiledSequence): The sequence to generate
+            sample_rate (float): Sample rate of the waveform, in samples per second
+            on_error (Callable[[str], None]): Called by the streaming thread when a write fails
+            loops (int | None, optional): Number of iterations, None until stopped. Defaults to 1.
+
+        Raises:
+            ValueError: If a looped sequence does not last a whole number of samples
+
+        Returns:
+            _AoStreamer | None: Thread streaming the rest of the waveform, None if it fits in one write
+        """
+        n_samples = _ao_waveform_size(sequence, sample_rate)
+        trigger_source = _device_channel(TTL_PFI, self.device)
+
+        # Iterations follow each other with no gap, the waveform is regenerated from the sample at the end of the sequence
+        if loops != 1:
+            period = (sequence.timestamps[-1] + sequence.time_increments[-1]) * sample_rate / 1000
+            if abs(period - (n_samples - 1)) > 1e-6:
+                raise ValueError(f"Looped sequence must last a whole number of AO samples, {period} samples at {sample_rate} S/s")
+            self.__logger.info("Arm regenerated hardware timed AO: %i samples at %s S/s, %s, started by %s",
+                               n_samples - 1, sample_rate, f"{loops} times" if loops is not None else "until stopped", trigger_source)
+            daq.arm_ao_waveform(sample_rate=sample_rate, n_samples=(n_samples - 1) * loops if loops is not None else None,
+                                trigger_source=trigger_source, data=_ao_waveform(sequence, sample_rate, last_sample=n_samples - 1),
+                                timeout=WRITE_TIMEOUT + n_samples / sample_rate, regenerated=True)
+            return None
+        self.__logger.info("Arm hardware timed AO: %i samples at %s S/s, started by %s",
+                           n_samples, sample_rate, trigger_source)
+
+        # Short waveforms are written in one bulk buffer
+        if n_samples <= AO_BUFFER_SIZE:
+            daq.arm_ao_waveform(sample_rate=sample_rate, n_samples=n_samples, trigger_source=trigger_source,
+                                data=_ao_waveform(sequence, sample_rate), timeout=WRITE_TIMEOUT)
+            return None
+
+        # Long waveforms are streamed in chunks without regeneration
+        daq.arm_ao_waveform(sample_rate=sample_rate, n_samples=n_samples, trigger_source=trigger_source,
+                            data=_ao_waveform(sequence, sample_rate, last_sample=AO_BUFFER_SIZE),
+                            timeout=WRITE_TIMEOUT, streamed=True)
+        return _AoStreamer(daq, sequence, sample_rate, n_samples, on_error=on_error)
+
+
+class StimSeqSession(StimSeq):
+    """ StimSeq keeping the DAQ tasks configured and committed between runs
+
+    Channels are added and the tasks committed once by open(). Each run then only
+    loads the sequence data, so the next sequence is armed within a few milliseconds.
+    A new sequence is loaded by setting seq_path. Can be used as a context manager.
+    """
+    def __init__(self, path_to_sequence:str, enable_heartbeat:bool=True, **kwargs) -> None:
+        """
+        Args:
+            path_to_sequence (str): Path to the first sequence file
+            enable_heartbeat (bool, optional): Configures the heartbeat line, for all runs of the session. Defaults to True.
+            **kwargs: Arguments of StimSeq
+        """
+        super().__init__(path_to_sequence, **kwargs)
+        self.__enable_heartbeat = enable_heartbeat
+        self.__is_open = False
+
+    @property
+    def is_open(self) -> bool:
+        """ Reader for __is_open """
+        return self.__is_open
+
+    def __enter__(self) -> "StimSeqSession":
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """ Create the tasks, add the channels and commit the tasks """
+        if self.__is_open:
+            return
+        self.backend.open()
+        try:
+            self._configure_channels(self.backend, enable_heartbeat=self.__enable_heartbeat)
+            self.backend.commit()
+        except Exception:
+            self.backend.close()
+            raise
+        self.__is_open = True
+        self.logger.info("DAQ session opened")
+
+    def close(self) -> None:
+        """ Release the tasks """
+        if not self.__is_open:
+            return
+        self.backend.close()
+        self.__is_open = False
+        self.logger.info("DAQ session closed")
+
+    def run_sequence(self, ao_sample_rate:float|None=None, late_policy:str=LATE_CATCH_UP, #pylint: disable=arguments-differ
+                     spin_window:float=SPIN_WINDOW, raise_priority:bool=False, timing_report:bool=False,
+                     trigger_timeout:float|None=None, cancel_event:Event|None=None,
+                     progress:queue.SimpleQueue|None=None,
+                     wait_start:Callable[[DaqBackend, float | None, Event | None], int | None]|None=None,
+                     acquisition:"Acquisition | None"=None, loops:int|None=1) -> None:
+        """ Execute the loaded sequence on the committed tasks, see StimSeq.run_sequence
+
+        The heartbeat is configured for the whole session by enable_heartbeat.
+
+        Raises:
+            RuntimeError: If the session is not opened
+            SequenceAbortedError: If a step is late with LATE_ABORT policy, if the trigger is not received
+                or if the sequence is cancelled. Outputs are reset to 0 before
+        """
+        if not self.__is_open:
+            raise RuntimeError("DAQ session is not opened")
+        with _acquiring(acquisition, self.backend, self.device, self.seq_path, self.logger):
+            self._send_sequence(self.backend, enable_heartbeat=self.__enable_heartbeat, ao_sample_rate=ao_sample_rate,
+                                late_policy=late_policy, spin_window=spin_window, raise_priority=raise_priority,
+                                timing_report=timing_report, trigger_timeout=trigger_timeout, cancel_event=cancel_event,
+                                progress=progress, wait_start=wait_start, acquisition=acquisition, loops=loops)
+
 
 # Method to validate a path given through command line
 def _file_path(file_path:str) -> str:
@@ -370,23 +1840,69 @@ if __name__ == "__main__" :
     parser.add_argument('--disable-heartbeat', dest="disable_heartbeat",
                         help="Used to disable heartbeat signal",
                         action='store_true')
+    parser.add_argument('--no-cache', dest="no_cache",
+                        help="Used to parse the sequence file without using the cache of parsed sequences",
+                        action='store_true')
+    parser.add_argument('--late-policy', dest="late_policy", type=str, default=LATE_CATCH_UP,
+                        help=f"Handling of steps late by more than {LATE_TOLERANCE} ms",
+                        choices=LATE_POLICIES)
+    parser.add_argument('--high-priority', dest="raise_priority",
+                        help="Used to raise the priority of the thread sending the sequence",
+                        action='store_true')
+    parser.add_argument('--timing-report', dest="timing_report",
+                        help="Used to record when each step is sent, and export the records next to the log file",
+                        action='store_true')
+    parser.add_argument('--ao-rate', dest="ao_sample_rate", type=float,
+                        help=f"Sample rate (S/s) for hardware timed analog outputs, max {AO_MAX_SAMPLE_RATE}. Analog outputs are software timed if not given")
+    parser.add_argument('--trigger-timeout', dest="trigger_timeout", type=float,
+                        help="Time in s to wait for the trigger signal before aborting. Waits forever if not given")
+    parser.add_argument('--acquire', dest="acquire",
+                        help="Used to acquire the TTL input and the signals wired back to analog inputs during the run, to a file next to the log file",
+                        action='store_true')
+    parser.add_argument('--loops', dest="loops", type=int, default=1,
+                        help="Number of times the sequence is run back to back after the trigger, 0 to loop until Ctrl+C")
+    parser.add_argument('--min-timestep', dest="min_timestep", type=int,
+                        help=f"Minimum time step in ms, rows closer to the previous step are skipped. Defaults to the timing profile of the device (see stimseq_calibrate), or {MIN_TIMESTEP}")
     args = parser.parse_args()
+    if args.loops < 0:
+        parser.error("Number of loops must be positive, or 0 to loop until Ctrl+C")
+    if args.loops != 1 and args.timing_report:
+        parser.error("Timing reports are not supported for looped sequences")
 
 
     # Open a File Picker Dialog if no path given through cli
     if not args.seq_path :
+        # Imported here, runs with --path start without Tk
+        from tkinter import Tk, filedialog #pylint: disable=import-outside-toplevel
         root = Tk()
         root.withdraw()
 
         # Ask User to select the sequence file
         args.seq_path = filedialog.askopenfilename(defaultextension=".csv",
                                                    initialdir=os.getcwd(),
-                                                   filetypes=[(".csv","*.csv")])
+                                                   filetypes=[(".csv","*.csv"), (PROTOCOL_EXTENSION, f"*{PROTOCOL_EXTENSION}")])
 
     # Init stimseq
     stimseq = StimSeq(path_to_sequence=args.seq_path,
                       log_lvl=LOG_LEVELS[args.log_lvl or "DEBUG"],
-                      log_file=os.path.join(os.path.dirname(__file__), LOG_FILE))
-
-    # Run Stimseq
-    stimseq.run_sequence(enable_heartbeat=not args.disable_heartbeat)
+                      log_file=os.path.join(os.path.dirname(__file__), LOG_FILE),
+                      use_cache=not args.no_cache,
+                      min_timestep=args.min_timestep)
+
+    # Acquisition file is next to the log file, as timing reports
+    acquisition = None
+    if args.acquire:
+        from stimseq_acquire import ACQUISITION_EXTENSION, Acquisition #pylint: disable=import-outside-toplevel
+        acquisition = Acquisition(os.path.join(os.path.dirname(__file__),
+                                               f"{datetime.now().strftime('%Y-%m-%d_%H.%M.%S')}-acquisition-{os.path.basename(args.seq_path)}{ACQUISITION_EXTENSION}"))
+
+    # Run Stimseq, outputs are reset when a loop is stopped by Ctrl+C
+    try:
+        stimseq.run_sequence(enable_heartbeat=not args.disable_heartbeat, ao_sample_rate=args.ao_sample_rate,
+                             late_policy=args.late_policy, raise_priority=args.raise_priority,
+                             timing_report=args.timing_report, trigger_timeout=args.trigger_timeout,
+                             acquisition=acquisition, loops=args.loops or None)
+    except KeyboardInterrupt:
+        if args.loops != 0:
+            raise
+        stimseq.logger.info("Loop stopped by Ctrl+C, outputs were reset")
@@ -0,0 +1,486 @@
+#pylint: disable=line-too-long
+"""Background acquisition of the trigger and output signals during a run
+
+An Acquisition samples analog inputs wired back to the signals of the DAQ (TTL input,
+heartbeat, outputs) on the sample clock of the DAQ, for the whole run:
+
+- A reader thread reads the samples from the acquisition task by chunks into a ring
+  buffer. It never waits for the disk: when the ring buffer is full, the chunk is
+  dropped and counted, and the gap shows in the file
+- A writer thread appends the chunks to the acquisition file, synced to disk after
+  each write
+- The loop sending the steps only gives the trigger time, it never waits for them
+
+Acquisition files (ACQUISITION_EXTENSION) start with a header, then records of
+consecutive samples:
+
+    header: ACQUISITION_MAGIC, uint32 length, JSON (channels, sample rate, start time, sequence)
+    record: int64 first sample, int64 number of samples, int64 trigger sample, int64 read time (perf_counter_ns),
+            then float32 samples, one row of channels per sample
+
+Records are only appended, so a file cut by a crash is read up to its last complete
+record. The last record of a stopped acquisition has no samples. The trigger sample
+is the rising edge of the TTL channel closest to the trigger detected by the run, or
+the detection time when no edge is found, -1 until the trigger is received.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter_ns
+from typing import NamedTuple
+
+import numpy as np
+
+import stimseq
+from stimseq_daq import DaqBackend
+
+ACQUISITION_EXTENSION = ".stimacq"
+ACQUISITION_MAGIC = b"STIMACQ1"
+ACQUISITION_VERSION = 1
+_HEADER_LENGTH = struct.Struct("<I")
+_RECORD = struct.Struct("<qqqq")  # first sample, number of samples, trigger sample, read time
+
+# Names of the acquired TTL input and heartbeat
+TRIGGER_SIGNAL = "TTL"
+HEARTBEAT_SIGNAL = "Heartbeat"
+
+# Const for acquisition wiring: analog input of each acquired signal, and the line or channel wired to it
+# OUTPUT_ADDITION_SECTION
+ACQUISITION_WIRING = {
+    TRIGGER_SIGNAL: (f"{stimseq.DAQ_NAME}/ai0", stimseq.TTL_DI),
+    HEARTBEAT_SIGNAL: (f"{stimseq.DAQ_NAME}/ai1", stimseq.HEARBIT_DO),
+    stimseq.LED: (f"{stimseq.DAQ_NAME}/ai2", stimseq.LED_AO),
+}
+
+# Range of the analog inputs, in V
+ACQUISITION_RANGE = [-10, 10]
+
+# Const for acquisition rate and buffers
+ACQUISITION_RATE = 1000  # Samples per second per channel
+ACQUISITION_CHUNK_SAMPLES = 100  # Samples per channel read at once, 100 ms at ACQUISITION_RATE
+ACQUISITION_RING_CHUNKS = 600  # Chunks held by the ring buffer while the disk is slow, 60 s at ACQUISITION_RATE
+ACQUISITION_DRIVER_BUFFER = 10  # Time in s of samples held by the driver while the reader is late
+ACQUISITION_READ_TIMEOUT = 1  # Time in s added to the duration of a chunk before a read times out
+
+# Const for trigger alignment
+TRIGGER_THRESHOLD = 2.5  # Voltage of the TTL channel above which the trigger is high
+TRIGGER_WINDOW = 20  # Time in ms around the detected trigger in which a TTL rising edge is taken as the trigger
+TRIGGER_EDGES = 64  # Number of last rising edges kept until the trigger is detected
+
+
+class AcquisitionData(NamedTuple):
+    """ Samples of an acquisition file
+
+    Attributes:
+        channels (list[str]): Name of each channel
+        sample_rate (float): Samples per second per channel
+        start_ns (int): perf_counter_ns() time of the start of the acquisition
+        trigger_sample (int): Index of the sample of the trigger, -1 if not received
+        samples (np.ndarray): float32 of shape (samples, channels), NaN for dropped samples
+        complete (bool): False if the acquisition was not stopped, ex: the file was cut by a crash
+        header (dict): Header of the file
+    """
+    channels: list[str]
+    sample_rate: float
+    start_ns: int
+    trigger_sample: int
+    samples: np.ndarray
+    complete: bool
+    header: dict
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def times(self) -> np.ndarray:
+        """ Time of each sample in ms from the trigger, or from the start if the trigger was not received
+
+        Returns:
+            np.ndarray: float64 times
+        """
+        return (np.arange(len(self.samples)) - max(self.trigger_sample, 0)) * 1000 / self.sample_rate
+
+    def channel(self, name:str) -> np.ndarray:
+        """ Samples of a channel
+
+        Args:
+            name (str): Name of the channel
+
+        Returns:
+            np.ndarray: float32 samples
+        """
+        return self.samples[:, self.channels.index(name)]
+
+
+class RingBuffer():
+    """ Fixed number of chunks of samples, put by one thread and taken by another
+
+    Chunks are copied into preallocated slots. A full buffer refuses new chunks
+    instead of blocking the thread putting them.
+    """
+    def __init__(self, n_chunks:int, chunk_samples:int, n_channels:int) -> None:
+        """
+        Args:
+            n_chunks (int): Number of slots
+            chunk_samples (int): Samples per channel of each chunk
+            n_channels (int): Number of channels
+        """
+        self.__data = np.empty((n_chunks, chunk_samples, n_channels), dtype=np.float32)
+        self.__first_samples = np.empty(n_chunks, dtype=np.int64)
+        self.__read_ns = np.empty(n_chunks, dtype=np.int64)
+        self.__head = 0
+        self.__count = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def put(self, first_sample:int, read_ns:int, samples:np.ndarray) -> bool:
+        """ Copy a chunk into the next free slot
+
+        Args:
+            first_sample (int): Index of the first sample of the chunk
+            read_ns (int): perf_counter_ns() time the chunk was read
+            samples (np.ndarray): Samples of shape (channels, chunk_samples)
+
+        Returns:
+            bool: False if the buffer is full, the chunk is dropped
+        """
+        with self.__condition:
+            if self.__count == len(self.__data):
+                return False
+            slot = (self.__head + self.__count) % len(self.__data)
+            self.__data[slot] = samples.T
+            self.__first_samples[slot] = first_sample
+            self.__read_ns[slot] = read_ns
+            self.__count += 1
+            self.__condition.notify()
+        return True
+
+    def get(self) -> list[tuple[int, int, np.ndarray]] | None:
+        """ Take every chunk in the buffer, waits for one
+
+        Returns:
+            list[tuple[int, int, np.ndarray]] | None: First sample, read time and float32 samples of shape (chunk_samples, channels)
+                of each chunk, None once the buffer is closed and empty
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__count or self.__closed)
+            slots = [(self.__head + i) % len(self.__data) for i in range(self.__count)]
+            chunks = [(int(self.__first_samples[slot]), int(self.__read_ns[slot]), self.__data[slot].copy()) for slot in slots]
+            self.__head = (self.__head + self.__count) % len(self.__data)
+            self.__count = 0
+        return chunks or None
+
+    def close(self) -> None:
+        """ No more chunks are put, wakes the thread taking them """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+class Acquisition():
+    """ Acquisition of analog inputs during a run, streamed to a file
+
+    Started before the trigger is waited for and stopped after the outputs are reset,
+    see run_sequence(acquisition=...). Can be started again for another run, to another path.
+    """
+    def __init__(self, path:str, wiring:dict[str, tuple[str, str | None]]|None=None,
+                 sample_rate:float=ACQUISITION_RATE, chunk_samples:int=ACQUISITION_CHUNK_SAMPLES,
+                 ring_chunks:int=ACQUISITION_RING_CHUNKS) -> None:
+        """
+        Args:
+            path (str): Path of the acquisition file
+            wiring (dict[str, tuple[str, str | None]] | None, optional): Analog input of each acquired signal by name,
+                and the line or channel wired to it (None if not wired to the DAQ). Defaults to ACQUISITION_WIRING.
+            sample_rate (float, optional): Samples per second per channel. Defaults to ACQUISITION_RATE.
+            chunk_samples (int, optional): Samples per channel read at once. Defaults to ACQUISITION_CHUNK_SAMPLES.
+            ring_chunks (int, optional): Chunks held while the disk is slow. Defaults to ACQUISITION_RING_CHUNKS.
+        """
+        if sample_rate <= 0:
+            raise ValueError(f"Sample rate must be positive, got {sample_rate}")
+        self.__path = path
+        self.__wiring = dict(ACQUISITION_WIRING if wiring is None else wiring)
+        if not self.__wiring:
+            raise ValueError("No acquired signals")
+        self.__sample_rate = sample_rate
+        self.__chunk_samples = chunk_samples
+        self.__ring_chunks = ring_chunks
+        self.__reset()
+
+    def __reset(self) -> None:
+        self.__daq:DaqBackend | None = None
+        self.__logger = logging.getLogger(stimseq.LOGGER_NAME)
+        self.__file = None
+        self.__reader:threading.Thread | None = None
+        self.__writer:threading.Thread | None = None
+        self.__start_ns = 0
+        self.__stop_ns:int | None = None
+        self.__samples = 0
+        self.__dropped = 0
+        self.__error:Exception | None = None
+        self.__trigger_ns:int | None = None
+        self.__trigger_sample = -1
+        self.__trigger_edge = False
+        self.__edges:deque[int] = deque(maxlen=TRIGGER_EDGES)
+        self.__edges_end = 0
+        self.__ttl_high:bool | None = None
+
+    @property
+    def path(self) -> str:
+        """ Reader for __path """
+        return self.__path
+
+    @path.setter
+    def path(self, path:str) -> None:
+        """ Writer for __path, used by the next start """
+        self.__path = path
+
+    @property
+    def channels(self) -> list[str]:
+        """ Name of each acquired signal, in the order of the samples """
+        return list(self.__wiring)
+
+    @property
+    def sample_rate(self) -> float:
+        """ Reader for __sample_rate """
+        return self.__sample_rate
+
+    @property
+    def is_running(self) -> bool:
+        """ True between start and stop """
+        return self.__reader is not None
+
+    @property
+    def samples(self) -> int:
+        """ Number of samples per channel read so far, dropped ones included """
+        return self.__samples
+
+    @property
+    def dropped_samples(self) -> int:
+        """ Number of samples per channel dropped because the ring buffer was full """
+        return self.__dropped
+
+    @property
+    def trigger_sample(self) -> int:
+        """ Index of the sample of the trigger, -1 until known """
+        return self.__trigger_sample
+
+    @property
+    def error(self) -> Exception | None:
+        """ Error that stopped the reader or the writer, None if none """
+        return self.__error
+
+    def start(self, daq:DaqBackend, device:str=stimseq.DAQ_NAME, sequence:str="",
+              logger:logging.Logger|logging.LoggerAdapter|None=None) -> None:
+        """ Create the acquisition file, start the acquisition task and the threads
+
+        Args:
+            daq (DaqBackend): Opened backend, with its channels configured
+            device (str, optional): Device wired as ACQUISITION_WIRING on DAQ_NAME. Defaults to DAQ_NAME.
+            sequence (str, optional): Path of the run sequence, saved in the header. Defaults to "".
+            logger (logging.Logger | logging.LoggerAdapter | None, optional): Logger of the run. Defaults to the StimSeq logger.
+
+        Raises:
+            RuntimeError: If the acquisition is already running
+        """
+        if self.is_running:
+            raise RuntimeError("Acquisition is already running")
+        self.__reset()
+        if logger is not None:
+            self.__logger = logger
+        physical = {name: stimseq._device_channel(channel, device) for name, (channel, _) in self.__wiring.items()} #pylint: disable=protected-access
+        loopback = {name: stimseq._device_channel(source, device) for name, (_, source) in self.__wiring.items() if source is not None} #pylint: disable=protected-access
+
+        self.__file = open(self.__path, 'wb') #pylint: disable=consider-using-with
+        try:
+            daq.start_acquisition(physical, sample_rate=self.__sample_rate,
+                                  buffer_size=int(ACQUISITION_DRIVER_BUFFER * self.__sample_rate),
+                                  min_val=min(ACQUISITION_RANGE), max_val=max(ACQUISITION_RANGE), loopback=loopback)
+        except Exception:
+            self.__file.close()
+            raise
+        self.__start_ns = perf_counter_ns()
+        self.__daq = daq
+
+        # Header is on disk before the first samples
+        header = json.dumps({"version": ACQUISITION_VERSION, "channels": self.channels, "physical_channels": physical,
+                             "loopback": loopback, "sample_rate": self.__sample_rate, "start_ns": self.__start_ns,
+                             "start_time": datetime.now().isoformat(), "sequence": sequence, "device": device}).encode()
+        self.__file.write(ACQUISITION_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+        self.__sync()
+
+        ring = RingBuffer(self.__ring_chunks, self.__chunk_samples, len(self.__wiring))
+        self.__reader = threading.Thread(target=self.__read, args=(ring,), name="Acquisition Reader", daemon=True)
+        self.__writer = threading.Thread(target=self.__write, args=(ring,), name="Acquisition Writer", daemon=True)
+        self.__writer.start()
+        self.__reader.start()
+        self.__logger.info("Acquisition of %s at %s S/s to %s", ", ".join(f"{name} ({channel})" for name, channel in physical.items()),
+                           self.__sample_rate, self.__path)
+
+    def mark_trigger(self, trigger_ns:int) -> None:
+        """ Give the time the trigger was detected by the run, does not wait
+
+        Args:
+            trigger_ns (int): perf_counter_ns() time of the trigger
+        """
+        self.__trigger_ns = trigger_ns
+
+    def stop(self) -> None:
+        """ Read the samples up to now, stop the acquisition task and close the file """
+        if not self.is_running:
+            return
+        self.__stop_ns = perf_counter_ns()
+        self.__reader.join()
+        try:
+            self.__daq.stop_acquisition()
+        finally:
+            self.__writer.join()
+            self.__reader = self.__writer = self.__daq = None
+
+        self.__logger.info("Acquired %i samples per channel to %s, trigger at sample %i",
+                           self.__samples, self.__path, self.__trigger_sample)
+        if self.__dropped:
+            self.__logger.warning("%i samples per channel of the acquisition were dropped, the disk was too slow", self.__dropped)
+        if self.__error is not None:
+            self.__logger.error("Acquisition stopped early: %r", self.__error)
+
+    def __sample_ns(self, sample:int) -> int:
+        # Time of a sample, from the start of the acquisition
+        return self.__start_ns + int(sample * 1e9 / self.__sample_rate)
+
+    def __read(self, ring:RingBuffer) -> None:
+        # Reader thread: samples go from the driver to the ring buffer, never waiting for the writer
+        data = np.empty((len(self.__wiring), self.__chunk_samples))
+        timeout = ACQUISITION_READ_TIMEOUT + self.__chunk_samples / self.__sample_rate
+        try:
+            while self.__stop_ns is None or self.__sample_ns(self.__samples) <= self.__stop_ns:
+                self.__daq.read_acquisition(data, timeout=timeout)
+                if not ring.put(self.__samples, perf_counter_ns(), data):
+                    self.__dropped += self.__chunk_samples
+                self.__samples += self.__chunk_samples
+        except Exception as error: #pylint: disable=broad-exception-caught
+            self.__error = error
+        finally:
+            ring.close()
+
+    def __write(self, ring:RingBuffer) -> None:
+        # Writer thread: records are appended and synced, so they survive a crash of the run
+        try:
+            while (chunks := ring.get()) is not None:
+                for first_sample, read_ns, samples in chunks:
+                    self.__find_trigger(first_sample, samples)
+                    self.__file.write(_RECORD.pack(first_sample, len(samples), self.__trigger_sample, read_ns))
+                    self.__file.write(samples.tobytes())
+                self.__sync()
+            # Record without samples, the acquisition was stopped
+            self.__file.write(_RECORD.pack(self.__samples, 0, self.__trigger_sample, perf_counter_ns()))
+            self.__sync()
+        except OSError as error:
+            self.__error = error
+        finally:
+            self.__file.close()
+
+    def __sync(self) -> None:
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def __find_trigger(self, first_sample:int, samples:np.ndarray) -> None:
+        # Keep the rising edges of the TTL channel, the trigger is the one closest to the detected trigger
+        if TRIGGER_SIGNAL in self.__wiring:
+            high = samples[:, self.channels.index(TRIGGER_SIGNAL)] >= TRIGGER_THRESHOLD
+            rising = np.flatnonzero(high[1:] & ~high[:-1]) + 1
+            # Edge between chunks, unless samples were dropped in between
+            if self.__ttl_high is False and high[0] and first_sample == self.__edges_end:
+                rising = np.insert(rising, 0, 0)
+            self.__edges.extend((first_sample + rising).tolist())
+            self.__ttl_high = bool(high[-1])
+            self.__edges_end = first_sample + len(samples)
+
+        if self.__trigger_edge or self.__trigger_ns is None:
+            return
+        detected = round((self.__trigger_ns - self.__start_ns) * self.__sample_rate / 1e9)
+        window = TRIGGER_WINDOW * self.__sample_rate / 1000
+        edges = [edge for edge in self.__edges if abs(edge - detected) <= window]
+        if edges:
+            self.__trigger_sample = min(edges, key=lambda edge: abs(edge - detected))
+            self.__trigger_edge = True
+        else:
+            self.__trigger_sample = detected
+
+
+# Method to read an acquisition file, up to its last complete record
+def read_acquisition_file(path:str) -> AcquisitionData:
+    """ Read an acquisition file, ignoring an incomplete last record
+
+    Args:
+        path (str): Path of the acquisition file
+
+    Raises:
+        ValueError: If the file is not an acquisition file
+
+    Returns:
+        AcquisitionData: The samples, aligned to the trigger by AcquisitionData.times()
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    header_start = len(ACQUISITION_MAGIC) + _HEADER_LENGTH.size
+    if not content.startswith(ACQUISITION_MAGIC) or len(content) < header_start:
+        raise ValueError(f"{path} is not an acquisition file")
+    (header_length,) = _HEADER_LENGTH.unpack_from(content, len(ACQUISITION_MAGIC))
+    if len(content) < header_start + header_length:
+        raise ValueError(f"Header of {path} is incomplete")
+    header = json.loads(content[header_start:header_start + header_length])
+    n_channels = len(header["channels"])
+
+    records = []
+    trigger_sample = -1
+    complete = False
+    n_read = 0
+    offset = header_start + header_length
+    while offset + _RECORD.size <= len(content):
+        first_sample, n_samples, record_trigger, _ = _RECORD.unpack_from(content, offset)
+        end = offset + _RECORD.size + n_samples * n_channels * 4
+        if end > len(content):
+            break
+        trigger_sample = record_trigger
+        if n_samples == 0:
+            # Samples read by the acquisition, last ones included if dropped
+            complete = True
+            n_read = first_sample
+            break
+        records.append((first_sample, np.frombuffer(content, dtype=np.float32, count=n_samples * n_channels,
+                                                    offset=offset + _RECORD.size).reshape(n_samples, n_channels)))
+        offset = end
+
+    # Dropped samples are left as NaN
+    samples = np.full((max([n_read, *(first + len(chunk) for first, chunk in records)]), n_channels), np.nan, dtype=np.float32)
+    for first_sample, chunk in records:
+        samples[first_sample:first_sample + len(chunk)] = chunk
+    return AcquisitionData(channels=header["channels"], sample_rate=header["sample_rate"], start_ns=header["start_ns"],
+                           trigger_sample=trigger_sample, samples=samples, complete=complete, header=header)
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Read an acquisition file recorded during a run, and export it as csv")
+    parser.add_argument('path', type=str,
+                        help=f"Acquisition file ({ACQUISITION_EXTENSION})")
+    parser.add_argument('--csv', dest="csv_path", type=str,
+                        help="Path of a csv file receiving the time from the trigger (ms) and the samples of each channel")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        parser.error(f"{args.path} is not a valid path")
+    acquisition = read_acquisition_file(args.path)
+    dropped = int(np.isnan(acquisition.samples[:, 0]).sum()) if len(acquisition) else 0
+    print(f"{len(acquisition)} samples of {', '.join(acquisition.channels)} at {acquisition.sample_rate} S/s, "
+          f"{dropped} dropped, trigger at sample {acquisition.trigger_sample}"
+          f"{'' if acquisition.complete else ', acquisition was not stopped (file cut)'}")
+    if args.csv_path:
+        np.savetxt(args.csv_path, np.column_stack([acquisition.times(), acquisition.samples]), delimiter=",",
+                   header=",".join(["time", *acquisition.channels]), comments="", fmt="%.6g")
+        print(f"Exported to {args.csv_path}")
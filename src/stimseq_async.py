@@ -0,0 +1,278 @@
+#pylint: disable=line-too-long
+"""Asyncio API to arm, run and cancel sequences
+
+An AsyncStimSeq drives one rig through a StimSeqSession, so a single event loop can
+coordinate several rigs, cameras or a behavioral task without a thread per rig in
+the application:
+
+- Blocking calls of a rig (parsing, opening the tasks, the run) are done by its own
+  executor thread. The steps are timed by this thread, not by the event loop
+- arm() returns once the rig waits for the trigger, wait_trigger() once the trigger
+  is received and run() once the outputs are reset after the last step. Progress
+  messages and the end of the run are passed to the event loop with call_soon_threadsafe
+- Cancelling a task awaiting arm(), wait_trigger() or run() (ex: task.cancel() or
+  asyncio.timeout) stops the run with its cancel event: outputs are reset to 0 as for
+  any aborted run, and the cancellation is raised once they are
+"""
+import argparse
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event
+from typing import Any, Callable
+
+from stimseq import (DAQ_NAME, LATE_CATCH_UP, LATE_POLICIES, LOG_FILE, LOG_LEVELS, LOGGER_NAME, Progress,
+                     RunTiming, SequenceAbortedError, StimSeqSession)
+from stimseq_daq import DaqBackend
+
+
+# Method to resolve a future of the event loop, unless it is already done
+def _set_result(future:asyncio.Future, result:Any) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+class _LoopQueue():
+    """ Progress messages of a run thread, put in an asyncio.Queue by the event loop
+
+    Has the put() method used by run_sequence on its progress queue.
+    """
+    def __init__(self, loop:asyncio.AbstractEventLoop, progress:asyncio.Queue) -> None:
+        self.__loop = loop
+        self.__progress = progress
+
+    def put(self, item:Progress) -> None:
+        """ Put a message in the queue from any thread """
+        self.__loop.call_soon_threadsafe(self.__progress.put_nowait, item)
+
+
+class AsyncStimSeq():
+    """ StimSeqSession of a rig, driven from an event loop
+
+    The rig is opened by open() and released by close(), or used as an async context
+    manager. Each run is started by arm(), then awaited by run().
+    """
+    def __init__(self, path_to_sequence:str, enable_heartbeat:bool=True, **kwargs) -> None:
+        """
+        Args:
+            path_to_sequence (str): Path to the first sequence file, parsed by open()
+            enable_heartbeat (bool, optional): Configures the heartbeat line, for all runs. Defaults to True.
+            **kwargs: Arguments of StimSeq (log_file, log_lvl, use_cache, backend, device, min_timestep)
+        """
+        self.__path = path_to_sequence
+        self.__session_kwargs = {"enable_heartbeat": enable_heartbeat, **kwargs}
+        self.__session:StimSeqSession | None = None
+        # One thread per rig, so runs of several rigs do not wait for each other
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"stimseq-{kwargs.get('device') or DAQ_NAME}")
+        self.__cancel_event = Event()
+        self.__run:asyncio.Future | None = None
+        self.__trigger:asyncio.Future | None = None
+
+    @property
+    def session(self) -> StimSeqSession:
+        """ Reader for __session, created by open()
+
+        Raises:
+            RuntimeError: If the rig was not opened
+        """
+        if self.__session is None:
+            raise RuntimeError("Rig is not opened")
+        return self.__session
+
+    @property
+    def is_armed(self) -> bool:
+        """ True from arm() to the end of the run """
+        return self.__run is not None and not self.__run.done()
+
+    async def __aenter__(self) -> "AsyncStimSeq":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def __call(self, function:Callable, *args, **kwargs) -> Any:
+        # Blocking call done by the thread of the rig
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(function, *args, **kwargs))
+
+    async def open(self) -> None:
+        """ Parse the first sequence, then create the tasks, add the channels and commit the tasks """
+        if self.__session is None:
+            self.__session = await self.__call(StimSeqSession, self.__path, **self.__session_kwargs)
+        await self.__call(self.__session.open)
+
+    async def close(self) -> None:
+        """ Cancel the run if any, then release the tasks and the thread of the rig. The rig can not be opened again """
+        if self.is_armed:
+            self.cancel()
+            await asyncio.wait([self.__run])
+        if self.__session is not None:
+            await self.__call(self.__session.close)
+        self.__executor.shutdown()
+
+    async def load(self, path_to_sequence:str) -> None:
+        """ Parse a sequence file, run by the next arm()
+
+        Raises:
+            RuntimeError: If the rig is armed
+        """
+        if self.is_armed:
+            raise RuntimeError("Can not load a sequence while the rig is armed")
+        await self.__call(setattr, self.session, "seq_path", path_to_sequence)
+
+    def cancel(self) -> None:
+        """ Stop the run while waiting for the trigger or between steps, outputs are reset to 0. Can be called from any thread """
+        self.__cancel_event.set()
+
+    async def arm(self, progress:asyncio.Queue|None=None, **run_kwargs) -> None:
+        """ Start the run of the loaded sequence, and return once the rig waits for the trigger
+
+        Args:
+            progress (asyncio.Queue | None, optional): Queue receiving Progress messages during the run,
+                at most every PROGRESS_INTERVAL. Defaults to None.
+            **run_kwargs: Arguments of StimSeqSession.run_sequence (ex: late_policy, trigger_timeout),
+                cancel_event, progress and wait_start excepted
+
+        Raises:
+            RuntimeError: If the rig is not opened or is already armed
+            SequenceAbortedError: If the run is cancelled before waiting for the trigger
+        """
+        session = self.session
+        if self.is_armed:
+            raise RuntimeError("Rig is already armed")
+        loop = asyncio.get_running_loop()
+        self.__cancel_event = Event()
+        armed = loop.create_future()
+        trigger = self.__trigger = loop.create_future()
+
+        def wait_start(daq:DaqBackend, timeout:float|None, cancel_event:Event|None) -> int | None:
+            # Called by the run thread when the sequence is ready, instead of its own wait for the trigger
+            loop.call_soon_threadsafe(_set_result, armed, None)
+            trigger_ns = daq.wait_trigger(timeout=timeout, cancel_event=cancel_event)
+            if trigger_ns is not None:
+                loop.call_soon_threadsafe(_set_result, trigger, trigger_ns)
+            return trigger_ns
+
+        self.__run = loop.run_in_executor(self.__executor, partial(session.run_sequence, cancel_event=self.__cancel_event,
+                                                                   progress=_LoopQueue(loop, progress) if progress is not None else None,
+                                                                   wait_start=wait_start, **run_kwargs))
+        self.__run.add_done_callback(partial(self.__run_done, armed, trigger))
+        await self.__wait(armed)
+
+    @staticmethod
+    def __run_done(armed:asyncio.Future, trigger:asyncio.Future, run:asyncio.Future) -> None:
+        # A run ending before the trigger ends the waits for it, with the error of the run
+        error = run.exception() if not run.cancelled() else SequenceAbortedError("Run cancelled")
+        for future in (armed, trigger):
+            if not future.done():
+                future.set_exception(error if error is not None else SequenceAbortedError("Run ended before the trigger"))
+                # Errors are raised by the awaited run, not reported again when these futures are not awaited
+                future.exception()
+
+    async def __wait(self, future:asyncio.Future) -> Any:
+        # Cancelling the caller stops the run, the cancellation is raised once outputs are reset
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+            await asyncio.wait([self.__run])
+            raise
+
+    async def wait_trigger(self) -> int:
+        """ Wait for the trigger of the armed run
+
+        Raises:
+            RuntimeError: If the rig was not armed
+            SequenceAbortedError: If the run ends before the trigger, ex: trigger_timeout or cancel()
+
+        Returns:
+            int: perf_counter_ns() value of the trigger
+        """
+        if self.__trigger is None:
+            raise RuntimeError("Rig is not armed")
+        return await self.__wait(self.__trigger)
+
+    async def run(self, progress:asyncio.Queue|None=None, **run_kwargs) -> RunTiming | None:
+        """ Wait for the end of the armed run, the rig is armed first if needed
+
+        Args:
+            progress (asyncio.Queue | None, optional): Progress queue, see arm(). Only used if the rig is not armed. Defaults to None.
+            **run_kwargs: Arguments of the run, see arm(). Only used if the rig is not armed
+
+        Raises:
+            SequenceAbortedError: If a step is late with LATE_ABORT policy, if the trigger is not received
+                or if the run is cancelled by cancel(). Outputs are reset to 0 before
+
+        Returns:
+            RunTiming | None: Timing of the run
+        """
+        if not self.is_armed:
+            await self.arm(progress, **run_kwargs)
+        await self.__wait(self.__run)
+        return self.session.last_run
+
+
+async def _main(paths:dict[str, str], timeout:float|None, log_lvl:int, log_file:str, **run_kwargs) -> None:
+    # Run of every device with its progress, cancelled after the timeout
+    async def report(logger:logging.Logger | logging.LoggerAdapter, progress:asyncio.Queue) -> None:
+        while True:
+            message = await progress.get()
+            logger.info("%i/%i steps, %i late, max lateness %.3f ms", message.steps_done, message.steps,
+                        message.late_steps, message.max_lateness)
+
+    async def run(device:str, path:str) -> None:
+        progress:asyncio.Queue = asyncio.Queue()
+        async with AsyncStimSeq(path, device=device, log_lvl=log_lvl, log_file=log_file) as rig:
+            # Messages are prefixed with the name of the device by its logger
+            logger = rig.session.logger
+            reporter = asyncio.create_task(report(logger, progress))
+            try:
+                await rig.arm(progress, **run_kwargs)
+                logger.info("Armed, waiting for the trigger")
+                await rig.wait_trigger()
+                logger.info("Trigger received")
+                timing = await rig.run()
+                logger.info("Done, %i late steps, max lateness %.3f ms", timing.late_steps, timing.max_lateness)
+            except SequenceAbortedError as error:
+                logger.error("Aborted: %s", error)
+            finally:
+                reporter.cancel()
+
+    try:
+        async with asyncio.timeout(timeout):
+            await asyncio.gather(*(run(device, path) for device, path in paths.items()))
+    except TimeoutError:
+        logging.getLogger(LOGGER_NAME).warning("Runs cancelled after %s s, outputs were reset", timeout)
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Run stimulation sequences on several DAQs from one event loop, each one started by its own trigger")
+    parser.add_argument('--devices', dest="devices", nargs='+', type=str, default=[DAQ_NAME],
+                        help="Names of the devices as defined in NI MAX, each one wired as DAQ_WIRING")
+    parser.add_argument('--paths', dest="paths", nargs='+', type=str, required=True,
+                        help="Sequence file run by every device, or one sequence file per device")
+    parser.add_argument('--log', dest="log_lvl", type=str,
+                        choices=LOG_LEVELS.keys(),
+                        help="Select the logging level")
+    parser.add_argument('--late-policy', dest="late_policy", type=str, default=LATE_CATCH_UP,
+                        choices=LATE_POLICIES,
+                        help="Handling of late steps")
+    parser.add_argument('--trigger-timeout', dest="trigger_timeout", type=float,
+                        help="Time in s to wait for the trigger before aborting. Waits forever if not given")
+    parser.add_argument('--timeout', dest="timeout", type=float,
+                        help="Time in s after which the runs are cancelled and outputs reset. Runs until the end if not given")
+    args = parser.parse_args()
+
+    if len(args.paths) not in (1, len(args.devices)):
+        parser.error("Give one sequence file, or one per device")
+    if len(set(args.devices)) != len(args.devices):
+        parser.error("Devices must be different")
+    sequence_paths = args.paths * len(args.devices) if len(args.paths) == 1 else args.paths
+
+    asyncio.run(_main(dict(zip(args.devices, sequence_paths)), timeout=args.timeout,
+                      log_lvl=LOG_LEVELS[args.log_lvl or "INFO"], log_file=os.path.join(os.path.dirname(__file__), LOG_FILE),
+                      late_policy=args.late_policy, trigger_timeout=args.trigger_timeout))
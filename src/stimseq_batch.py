@@ -0,0 +1,289 @@
+#pylint: disable=line-too-long
+"""Run a playlist of sequences back to back
+
+Trials are run in a single StimSeqSession, each one started by the trigger signal,
+with an interval between the end of a trial and the arming of the next one. While
+a trial runs, the next sequence is parsed by a background process, so the parsing
+does not hold the GIL while the steps are timed.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Event
+from time import perf_counter
+from typing import NamedTuple
+
+from stimseq import (LATE_CATCH_UP, LATE_POLICIES, LOG_FILE, LOG_LEVELS, LOGGER_NAME, AO_MAX_SAMPLE_RATE,
+                     CompiledSequence, SequenceAbortedError, StimSeqSession, ValidationReport, load_sequence)
+from stimseq_daq import DaqBackend
+
+# Time in s between the end of a trial and the arming of the next one
+INTER_TRIAL_INTERVAL = 1
+
+# Lines of playlist files starting with this character are ignored, as in sequence files
+PLAYLIST_COMMENT = "*"
+
+TRIAL_STATUSES = [
+    TRIAL_DONE := "done",
+    TRIAL_ABORTED := "aborted",
+    TRIAL_FAILED := "failed",
+]
+
+
+class TrialResult(NamedTuple):
+    """ Outcome of one trial of a batch """
+    index:int
+    path:str
+    status:str
+    message:str = ""
+
+
+# Method to read a playlist file
+def read_playlist(path:str) -> list[str]:
+    """ Read a playlist file, one sequence file per line
+
+    Relative paths are relative to the playlist file. Empty lines and lines
+    starting with PLAYLIST_COMMENT are ignored.
+
+    Args:
+        path (str): Path to the playlist file
+
+    Returns:
+        list[str]: Paths of the sequence files
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(os.path.dirname(path), line) for line in lines
+            if line and not line.startswith(PLAYLIST_COMMENT)]
+
+
+# Method to build the ordered list of trials
+def make_playlist(paths:list[str], repeats:int=1, shuffle:bool=False, seed:int|None=None) -> list[str]:
+    """ Repeat the sequences, and shuffle them within each repetition
+
+    Args:
+        paths (list[str]): Paths of the sequence files
+        repeats (int, optional): Number of blocks, each running every sequence once. Defaults to 1.
+        shuffle (bool, optional): Randomize the order of the sequences in each block. Defaults to False.
+        seed (int | None, optional): Seed of the random order, for reproducible playlists. Defaults to None.
+
+    Returns:
+        list[str]: Paths of the sequence file of each trial
+    """
+    rng = random.Random(seed)
+    playlist = []
+    for _ in range(repeats):
+        block = list(paths)
+        if shuffle:
+            rng.shuffle(block)
+        playlist += block
+    return playlist
+
+
+# Method to parse the sequence of a trial in the prefetch process
+def _parse_trial(path:str, use_cache:bool, min_timestep:int) -> tuple[CompiledSequence, ValidationReport]:
+    # The process has no log handler, the report of the sequence is logged by the session when the trial is loaded
+    return load_sequence(path, use_cache, logging.getLogger(LOGGER_NAME), min_timestep)
+
+
+class BatchRunner():
+    """ Run trials of a playlist in a single DAQ session, parsing the next trial during the current one
+    """
+    def __init__(
+            self,
+            playlist:list[str],
+            inter_trial_interval:float=INTER_TRIAL_INTERVAL,
+            stop_on_abort:bool=False,
+            enable_heartbeat:bool=True,
+            log_file:str=os.path.join(os.path.dirname(__file__), LOG_FILE),
+            log_lvl=logging.INFO,
+            use_cache:bool=True,
+            backend:DaqBackend|None=None,
+        ) -> None:
+        """
+        Args:
+            playlist (list[str]): Path of the sequence file of each trial
+            inter_trial_interval (float, optional): Time in s between the end of a trial and the arming of the next one.
+                Defaults to INTER_TRIAL_INTERVAL.
+            stop_on_abort (bool, optional): Stop the batch when a trial is aborted or fails. Defaults to False.
+            enable_heartbeat (bool, optional): Enables the heartbeat signal. Defaults to True.
+            log_file (str, optional): Path of the log file. Defaults to LOG_FILE next to this file.
+            log_lvl (optional): Logging level. Defaults to logging.INFO.
+            use_cache (bool, optional): Use the cache of parsed sequences. Defaults to True.
+            backend (DaqBackend | None, optional): Access to the DAQ. Defaults to NidaqmxBackend.
+        """
+        if not playlist:
+            raise ValueError("Playlist is empty")
+        if inter_trial_interval < 0:
+            raise ValueError(f"Inter trial interval must be positive, got {inter_trial_interval}")
+
+        self.__playlist = list(playlist)
+        self.__inter_trial_interval = inter_trial_interval
+        self.__stop_on_abort = stop_on_abort
+        self.__use_cache = use_cache
+        self.__results:list[TrialResult] = []
+
+        # The session parses the first trial
+        self.__session = StimSeqSession(self.__playlist[0], enable_heartbeat=enable_heartbeat, log_file=log_file,
+                                        log_lvl=log_lvl, use_cache=use_cache, backend=backend)
+        self.__logger = self.__session.logger
+
+    @property
+    def playlist(self) -> list[str]:
+        """ Reader for __playlist """
+        return list(self.__playlist)
+
+    @property
+    def session(self) -> StimSeqSession:
+        """ Reader for __session """
+        return self.__session
+
+    @property
+    def results(self) -> list[TrialResult]:
+        """ Reader for __results, one result per trial run so far """
+        return list(self.__results)
+
+    def run(self, cancel_event:Event|None=None, **run_kwargs) -> list[TrialResult]:
+        """ Run every trial of the playlist
+
+        Args:
+            cancel_event (Event | None, optional): Event stopping the batch when set, during a trial
+                or an inter trial interval. Defaults to None.
+            **run_kwargs: Arguments of StimSeqSession.run_sequence, used for every trial
+
+        Returns:
+            list[TrialResult]: Result of each trial run
+        """
+        cancel_event = cancel_event if cancel_event is not None else Event()
+        self.__results = []
+        self.__logger.info("Starting batch of %i trials", len(self.__playlist))
+
+        try:
+            self.__run_trials(cancel_event, run_kwargs)
+        finally:
+            # Trials run so far are summarized, even if the batch is interrupted
+            self.__log_summary()
+        return self.results
+
+    def __run_trials(self, cancel_event:Event, run_kwargs:dict) -> None:
+        # Trials in order, until the end of the playlist, the cancel event or a failed trial with stop_on_abort
+        n_trials = len(self.__playlist)
+        # Spawned on every platform, forking would copy the threads of the session (ex: logging thread)
+        with self.__session, ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as prefetch:
+            upcoming:Future | None = None
+            trial_end = None
+            for index, path in enumerate(self.__playlist):
+                # The first trial is parsed by the session, the next ones by the prefetch process
+                if upcoming is not None:
+                    try:
+                        self.__session.set_parsed_sequence(path, *upcoming.result())
+                    except (OSError, ValueError) as error:
+                        self.__logger.error("Trial %i/%i: could not load %s: %s", index + 1, n_trials, path, error)
+                        self.__results.append(TrialResult(index, path, TRIAL_FAILED, str(error)))
+                        upcoming = self.__prefetch(prefetch, index + 1)
+                        if self.__stop_on_abort:
+                            break
+                        continue
+                upcoming = self.__prefetch(prefetch, index + 1)
+
+                # Inter trial interval, measured from the end of the previous trial
+                if trial_end is not None:
+                    remaining = trial_end + self.__inter_trial_interval - perf_counter()
+                    if remaining > 0 and cancel_event.wait(remaining):
+                        break
+                if cancel_event.is_set():
+                    break
+
+                self.__logger.info("Trial %i/%i: %s", index + 1, n_trials, path)
+                try:
+                    self.__session.run_sequence(cancel_event=cancel_event, **run_kwargs)
+                    self.__results.append(TrialResult(index, path, TRIAL_DONE))
+                except SequenceAbortedError as error:
+                    self.__results.append(TrialResult(index, path, TRIAL_ABORTED, str(error)))
+                    if cancel_event.is_set() or self.__stop_on_abort:
+                        break
+                except Exception as error: #pylint: disable=broad-exception-caught
+                    # Ex: DAQ error or timeout, outputs were reset by run_sequence if the DAQ still answers
+                    self.__logger.exception("Trial %i/%i: run failed", index + 1, n_trials)
+                    self.__results.append(TrialResult(index, path, TRIAL_FAILED, f"{type(error).__name__}: {error}"))
+                    if self.__stop_on_abort:
+                        break
+                trial_end = perf_counter()
+
+            if upcoming is not None:
+                upcoming.cancel()
+
+    def __prefetch(self, prefetch:ProcessPoolExecutor, index:int) -> Future | None:
+        # Parse the sequence of a trial in the background, None after the last trial
+        if index >= len(self.__playlist):
+            return None
+        return prefetch.submit(_parse_trial, self.__playlist[index], self.__use_cache, self.__session.min_timestep)
+
+    def __log_summary(self) -> None:
+        counts = {status: sum(result.status == status for result in self.__results) for status in TRIAL_STATUSES}
+        self.__logger.info("Batch finished: %i/%i trials run, %s", len(self.__results), len(self.__playlist),
+                           ", ".join(f"{count} {status}" for status, count in counts.items()))
+        for result in self.__results:
+            if result.status != TRIAL_DONE:
+                self.__logger.warning("Trial %i (%s) %s: %s", result.index + 1, result.path, result.status, result.message)
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Run a playlist of stimulation sequences, each started by the trigger signal")
+    parser.add_argument('paths', nargs='*', type=str,
+                        help="Sequence files, in playlist order")
+    parser.add_argument('--playlist', dest="playlist", type=str,
+                        help="Playlist file, one sequence file per line. Used instead of paths")
+    parser.add_argument('--repeat', dest="repeats", type=int, default=1,
+                        help="Number of times the playlist is run")
+    parser.add_argument('--shuffle', dest="shuffle",
+                        help="Used to randomize the order of the sequences in each repetition",
+                        action='store_true')
+    parser.add_argument('--seed', dest="seed", type=int,
+                        help="Seed of the random order. Drawn and logged if not given")
+    parser.add_argument('--iti', dest="inter_trial_interval", type=float, default=INTER_TRIAL_INTERVAL,
+                        help="Time in s between the end of a trial and the arming of the next one")
+    parser.add_argument('--stop-on-abort', dest="stop_on_abort",
+                        help="Used to stop the batch when a trial is aborted",
+                        action='store_true')
+    parser.add_argument('--log', dest="log_lvl", type=str,
+                        choices=LOG_LEVELS.keys(),
+                        help="Select the logging level")
+    parser.add_argument('--disable-heartbeat', dest="disable_heartbeat",
+                        help="Used to disable heartbeat output",
+                        action='store_true')
+    parser.add_argument('--no-cache', dest="no_cache",
+                        help="Used to parse the sequence files even if they are in the cache",
+                        action='store_true')
+    parser.add_argument('--late-policy', dest="late_policy", type=str, default=LATE_CATCH_UP,
+                        choices=LATE_POLICIES,
+                        help="Handling of late steps")
+    parser.add_argument('--ao-rate', dest="ao_sample_rate", type=float,
+                        help=f"Sample rate (S/s) for hardware timed analog outputs, max {AO_MAX_SAMPLE_RATE}. Analog outputs are software timed if not given")
+    parser.add_argument('--trigger-timeout', dest="trigger_timeout", type=float,
+                        help="Time in s to wait for the trigger signal of each trial before aborting it. Waits forever if not given")
+    args = parser.parse_args()
+
+    sequences = read_playlist(args.playlist) if args.playlist else args.paths
+    if not sequences:
+        parser.error("No sequence files given")
+    if args.shuffle and args.seed is None:
+        args.seed = random.randrange(2**32)
+
+    runner = BatchRunner(make_playlist(sequences, repeats=args.repeats, shuffle=args.shuffle, seed=args.seed),
+                         inter_trial_interval=args.inter_trial_interval,
+                         stop_on_abort=args.stop_on_abort,
+                         enable_heartbeat=not args.disable_heartbeat,
+                         log_lvl=LOG_LEVELS[args.log_lvl or "INFO"],
+                         log_file=os.path.join(os.path.dirname(__file__), LOG_FILE),
+                         use_cache=not args.no_cache)
+    if args.shuffle:
+        runner.session.logger.info("Random order seed: %i", args.seed)
+
+    runner.run(late_policy=args.late_policy, ao_sample_rate=args.ao_sample_rate,
+               trigger_timeout=args.trigger_timeout)
@@ -0,0 +1,250 @@
+#pylint: disable=line-too-long
+"""Calibration of the timing of a DAQ, and of the minimum time step it can keep up with
+
+A calibration opens the device with the channels of a run (DAQ_WIRING, heartbeat
+included), commits them as a StimSeqSession does, and measures:
+
+- write latency: bursts of steps written back to back, each step being a DO write of
+  every port then an AO write, the longest step of run_sequence. Outputs stay at 0,
+  only the heartbeat line toggles at each step. Bursts are separated by a pause, so
+  writes after an idle bus are measured too. The first CALIBRATION_WARMUP steps are
+  not measured, as the first writes of a run are not timed by the previous steps
+- sleep overshoot: time a sleep lasts beyond its requested duration, for durations up
+  to CANCEL_CHECK_INTERVAL, as the sleeps of DeadlineScheduler.wait
+
+The scheduler busy loops during the last SPIN_WINDOW before a step, so only the
+overshoot beyond it delays the step. The minimum time step of the device is the
+CALIBRATION_PERCENTILE of the step latency, plus the CALIBRATION_PERCENTILE of the
+overshoot beyond the spin window, times CALIBRATION_MARGIN, rounded up to the ms.
+
+Profiles are saved to TIMING_PROFILE_DIR/<device>.json, StimSeq then validates the
+sequences of this device against their minimum time step instead of MIN_TIMESTEP.
+A profile is only used with the channels it was measured with, and must be measured
+again when the USB controller or the load of the computer change.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+from datetime import datetime
+from time import perf_counter_ns, sleep
+
+import numpy as np
+
+import stimseq
+from stimseq_daq import DaqBackend, NidaqmxBackend
+
+# Number of steps written back to back in each burst
+CALIBRATION_WRITES = 1000
+
+# Number of bursts of writes
+CALIBRATION_BURSTS = 10
+
+# Time in ms between two bursts
+CALIBRATION_BURST_PAUSE = 100
+
+# Number of steps written before the measured bursts
+CALIBRATION_WARMUP = 20
+
+# Number of sleeps measured, with durations drawn between 0 and CANCEL_CHECK_INTERVAL
+CALIBRATION_SLEEPS = 1000
+
+# Percentile of the latencies the minimum time step is computed from
+CALIBRATION_PERCENTILE = 99.9
+
+# Factor applied to the measured latencies of a step for the minimum time step
+CALIBRATION_MARGIN = 1.2
+
+# Percentiles of each distribution saved in the profile, with the max
+PROFILE_PERCENTILES = [50, 99, CALIBRATION_PERCENTILE]
+
+
+# Method to summarize a distribution of durations
+def _distribution(durations_ns:np.ndarray) -> dict[str, float]:
+    """ Percentiles and max of durations
+
+    Args:
+        durations_ns (np.ndarray): Durations in ns
+
+    Returns:
+        dict[str, float]: "p50", "p99", "p99.9" and "max" durations in ms
+    """
+    values = np.percentile(durations_ns, PROFILE_PERCENTILES) / 1e6
+    return {**{f"p{percentile:g}": float(value) for percentile, value in zip(PROFILE_PERCENTILES, values)},
+            "max": float(durations_ns.max()) / 1e6}
+
+
+def measure_writes(daq:DaqBackend, bursts:int=CALIBRATION_BURSTS, writes:int=CALIBRATION_WRITES,
+                   burst_pause:float=CALIBRATION_BURST_PAUSE) -> dict[str, np.ndarray]:
+    """ Time bursts of steps written to an opened backend, with the channels of a run
+
+    Outputs are written at 0, the heartbeat line toggles at each step. They are reset
+    to 0 at the end, even if a write fails.
+
+    Args:
+        daq (DaqBackend): Opened backend, with the channels of _channel_wiring
+        bursts (int, optional): Number of bursts. Defaults to CALIBRATION_BURSTS.
+        writes (int, optional): Number of steps of each burst. Defaults to CALIBRATION_WRITES.
+        burst_pause (float, optional): Time in ms between two bursts. Defaults to CALIBRATION_BURST_PAUSE.
+
+    Returns:
+        dict[str, np.ndarray]: Durations in ns of the "do" and "ao" writes and of the whole "step", one per measured step
+    """
+    do_words = np.zeros(len(stimseq.DO_PORTS), dtype=np.uint32)
+    ao_values = np.zeros(len(stimseq.AO_DATA_KEYS))
+    heartbeat_port = stimseq.DO_PORTS.index(stimseq.HEARTBEAT_LINE[0])
+    heartbeat_bit = np.uint32(1 << stimseq.HEARTBEAT_LINE[1])
+    times = np.empty((bursts * writes, 3), dtype=np.int64)
+    try:
+        for step in range(-CALIBRATION_WARMUP, bursts * writes):
+            if step >= 0 and step % writes == 0:
+                sleep(burst_pause / 1000)
+            do_words[heartbeat_port] ^= heartbeat_bit
+            start = perf_counter_ns()
+            daq.write_do(do_words, timeout=stimseq.WRITE_TIMEOUT)
+            do_end = perf_counter_ns()
+            daq.write_ao(ao_values, timeout=stimseq.WRITE_TIMEOUT)
+            if step >= 0:
+                times[step] = (start, do_end, perf_counter_ns())
+    finally:
+        daq.write_do(np.zeros(len(stimseq.DO_PORTS), dtype=np.uint32), timeout=stimseq.WRITE_TIMEOUT)
+        daq.write_ao(np.zeros(len(stimseq.AO_DATA_KEYS)), timeout=stimseq.WRITE_TIMEOUT)
+    return {"do": times[:, 1] - times[:, 0], "ao": times[:, 2] - times[:, 1], "step": times[:, 2] - times[:, 0]}
+
+
+def measure_sleeps(sleeps:int=CALIBRATION_SLEEPS, seed:int=0) -> np.ndarray:
+    """ Time sleeps of random durations, up to CANCEL_CHECK_INTERVAL
+
+    Args:
+        sleeps (int, optional): Number of sleeps. Defaults to CALIBRATION_SLEEPS.
+        seed (int, optional): Seed of the durations. Defaults to 0.
+
+    Returns:
+        np.ndarray: Overshoot of each sleep in ns, negative if it ended early
+    """
+    rng = random.Random(seed)
+    overshoots = np.empty(sleeps, dtype=np.int64)
+    for i in range(sleeps):
+        duration_ns = rng.randrange(1, stimseq.CANCEL_CHECK_INTERVAL * 1_000_000)
+        start = perf_counter_ns()
+        sleep(duration_ns / 1e9)
+        overshoots[i] = perf_counter_ns() - start - duration_ns
+    return overshoots
+
+
+def min_timestep_budget(step_ns:np.ndarray, overshoot_ns:np.ndarray, spin_window:float=stimseq.SPIN_WINDOW,
+                        percentile:float=CALIBRATION_PERCENTILE, margin:float=CALIBRATION_MARGIN) -> int:
+    """ Minimum time step a device keeps up with, from its measured latencies
+
+    A step is delayed by the overshoot of the sleep before it beyond the spin window,
+    then lasts its write latency. The next step must not start before.
+
+    Args:
+        step_ns (np.ndarray): Write latency of steps in ns
+        overshoot_ns (np.ndarray): Sleep overshoots in ns
+        spin_window (float, optional): Spin window of the runs in ms. Defaults to SPIN_WINDOW.
+        percentile (float, optional): Percentile of the latencies. Defaults to CALIBRATION_PERCENTILE.
+        margin (float, optional): Factor applied to the latencies. Defaults to CALIBRATION_MARGIN.
+
+    Returns:
+        int: Minimum time step in ms, at least 1
+    """
+    wake_lateness = max(float(np.percentile(overshoot_ns, percentile)) / 1e6 - spin_window, 0)
+    budget = (float(np.percentile(step_ns, percentile)) / 1e6 + wake_lateness) * margin
+    return max(int(np.ceil(budget)), 1)
+
+
+def calibrate(backend:DaqBackend|None=None, device:str=stimseq.DAQ_NAME, bursts:int=CALIBRATION_BURSTS,
+              writes:int=CALIBRATION_WRITES, sleeps:int=CALIBRATION_SLEEPS,
+              spin_window:float=stimseq.SPIN_WINDOW, raise_priority:bool=False) -> dict:
+    """ Measure the timing of a device, see the module docstring
+
+    Args:
+        backend (DaqBackend | None, optional): Backend of the device. Defaults to NidaqmxBackend.
+        device (str, optional): Name of the device as defined in NI MAX. Defaults to DAQ_NAME.
+        bursts (int, optional): Number of bursts of writes. Defaults to CALIBRATION_BURSTS.
+        writes (int, optional): Number of steps of each burst. Defaults to CALIBRATION_WRITES.
+        sleeps (int, optional): Number of sleeps measured. Defaults to CALIBRATION_SLEEPS.
+        spin_window (float, optional): Spin window of the runs in ms. Defaults to SPIN_WINDOW.
+        raise_priority (bool, optional): Measure with the raised priority of runs with raise_priority. Defaults to False.
+
+    Returns:
+        dict: Timing profile, to save with save_timing_profile
+    """
+    backend = backend if backend is not None else NidaqmxBackend()
+    with stimseq._high_priority(raise_priority) as raised: #pylint: disable=protected-access
+        with backend as daq:
+            stimseq._add_channels(daq, device) #pylint: disable=protected-access
+            daq.commit()
+            latencies = measure_writes(daq, bursts=bursts, writes=writes)
+        overshoots = measure_sleeps(sleeps)
+
+    return {"version": stimseq.TIMING_PROFILE_VERSION,
+            "device": device,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "channels": [list(channel) for channel in stimseq._channel_wiring(device)], #pylint: disable=protected-access
+            "high_priority": raised,
+            "steps": len(latencies["step"]),
+            "sleeps": len(overshoots),
+            "spin_window": spin_window,
+            "percentile": CALIBRATION_PERCENTILE,
+            "margin": CALIBRATION_MARGIN,
+            "do_write": _distribution(latencies["do"]),
+            "ao_write": _distribution(latencies["ao"]),
+            "step_write": _distribution(latencies["step"]),
+            "sleep_overshoot": _distribution(overshoots),
+            "min_timestep": min_timestep_budget(latencies["step"], overshoots, spin_window=spin_window)}
+
+
+def save_timing_profile(profile:dict) -> str:
+    """ Save a timing profile, read by stimseq.load_timing_profile
+
+    Args:
+        profile (dict): Profile returned by calibrate
+
+    Returns:
+        str: Path of the profile
+    """
+    os.makedirs(stimseq.TIMING_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(stimseq.TIMING_PROFILE_DIR, f"{profile['device']}.json")
+    # Written next to the profile then renamed, a profile being read is never cut
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Measure the write latency and sleep overshoot of a DAQ, and save its timing profile. "
+                                                 "Outputs stay at 0 during the calibration, only the heartbeat toggles")
+    parser.add_argument('--device', dest="device", type=str, default=stimseq.DAQ_NAME,
+                        help="Name of the device as defined in NI MAX, wired as DAQ_WIRING")
+    parser.add_argument('--bursts', dest="bursts", type=int, default=CALIBRATION_BURSTS,
+                        help="Number of bursts of writes")
+    parser.add_argument('--writes', dest="writes", type=int, default=CALIBRATION_WRITES,
+                        help="Number of steps written in each burst")
+    parser.add_argument('--sleeps', dest="sleeps", type=int, default=CALIBRATION_SLEEPS,
+                        help="Number of sleeps measured")
+    parser.add_argument('--high-priority', dest="raise_priority",
+                        help="Used to measure with the raised priority of runs with --high-priority",
+                        action='store_true')
+    parser.add_argument('--dry-run', dest="dry_run",
+                        help="Used to print the measures without saving the profile",
+                        action='store_true')
+    args = parser.parse_args()
+
+    if min(args.bursts, args.writes, args.sleeps) < 1:
+        parser.error("Bursts, writes and sleeps must be positive")
+    timing_profile = calibrate(device=args.device, bursts=args.bursts, writes=args.writes, sleeps=args.sleeps,
+                               raise_priority=args.raise_priority)
+    print(f"{timing_profile['steps']} steps and {timing_profile['sleeps']} sleeps measured on {args.device}"
+          f"{', with raised priority' if timing_profile['high_priority'] else ''}")
+    for name in ["do_write", "ao_write", "step_write", "sleep_overshoot"]:
+        print(f"{name:>16}: " + ", ".join(f"{key} {value:.3f} ms" for key, value in timing_profile[name].items()))
+    print(f"Minimum time step: {timing_profile['min_timestep']} ms (MIN_TIMESTEP: {stimseq.MIN_TIMESTEP} ms)")
+    if not args.dry_run:
+        print(f"Saved to {save_timing_profile(timing_profile)}")
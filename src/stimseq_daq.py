@@ -0,0 +1,700 @@
+#pylint: disable=line-too-long
+"""Access to the DAQ used by StimSeq
+
+StimSeq only talks to the DAQ through a DaqBackend. NidaqmxBackend drives a real
+(or NI MAX simulated) device, SimulatedBackend emulates one in process so
+sequences can be run and measured without NI drivers.
+
+nidaqmx is only imported by the methods of NidaqmxBackend, it is not loaded by
+tools and runs using the SimulatedBackend.
+"""
+import bisect
+import re
+import threading
+from abc import ABC, abstractmethod
+from time import perf_counter_ns, sleep
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import nidaqmx as ni
+
+# Const for trigger polling, in ms. The interval between reads doubles from min to max while waiting
+TRIGGER_POLL_MIN_INTERVAL = 0.05
+TRIGGER_POLL_MAX_INTERVAL = 1
+
+# Time in ms between two checks of timeout, cancellation and line level while waiting for a trigger edge
+TRIGGER_CHECK_INTERVAL = 100
+
+# NI-DAQmx error raised when a read times out
+_DAQMX_READ_TIMEOUT = -200474
+
+# Voltage of high digital lines, read back by the acquisition of SimulatedBackend (TTL level of USB-600x)
+SIMULATED_HIGH_LEVEL = 5.0
+
+
+# Method to get the lines of a physical lines string
+def _physical_lines(lines:str) -> set[tuple[str, int, int]]:
+    """ (device, port, line) of each line of a physical lines string, ex: "Dev1/port0/line0:7,Dev1/port0/line9" """
+    result = set()
+    for device, port, first, last in re.findall(r"([^/,]+)/port(\d+)/line(\d+)(?::(\d+))?", lines):
+        first, last = sorted((int(first), int(last or first)))
+        result.update((device, int(port), line) for line in range(first, last + 1))
+    return result
+
+
+class DaqBackend(ABC):
+    """ Interface to the DAQ, holding one DO, one AO and one trigger task
+
+    Tasks are created by open() and released by close(), the backend can be used
+    as a context manager and opened again for the next run.
+    """
+
+    def __enter__(self) -> "DaqBackend":
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @abstractmethod
+    def open(self) -> None:
+        """ Create the DO, AO and trigger tasks, without channels """
+
+    @abstractmethod
+    def close(self) -> None:
+        """ Release the tasks """
+
+    def commit(self) -> None:
+        """ Verify the tasks and reserve their resources once channels are added
+
+        The following writes and runs then start without the configuration cost of the driver.
+        """
+
+    @abstractmethod
+    def add_do_port(self, lines:str, name:str) -> None:
+        """ Add a DO channel holding lines of a single port, written as one word
+
+        Args:
+            lines (str): Physical lines, ex: "Dev1/port0/line0:7"
+            name (str): Name of the channel
+        """
+
+    @abstractmethod
+    def add_ao_channel(self, physical_channel:str, name:str, min_val:float, max_val:float) -> None:
+        """ Add an AO voltage channel
+
+        Args:
+            physical_channel (str): Physical channel, ex: "Dev1/ao0"
+            name (str): Name of the channel
+            min_val (float): Minimum voltage
+            max_val (float): Maximum voltage
+        """
+
+    @abstractmethod
+    def add_trigger(self, lines:str, name:str) -> None:
+        """ Add the DI line of the trigger signal
+
+        Args:
+            lines (str): Physical line, ex: "Dev1/port2/line0"
+            name (str): Name of the channel
+        """
+
+    @abstractmethod
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        """ Write one sample to every DO port
+
+        Args:
+            words (np.ndarray): uint32 word of each port, in the order ports were added. Bit n is line n.
+            timeout (float): Timeout in s
+        """
+
+    @abstractmethod
+    def write_ao(self, values:np.ndarray, timeout:float) -> None:
+        """ Write one sample to every AO channel
+
+        Args:
+            values (np.ndarray): float64 value of each channel, in the order channels were added
+            timeout (float): Timeout in s
+        """
+
+    @abstractmethod
+    def read_trigger(self) -> bool:
+        """ Read the trigger line
+
+        Returns:
+            bool: State of the trigger line
+        """
+
+    def wait_trigger(self, timeout:float|None=None, cancel_event:threading.Event|None=None) -> int | None:
+        """ Wait for the trigger line to be high
+
+        The line is polled at an interval growing from TRIGGER_POLL_MIN_INTERVAL to
+        TRIGGER_POLL_MAX_INTERVAL, so long waits do not keep a CPU core busy.
+
+        Args:
+            timeout (float | None, optional): Timeout in s, None to wait forever. Defaults to None.
+            cancel_event (threading.Event | None, optional): Event stopping the wait when set. Defaults to None.
+
+        Returns:
+            int | None: perf_counter_ns() time the trigger was detected, None on timeout or cancellation
+        """
+        deadline_ns = None if timeout is None else perf_counter_ns() + int(timeout * 1e9)
+        interval = TRIGGER_POLL_MIN_INTERVAL
+        while not self.read_trigger():
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            if deadline_ns is not None and perf_counter_ns() > deadline_ns:
+                return None
+            sleep(interval / 1000)
+            interval = min(2 * interval, TRIGGER_POLL_MAX_INTERVAL)
+        return perf_counter_ns()
+
+    @abstractmethod
+    def arm_ao_waveform(self, sample_rate:float, n_samples:int|None, trigger_source:str,
+                        data:np.ndarray, timeout:float, streamed:bool=False, regenerated:bool=False) -> None:
+        """ Configure a sample clocked AO generation started by a digital edge, then start it
+
+        Args:
+            sample_rate (float): Sample rate in samples per second
+            n_samples (int | None): Total number of samples per channel, None to generate a regenerated buffer until stopped
+            trigger_source (str): Terminal of the start trigger, ex: "/Dev1/PFI0"
+            data (np.ndarray): First samples, one row per channel
+            timeout (float): Timeout in s of the write
+            streamed (bool, optional): True if the rest of the samples are written with write_ao_waveform. Defaults to False.
+            regenerated (bool, optional): True if data is one period, generated again and again by the device
+                until n_samples are generated. Defaults to False.
+        """
+
+    @abstractmethod
+    def write_ao_waveform(self, data:np.ndarray, timeout:float) -> None:
+        """ Write the next samples of a streamed AO generation, blocks until the buffer has room
+
+        Args:
+            data (np.ndarray): Samples, one row per channel
+            timeout (float): Timeout in s
+        """
+
+    @abstractmethod
+    def wait_ao_done(self, timeout:float) -> None:
+        """ Wait for the end of the AO generation, AO channels can then be written one sample at a time again
+
+        Args:
+            timeout (float): Timeout in s
+        """
+
+    @abstractmethod
+    def stop_ao(self) -> None:
+        """ Stop the AO generation, AO channels can then be written one sample at a time again """
+
+    def start_acquisition(self, channels:dict[str, str], sample_rate:float, buffer_size:int,
+                          min_val:float, max_val:float, loopback:dict[str, str]|None=None) -> None:
+        """ Create and start a task acquiring analog inputs on the sample clock, until stop_acquisition
+
+        The acquisition task is apart from the DO, AO and trigger tasks, and can be read from another thread.
+
+        Args:
+            channels (dict[str, str]): Physical AI channel of each acquired signal, by name, ex: {"TTL": "Dev1/ai0"}
+            sample_rate (float): Sample rate in samples per second per channel
+            buffer_size (int): Number of samples per channel kept by the driver until read
+            min_val (float): Minimum voltage
+            max_val (float): Maximum voltage
+            loopback (dict[str, str] | None, optional): Output line or channel wired to each acquired signal, by name.
+                Only used by backends emulating the DAQ. Defaults to None.
+
+        Raises:
+            NotImplementedError: If the backend does not support acquisition
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support acquisition")
+
+    def read_acquisition(self, data:np.ndarray, timeout:float) -> None:
+        """ Read the next samples of the acquisition, waits until they are acquired
+
+        Args:
+            data (np.ndarray): float64 array of shape (channels, samples) filled with the samples,
+                channels in the order given to start_acquisition
+            timeout (float): Timeout in s
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support acquisition")
+
+    def stop_acquisition(self) -> None:
+        """ Stop and release the acquisition task """
+        raise NotImplementedError(f"{type(self).__name__} does not support acquisition")
+
+
+class NidaqmxBackend(DaqBackend):
+    """ DaqBackend using NI-DAQmx """
+
+    def __init__(self) -> None:
+        self.__task_do:"ni.Task | None" = None
+        self.__task_ao:"ni.Task | None" = None
+        self.__task_trig:"ni.Task | None" = None
+        self.__task_acq:"ni.Task | None" = None
+        self.__trigger_lines = ""
+        # Set to False once the device refused change detection, it is not tried again
+        self.__change_detection = True
+        # True while a regenerated AO buffer is held in the memory of the device
+        self.__onboard_regeneration = False
+
+    def open(self) -> None:
+        #pylint: disable=import-outside-toplevel
+        import nidaqmx as ni
+        from nidaqmx.stream_writers import AnalogMultiChannelWriter, DigitalMultiChannelWriter
+
+        self.__task_do = ni.Task("Digital Outputs")
+        self.__task_trig = ni.Task("Trigger")
+        self.__task_ao = ni.Task("Analog Outputs")
+
+        # Writers send samples from numpy arrays, without conversion
+        self.__do_writer = DigitalMultiChannelWriter(self.__task_do.out_stream)
+        self.__ao_writer = AnalogMultiChannelWriter(self.__task_ao.out_stream)
+        self.__ao_waveform_writer = AnalogMultiChannelWriter(self.__task_ao.out_stream, auto_start=False)
+
+    def close(self) -> None:
+        for task in (self.__task_do, self.__task_trig, self.__task_ao, self.__task_acq):
+            if task is not None:
+                task.close()
+        self.__task_do = self.__task_ao = self.__task_trig = self.__task_acq = None
+
+    def commit(self) -> None:
+        from nidaqmx.constants import TaskMode #pylint: disable=import-outside-toplevel
+        for task in (self.__task_do, self.__task_trig, self.__task_ao):
+            task.control(TaskMode.TASK_COMMIT)
+
+    def add_do_port(self, lines:str, name:str) -> None:
+        from nidaqmx.constants import LineGrouping #pylint: disable=import-outside-toplevel
+        self.__task_do.do_channels.add_do_chan(lines=lines, name_to_assign_to_lines=name,
+                                               line_grouping=LineGrouping.CHAN_FOR_ALL_LINES)
+
+    def add_ao_channel(self, physical_channel:str, name:str, min_val:float, max_val:float) -> None:
+        from nidaqmx.constants import VoltageUnits #pylint: disable=import-outside-toplevel
+        self.__task_ao.ao_channels.add_ao_voltage_chan(physical_channel=physical_channel, name_to_assign_to_channel=name,
+                                                       min_val=min_val, max_val=max_val, units=VoltageUnits.VOLTS)
+
+    def add_trigger(self, lines:str, name:str) -> None:
+        from nidaqmx.constants import LineGrouping #pylint: disable=import-outside-toplevel
+        self.__task_trig.di_channels.add_di_chan(lines=lines, name_to_assign_to_lines=name,
+                                                 line_grouping=LineGrouping.CHAN_PER_LINE)
+        self.__trigger_lines = lines
+
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        self.__do_writer.write_one_sample_port_uint32(words, timeout=timeout)
+
+    def write_ao(self, values:np.ndarray, timeout:float) -> None:
+        self.__ao_writer.write_one_sample(values, timeout=timeout)
+
+    def read_trigger(self) -> bool:
+        return bool(self.__task_trig.read())
+
+    def wait_trigger(self, timeout:float|None=None, cancel_event:threading.Event|None=None) -> int | None:
+        """ Wait for the trigger line to be high
+
+        Uses change detection timing when the device supports it, so the driver wakes
+        up on the rising edge. Falls back to polling otherwise (ex: USB-600x).
+
+        A rising edge between a read of the line level and the start of change detection
+        is not reported. The level is read again every TRIGGER_CHECK_INTERVAL, so a trigger
+        held high is still received.
+        """
+        #pylint: disable=import-outside-toplevel
+        from nidaqmx.constants import SampleTimingType
+        from nidaqmx.errors import DaqError
+
+        # Line already high
+        if self.read_trigger():
+            return perf_counter_ns()
+
+        if self.__change_detection:
+            try:
+                self.__start_change_detection()
+            except DaqError:
+                self.__change_detection = False
+                self.__task_trig.timing.samp_timing_type = SampleTimingType.ON_DEMAND
+        if not self.__change_detection:
+            return super().wait_trigger(timeout=timeout, cancel_event=cancel_event)
+
+        deadline_ns = None if timeout is None else perf_counter_ns() + int(timeout * 1e9)
+        try:
+            while True:
+                try:
+                    # Each sample is a change on the line, the wait for it is done by the driver
+                    if self.__task_trig.read(timeout=TRIGGER_CHECK_INTERVAL / 1000):
+                        return perf_counter_ns()
+                except DaqError as error:
+                    if error.error_code != _DAQMX_READ_TIMEOUT:
+                        raise
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                if deadline_ns is not None and perf_counter_ns() > deadline_ns:
+                    return None
+
+                # Change detection is stopped to read the level, in case the edge came before it started
+                self.__task_trig.stop()
+                self.__task_trig.timing.samp_timing_type = SampleTimingType.ON_DEMAND
+                if self.read_trigger():
+                    return perf_counter_ns()
+                self.__start_change_detection()
+        finally:
+            self.__task_trig.stop()
+            self.__task_trig.timing.samp_timing_type = SampleTimingType.ON_DEMAND
+
+    def __start_change_detection(self) -> None:
+        # Start sampling the trigger line at each of its rising edges
+        from nidaqmx.constants import AcquisitionType #pylint: disable=import-outside-toplevel
+        self.__task_trig.timing.cfg_change_detection_timing(rising_edge_chan=self.__trigger_lines,
+                                                            sample_mode=AcquisitionType.CONTINUOUS)
+        self.__task_trig.start()
+
+    def arm_ao_waveform(self, sample_rate:float, n_samples:int|None, trigger_source:str,
+                        data:np.ndarray, timeout:float, streamed:bool=False, regenerated:bool=False) -> None:
+        #pylint: disable=import-outside-toplevel
+        from nidaqmx.constants import AcquisitionType, Edge, RegenerationMode
+        from nidaqmx.errors import DaqError
+
+        # A finite generation longer than the regenerated buffer repeats it
+        sample_mode = AcquisitionType.FINITE if n_samples is not None else AcquisitionType.CONTINUOUS
+        self.__task_ao.timing.cfg_samp_clk_timing(rate=sample_rate, sample_mode=sample_mode,
+                                                  samps_per_chan=n_samples if n_samples is not None else data.shape[1])
+        self.__task_ao.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=trigger_source,
+                                                                      trigger_edge=Edge.RISING)
+        if streamed:
+            self.__task_ao.out_stream.regen_mode = RegenerationMode.DONT_ALLOW_REGENERATION
+            self.__task_ao.out_stream.output_buf_size = 2 * data.shape[1]
+        elif regenerated:
+            self.__task_ao.out_stream.output_buf_size = data.shape[1]
+            # Buffers fitting in the memory of the device are regenerated by it, without transfers from the computer
+            try:
+                if data.shape[1] <= self.__task_ao.out_stream.onbrd_buf_size:
+                    self.__task_ao.out_stream.use_only_onbrd_mem = True
+                    self.__onboard_regeneration = True
+            except DaqError:
+                pass
+        self.__ao_waveform_writer.write_many_sample(data, timeout=timeout)
+        self.__task_ao.start()
+
+    def write_ao_waveform(self, data:np.ndarray, timeout:float) -> None:
+        self.__ao_waveform_writer.write_many_sample(data, timeout=timeout)
+
+    def wait_ao_done(self, timeout:float) -> None:
+        self.__task_ao.wait_until_done(timeout=timeout)
+        self.stop_ao()
+
+    def stop_ao(self) -> None:
+        from nidaqmx.constants import RegenerationMode, SampleTimingType #pylint: disable=import-outside-toplevel
+        # A stopped committed task goes back to the committed state, not to the unverified one
+        self.__task_ao.stop()
+        self.__task_ao.triggers.start_trigger.disable_start_trig()
+        self.__task_ao.timing.samp_timing_type = SampleTimingType.ON_DEMAND
+        self.__task_ao.out_stream.regen_mode = RegenerationMode.ALLOW_REGENERATION
+        if self.__onboard_regeneration:
+            self.__task_ao.out_stream.use_only_onbrd_mem = False
+            self.__onboard_regeneration = False
+
+    def start_acquisition(self, channels:dict[str, str], sample_rate:float, buffer_size:int,
+                          min_val:float, max_val:float, loopback:dict[str, str]|None=None) -> None:
+        """ Create and start a continuous AI task
+
+        Digital inputs of USB-600x are not sample clocked, digital signals are acquired
+        on analog inputs, wired single ended (RSE).
+        """
+        #pylint: disable=import-outside-toplevel
+        import nidaqmx as ni
+        from nidaqmx.constants import AcquisitionType, TerminalConfiguration, VoltageUnits
+        from nidaqmx.stream_readers import AnalogMultiChannelReader
+
+        self.__task_acq = ni.Task("Acquisition")
+        try:
+            for name, physical_channel in channels.items():
+                self.__task_acq.ai_channels.add_ai_voltage_chan(physical_channel, name_to_assign_to_channel=name,
+                                                                terminal_config=TerminalConfiguration.RSE,
+                                                                min_val=min_val, max_val=max_val, units=VoltageUnits.VOLTS)
+            self.__task_acq.timing.cfg_samp_clk_timing(rate=sample_rate, sample_mode=AcquisitionType.CONTINUOUS,
+                                                       samps_per_chan=buffer_size)
+            self.__acq_reader = AnalogMultiChannelReader(self.__task_acq.in_stream)
+            self.__task_acq.start()
+        except Exception:
+            self.__task_acq.close()
+            self.__task_acq = None
+            raise
+
+    def read_acquisition(self, data:np.ndarray, timeout:float) -> None:
+        self.__acq_reader.read_many_sample(data, number_of_samples_per_channel=data.shape[1], timeout=timeout)
+
+    def stop_acquisition(self) -> None:
+        if self.__task_acq is not None:
+            self.__task_acq.close()
+        self.__task_acq = None
+
+
+class SimulatedBackend(DaqBackend):
+    """ DaqBackend emulating a DAQ in process
+
+    Writes and reads take a configurable latency, the trigger line goes high after
+    a configurable delay or when fire_trigger() is called, and every output
+    transition is logged with its perf_counter_ns() time. Analog inputs wired back
+    to the trigger line or to outputs (loopback of start_acquisition) are acquired
+    from the transitions, hardware timed AO waveforms excepted.
+    """
+
+    def __init__(self, write_latency:float=0, read_latency:float=0, trigger_delay:float|None=0) -> None:
+        """
+        Args:
+            write_latency (float, optional): Duration of each write, in ms. Defaults to 0.
+            read_latency (float, optional): Duration of each trigger read, in ms. Defaults to 0.
+            trigger_delay (float | None, optional): Time in ms between the first trigger read and the trigger signal.
+                None to wait for fire_trigger(). Defaults to 0.
+        """
+        self.__write_latency_ns = int(write_latency * 1e6)
+        self.__read_latency_ns = int(read_latency * 1e6)
+        self.__trigger_delay_ns = None if trigger_delay is None else int(trigger_delay * 1e6)
+        self.__trigger_event = threading.Event()
+        self.__acquisition:tuple[float, list[tuple[str, int | None] | None]] | None = None
+        self.__reset()
+
+    def __reset(self) -> None:
+        self.__channels:dict[str, str] = {}
+        self.__do_ports:list[str] = []
+        self.__ao_channels:list[str] = []
+        self.__trigger_line:str | None = None
+        self.__state:dict[str, int | float] = {}
+        self.__transitions:list[tuple[int, str, int | float]] = []
+        self.__waveform:tuple[float, list[np.ndarray]] | None = None
+        self.__waveform_size:int | None = 0
+        self.__waveform_regenerated = False
+        self.__ao_trigger_source:str | None = None
+        self.__armed_ns:int | None = None
+        self.__trigger_ns:int | None = None
+        self.__trigger_event.clear()
+
+    @property
+    def armed_ns(self) -> int | None:
+        """ perf_counter_ns() time of the first trigger read, None if not read yet """
+        return self.__armed_ns
+
+    @property
+    def trigger_ns(self) -> int | None:
+        """ perf_counter_ns() time of the trigger signal, None if not triggered yet """
+        return self.__trigger_ns
+
+    @property
+    def channels(self) -> dict[str, str]:
+        """ Physical lines or channel of each configured channel name """
+        return dict(self.__channels)
+
+    @property
+    def ao_trigger_source(self) -> str | None:
+        """ Start trigger terminal of the last armed AO waveform, the waveform starts with the trigger line whatever its value """
+        return self.__ao_trigger_source
+
+    @property
+    def transitions(self) -> list[tuple[int, str, int | float]]:
+        """ Output transitions as (perf_counter_ns() time, channel name, new value), in time order
+
+        Transitions of a hardware timed AO waveform are timed from the trigger signal.
+        """
+        return sorted(self.__transitions + self.__waveform_transitions(), key=lambda transition: transition[0])
+
+    def __waveform_samples(self, n_samples:int) -> np.ndarray:
+        # First samples of the generation, a regenerated buffer being repeated
+        _, chunks = self.__waveform
+        waveform = np.concatenate(chunks, axis=1)
+        if self.__waveform_regenerated:
+            waveform = np.tile(waveform, (1, -(-n_samples // waveform.shape[1])))
+        return waveform[:, :n_samples]
+
+    def __generated_samples(self) -> int:
+        # Number of samples generated since the trigger
+        sample_rate, _ = self.__waveform
+        generated = int((perf_counter_ns() - (self.__trigger_ns or perf_counter_ns())) * sample_rate / 1e9)
+        return generated if self.__waveform_size is None else min(generated, self.__waveform_size)
+
+    def __waveform_transitions(self) -> list[tuple[int, str, float]]:
+        if self.__waveform is None or self.__trigger_ns is None:
+            return []
+        transitions = []
+        sample_rate, _ = self.__waveform
+        # A generation until stopped is known up to now
+        waveform = self.__waveform_samples(self.__waveform_size if self.__waveform_size is not None else self.__generated_samples() + 1)
+        for name, values in zip(self.__ao_channels, waveform):
+            changes = np.flatnonzero(np.diff(values, prepend=self.__state.get(name, 0.0)))
+            times = self.__trigger_ns + (changes * 1e9 / sample_rate).astype(np.int64)
+            transitions += zip(times.tolist(), [name] * len(changes), values[changes].tolist())
+        return transitions
+
+    def __end_waveform(self) -> None:
+        # Generated samples become regular transitions, AO channels are written one sample at a time again
+        for time_ns, name, value in sorted(self.__waveform_transitions(), key=lambda transition: transition[0]):
+            self.__state[name] = value
+            self.__transitions.append((time_ns, name, value))
+        self.__waveform = None
+
+    def fire_trigger(self) -> None:
+        """ Set the trigger line high, can be called from any thread """
+        self.__trigger_event.set()
+
+    def open(self) -> None:
+        self.__reset()
+
+    def close(self) -> None:
+        self.__channels.clear()
+
+    def __add_channel(self, name:str, physical:str, pattern:str) -> None:
+        if not re.fullmatch(pattern, physical):
+            raise ValueError(f"Invalid physical channel for {name}: {physical}")
+        if name in self.__channels:
+            raise ValueError(f"Channel name already used: {name}")
+        if physical in self.__channels.values():
+            raise ValueError(f"Physical channel already used: {physical}")
+        self.__channels[name] = physical
+
+    def add_do_port(self, lines:str, name:str) -> None:
+        self.__add_channel(name, lines, r"[^/,]+/port(\d+)/line\d+(:\d+)?(,[^/,]+/port\1/line\d+(:\d+)?)*")
+        self.__do_ports.append(name)
+
+    def add_ao_channel(self, physical_channel:str, name:str, min_val:float, max_val:float) -> None:
+        self.__add_channel(name, physical_channel, r"[^/,]+/ao\d+")
+        self.__ao_channels.append(name)
+
+    def add_trigger(self, lines:str, name:str) -> None:
+        self.__add_channel(name, lines, r"[^/,]+/port\d+/line\d+")
+        self.__trigger_line = name
+
+    def __spin(self, duration_ns:int) -> None:
+        end_ns = perf_counter_ns() + duration_ns
+        while perf_counter_ns() < end_ns:
+            pass
+
+    def __set_outputs(self, names:list[str], values:np.ndarray) -> None:
+        if len(values) != len(names):
+            raise ValueError(f"Expected {len(names)} values, got {len(values)}")
+        now_ns = perf_counter_ns()
+        for name, value in zip(names, values.tolist()):
+            if self.__state.get(name) != value:
+                self.__state[name] = value
+                self.__transitions.append((now_ns, name, value))
+
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        self.__spin(self.__write_latency_ns)
+        self.__set_outputs(self.__do_ports, words)
+
+    def write_ao(self, values:np.ndarray, timeout:float) -> None:
+        self.__spin(self.__write_latency_ns)
+        self.__set_outputs(self.__ao_channels, values)
+
+    def read_trigger(self) -> bool:
+        if self.__trigger_line is None:
+            raise ValueError("No trigger line configured")
+        self.__spin(self.__read_latency_ns)
+        now_ns = perf_counter_ns()
+        if self.__armed_ns is None:
+            self.__armed_ns = now_ns
+        if self.__trigger_ns is None:
+            if self.__trigger_event.is_set():
+                self.__trigger_ns = now_ns
+            elif self.__trigger_delay_ns is not None and now_ns >= self.__armed_ns + self.__trigger_delay_ns:
+                self.__trigger_ns = self.__armed_ns + self.__trigger_delay_ns
+        return self.__trigger_ns is not None
+
+    def wait_trigger(self, timeout:float|None=None, cancel_event:threading.Event|None=None) -> int | None:
+        """ Wait for the trigger, returning the emulated trigger time rather than its detection
+
+        A trigger received by a previous wait is cleared, so a backend kept open can run several sequences.
+        """
+        if self.__trigger_ns is not None:
+            self.__armed_ns = self.__trigger_ns = None
+            self.__trigger_event.clear()
+        if super().wait_trigger(timeout=timeout, cancel_event=cancel_event) is None:
+            return None
+        return self.__trigger_ns
+
+    def arm_ao_waveform(self, sample_rate:float, n_samples:int|None, trigger_source:str,
+                        data:np.ndarray, timeout:float, streamed:bool=False, regenerated:bool=False) -> None:
+        if data.shape[0] != len(self.__ao_channels):
+            raise ValueError(f"Expected {len(self.__ao_channels)} AO rows, got {data.shape[0]}")
+        self.__spin(self.__write_latency_ns)
+        self.__waveform = (sample_rate, [np.array(data, dtype=np.float64)])
+        self.__waveform_size = n_samples
+        self.__waveform_regenerated = regenerated
+        self.__ao_trigger_source = trigger_source
+
+    def write_ao_waveform(self, data:np.ndarray, timeout:float) -> None:
+        self.__spin(self.__write_latency_ns)
+        self.__waveform[1].append(np.array(data, dtype=np.float64))
+
+    def wait_ao_done(self, timeout:float) -> None:
+        sample_rate, _ = self.__waveform
+        if self.__waveform_size is None:
+            sleep(timeout)
+            raise TimeoutError("AO generation until stopped does not end")
+        remaining_ns = self.__trigger_ns + int(self.__waveform_size * 1e9 / sample_rate) - perf_counter_ns()
+        if remaining_ns > 0:
+            sleep(remaining_ns / 1e9)
+        self.__end_waveform()
+
+    def stop_ao(self) -> None:
+        # Samples after the stop are never generated
+        if self.__waveform is not None:
+            sample_rate, _ = self.__waveform
+            generated = self.__generated_samples()
+            self.__waveform = (sample_rate, [self.__waveform_samples(generated)])
+            self.__waveform_size = generated
+            self.__waveform_regenerated = False
+            self.__end_waveform()
+
+    def __loopback_source(self, physical:str|None) -> tuple[str, int | None] | None:
+        # Channel name and line read back from an output or trigger physical channel, None if not configured (read as 0)
+        if physical is None:
+            return None
+        lines = _physical_lines(physical)
+        for name, channel in self.__channels.items():
+            if physical == channel:
+                return name, None
+            if lines and lines <= _physical_lines(channel):
+                return name, next(iter(lines))[2]
+        return None
+
+    def start_acquisition(self, channels:dict[str, str], sample_rate:float, buffer_size:int,
+                          min_val:float, max_val:float, loopback:dict[str, str]|None=None) -> None:
+        for name, physical_channel in channels.items():
+            if not re.fullmatch(r"[^/,]+/ai\d+", physical_channel):
+                raise ValueError(f"Invalid physical channel for {name}: {physical_channel}")
+        loopback = loopback or {}
+        self.__acquisition = (sample_rate, [self.__loopback_source(loopback.get(name)) for name in channels])
+        self.__acquisition_state = dict(self.__state)
+        self.__acquisition_cursor = len(self.__transitions)
+        self.__acquired = 0
+        self.__acquisition_start_ns = perf_counter_ns()
+
+    def read_acquisition(self, data:np.ndarray, timeout:float) -> None:
+        sample_rate, sources = self.__acquisition
+        times = self.__acquisition_start_ns + ((self.__acquired + np.arange(data.shape[1])) * 1e9 / sample_rate).astype(np.int64)
+        wait_ns = int(times[-1]) - perf_counter_ns()
+        if wait_ns > timeout * 1e9:
+            sleep(timeout)
+            raise TimeoutError(f"Acquisition read timed out after {timeout} s")
+        if wait_ns > 0:
+            sleep(wait_ns / 1e9)
+        self.__acquired += data.shape[1]
+
+        # Transitions logged up to the last sample, outputs are sampled on them
+        last = bisect.bisect_right(self.__transitions, int(times[-1]), lo=self.__acquisition_cursor,
+                                   key=lambda transition: transition[0])
+        transitions = self.__transitions[self.__acquisition_cursor:last]
+        self.__acquisition_cursor = last
+        for row, source in zip(data, sources):
+            if source is None:
+                row[:] = 0
+                continue
+            name, line = source
+            if name == self.__trigger_line:
+                row[:] = SIMULATED_HIGH_LEVEL * (self.__trigger_ns is not None and times >= self.__trigger_ns)
+                continue
+            changes = [(time_ns, value) for time_ns, channel, value in transitions if channel == name]
+            values = np.array([self.__acquisition_state.get(name, 0), *(value for _, value in changes)])
+            values = values[np.searchsorted([time_ns for time_ns, _ in changes], times, side='right')]
+            self.__acquisition_state[name] = values[-1].item()
+            row[:] = values if line is None else SIMULATED_HIGH_LEVEL * ((values.astype(np.int64) >> line) & 1)
+
+    def stop_acquisition(self) -> None:
+        self.__acquisition = None
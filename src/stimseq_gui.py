@@ -4,27 +4,35 @@
 import argparse
 import logging
 import os
+import queue
+import sys
 
 # Imports for graphical interface
-from tkinter import Tk, ttk, filedialog, Frame, Button, Canvas
+from tkinter import Tk, ttk, filedialog, messagebox, Frame, Button, Canvas, Label, StringVar
 from datetime import datetime
-
-# Imports for plotting datas
-import matplotlib.pyplot as plot
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from threading import Event, Thread
+from typing import TYPE_CHECKING
 
 # Import StimSeq Backend
 import stimseq
+from stimseq_plot import PLOT_COLUMNS, SequencePlotter
+from stimseq_render import RENDER_SAMPLE_RATE, export_timeline
+from stimseq_watch import WATCH_INTERVAL, SequenceWatcher
+
+# matplotlib is imported once the sequence file is chosen, so the file dialog shows up sooner
+if TYPE_CHECKING:
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 
-# Const for plotting sequence
-PLOT_STYLE = 'bo-'  #blue, dots, contiguous line (see matplolib documention)
+# Const for the progress display of a run
+PROGRESS_REFRESH = 100  # Time in ms between two updates of the cursor and counters
+RUN_SWITCH_INTERVAL = 0.0005  # Thread switch interval in s while a sequence runs, so the GUI thread releases the GIL sooner
 
 
 class StimSeqGUI(Tk):
     """ Stimseq GUI handling graphical interface used to validate a sequence"""
 
-    __canvas:FigureCanvasTkAgg
+    __canvas:"FigureCanvasTkAgg"
 
     def __init__(self, log_lvl=logging.INFO, **kwargs) -> None:
         #  Init TK
@@ -34,18 +42,21 @@ class StimSeqGUI(Tk):
         self.minsize(width=400, height=300)
         self.withdraw()
 
-        # Prepare drawing area.
-        # number_of_rows = Number of column minus 1 because first column is for timestamps
-        self.__number_of_rows = len(stimseq.SEQUENCE_COLUMNS) - 1
-        self.__figure, self.__axes = plot.subplots(nrows=self.__number_of_rows,constrained_layout=True)
+        # Get the sequence file, only Tk is loaded at this point
+        self.__sequence_path = self.__get_sequence_file_from_user()
+
+        # Prepare drawing area, one row per column of the sequence sharing the time axis.
+        # The figure is embedded in the window, pyplot and its figure manager are not used
+        from matplotlib.figure import Figure #pylint: disable=import-outside-toplevel
+        self.__number_of_rows = len(PLOT_COLUMNS)
+        self.__figure = Figure(constrained_layout=True)
+        self.__axes = self.__figure.subplots(nrows=self.__number_of_rows, sharex=True)
         self.__figure.set_figheight(1.5 * self.__number_of_rows)
+        self.__plotter = SequencePlotter(self.__figure, self.__axes)
 
         # Init Graphical interface
         self.__init_graphical_interface()
 
-        # Get the sequence file
-        self.__sequence_path = self.__get_sequence_file_from_user()
-
         # Init stimseq backend
         self.__stimseq = stimseq.StimSeq(path_to_sequence=self.__sequence_path,
                                          log_lvl=log_lvl)
@@ -53,12 +64,20 @@ class StimSeqGUI(Tk):
         # Plot the sequence
         self.__plot_sequence()
 
-        # Default to false so closing the window won't start the sequence
-        self.__run_sequence = False
+        # Run state, the sequence is sent by a worker thread while the window stays responsive
+        self.__worker:Thread | None = None
+        self.__cancel_event = Event()
+        self.__progress:queue.SimpleQueue = queue.SimpleQueue()
+        self.__switch_interval = sys.getswitchinterval()
+
+        # Watch the sequence file, edits are parsed and plotted again where the file changed
+        self.__watcher = SequenceWatcher(self.__sequence_path, self.__stimseq.min_timestep)
+        self.after(WATCH_INTERVAL, self.__watch_sequence_file)
 
     def __init_graphical_interface(self) -> None:
         """ Init graphical objects inside the graphical interface
         """
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk #pylint: disable=import-outside-toplevel
 
         # Init tk frames, it is the main graphical unit inside the window
         main_frame = Frame(self)
@@ -66,19 +85,31 @@ class StimSeqGUI(Tk):
         canvas_frame = Frame(main_frame)
 
         # Create buttons and pack them into their master frame
-        btn_change = Button(master=buttons_frame, text="Change Sequence File", command= self.__btn_change_sequence_file)
-        btn_save = Button(master=buttons_frame, text="Save Plot and start sequence", command= self.__btn_save_plot_and_start)
-        btn_quit = Button(master=buttons_frame, text="Quit without running sequence", command= self.__btn_exit_no_run)
-        btn_change.pack()
-        btn_save.pack()
+        self.__btn_change = Button(master=buttons_frame, text="Change Sequence File", command= self.__btn_change_sequence_file)
+        self.__btn_save = Button(master=buttons_frame, text="Save Plot and start sequence", command= self.__btn_save_plot_and_start)
+        self.__btn_export = Button(master=buttons_frame, text="Export timeline", command= self.__btn_export_timeline)
+        self.__btn_abort = Button(master=buttons_frame, text="Abort sequence", command= self.__btn_abort, state="disabled")
+        btn_quit = Button(master=buttons_frame, text="Quit", command= self.__btn_exit_no_run)
+        self.__btn_change.pack()
+        self.__btn_save.pack()
+        self.__btn_export.pack()
+        self.__btn_abort.pack()
         btn_quit.pack()
 
+        # Step counters and lateness of the running sequence
+        self.__status = StringVar(master=self, value="")
+        Label(master=buttons_frame, textvariable=self.__status).pack()
+
         # Init the canvas and pack into its master frame. This is were the plot will be drawn
         scroll_canvas = Canvas(canvas_frame)
         self.__canvas = FigureCanvasTkAgg(figure=self.__figure, master=scroll_canvas)
         cwidg = self.__canvas.get_tk_widget()
         scroll_canvas.create_window(0, 0, anchor='nw', window=cwidg)
 
+        # Toolbar to zoom and pan, lines are decimated again for the visible range
+        toolbar = NavigationToolbar2Tk(self.__canvas, canvas_frame, pack_toolbar=False)
+        toolbar.grid(row=0, column=0, sticky='ew')
+
         scrx = ttk.Scrollbar(canvas_frame, orient="horizontal", command=scroll_canvas.xview)
         scry = ttk.Scrollbar(canvas_frame, orient="vertical", command=scroll_canvas.yview)
         scroll_canvas.configure(yscrollcommand=scry.set, xscrollcommand=scrx.set)
@@ -102,36 +133,45 @@ class StimSeqGUI(Tk):
         main_frame.pack()
 
     def __quit(self) -> None:
-        """ Callable to close GUI Window"""
+        """ Callable to close GUI Window, a running sequence is aborted and its outputs reset first"""
+        if self.__worker is not None:
+            self.__cancel_event.set()
+            self.__worker.join()
+            self.__end_run()
         self.quit()
         self.destroy()
 
     def __plot_sequence(self,) -> None:
         """Plot the sequence in the graphical interface and show it to the user
 
+        Lines are drawn from the transitions of each column, decimated to the width of the axes.
         """
-
-        # Arrange data for easy plot
-        plotable_sequence: dict[str, list[int | float | bool]] = {}
-        timestamps = []
-        for step in self.__stimseq.sequence:
-            timestamps.append(step[stimseq.TIMESTAMP])
-            for key in stimseq.SEQUENCE_COLUMNS:
-                if key == stimseq.TIMESTAMP:
-                    continue
-                plotable_sequence.setdefault(key, []).append(step[key])
-
-        # Plot the sequence column by column
-        for i, (title, values) in enumerate(plotable_sequence.items()):
-            self.__axes[i].clear()
-            self.__axes[i].plot(timestamps, values, PLOT_STYLE, drawstyle="steps-post")
-            self.__axes[i].set_ylabel(title)
-
         # Set sequence filename as figure Title
-        self.__figure.suptitle(f"{os.path.basename(self.__sequence_path)}", fontsize=16)
-
+        self.__plotter.set_sequence(self.__stimseq.compiled, title=f"{os.path.basename(self.__sequence_path)}")
         self.__canvas.draw()
 
+    def __watch_sequence_file(self) -> None:
+        """ Parse the sequence file again where it changed, and redraw the changed time span of the plot
+
+        The file is not parsed again while a sequence runs, changes are then loaded after the run.
+        """
+        if self.__worker is None:
+            try:
+                update = self.__watcher.update()
+                if update is not None:
+                    self.__stimseq.set_parsed_sequence(self.__sequence_path, self.__watcher.compiled, self.__watcher.report)
+            except (OSError, ValueError) as error:
+                update = None
+                self.__status.set(f"Could not reload {os.path.basename(self.__sequence_path)}: {error}")
+            if update is not None:
+                if update.full:
+                    self.__plot_sequence()
+                elif update.t_start is not None:
+                    self.__plotter.update_sequence(self.__watcher.compiled, update.t_start, update.t_end)
+                self.__status.set(f"Reloaded {os.path.basename(self.__sequence_path)}: {update.parsed_rows} rows parsed, "
+                                  f"{len(self.__watcher.compiled)} steps, {len(self.__watcher.report)} skipped rows")
+        self.after(WATCH_INTERVAL, self.__watch_sequence_file)
+
     def mainloop(self, n=0) -> None:
         """ Show gui
         plot the sequence, and add buttons asking the use what he wants to do
@@ -152,17 +192,13 @@ class StimSeqGUI(Tk):
         # Wait for user input
         super().mainloop(n=n)
 
-        # Run sequence only if requested
-        if self.__run_sequence:
-            self.__stimseq.run_sequence()
-
-    def __get_sequence_file_from_user(self) -> None:
-        """ Opens a window to ask the user for the sequence file
+    def __get_sequence_file_from_user(self) -> str:
+        """ Opens a window to ask the user for the sequence file, returns an empty path if cancelled
         """
 
         path = filedialog.askopenfilename(defaultextension=".csv",
                                           initialdir=os.getcwd(),
-                                          filetypes=[(".csv","*.csv")])
+                                          filetypes=[(".csv","*.csv"), (stimseq.PROTOCOL_EXTENSION, f"*{stimseq.PROTOCOL_EXTENSION}")])
         return path
 
     def __btn_save_plot_and_start(self) -> None:
@@ -173,26 +209,115 @@ class StimSeqGUI(Tk):
         path = filedialog.asksaveasfilename(initialfile=f"{now.strftime("%Y-%m-%d_%H.%M.%S")}-{os.path.basename(self.__sequence_path)}.png",
                                             initialdir=os.getcwd(),
                                             defaultextension="png")
-        self.__figure.savefig(path)
-        self.__run_sequence = True
-        self.__quit()
+        self.__plotter.savefig(path)
+        self.__start_run()
+
+    def __btn_export_timeline(self) -> None:
+        """ Callback to render the sequence into a timeline file, sampled at RENDER_SAMPLE_RATE
+        """
+        now = datetime.now()
+
+        path = filedialog.asksaveasfilename(initialfile=f"{now.strftime("%Y-%m-%d_%H.%M.%S")}-{os.path.basename(self.__sequence_path)}.npy",
+                                            initialdir=os.getcwd(),
+                                            defaultextension="npy",
+                                            filetypes=[(".npy", "*.npy")])
+        if not path:
+            return
+        timeline = export_timeline(self.__stimseq.compiled, path, sample_rate=RENDER_SAMPLE_RATE)
+        self.__status.set(f"Exported {len(timeline)} samples to {os.path.basename(path)}")
+
+    def __start_run(self) -> None:
+        """ Send the sequence from a worker thread, progress is read back by __poll_progress
+        """
+        self.__cancel_event.clear()
+        self.__btn_change.configure(state="disabled")
+        self.__btn_save.configure(state="disabled")
+        self.__btn_export.configure(state="disabled")
+        self.__btn_abort.configure(state="normal")
+        self.__status.set("Waiting for trigger signal")
+        self.__plotter.set_cursor(0)
+
+        sys.setswitchinterval(RUN_SWITCH_INTERVAL)
+        self.__worker = Thread(target=self.__run_worker, name="Sequence", daemon=True)
+        self.__worker.start()
+        self.after(PROGRESS_REFRESH, self.__poll_progress)
+
+    def __run_worker(self) -> None:
+        """ Body of the worker thread, the end of the run is sent through the queue as None or the raised error
+        """
+        try:
+            self.__stimseq.run_sequence(cancel_event=self.__cancel_event, progress=self.__progress)
+        except Exception as error: #pylint: disable=broad-exception-caught
+            self.__progress.put(error)
+        else:
+            self.__progress.put(None)
+
+    def __poll_progress(self) -> None:
+        """ Show the last progress of the run, only the cursor is redrawn
+        """
+        last = None
+        finished = False
+        while True:
+            try:
+                message = self.__progress.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(message, stimseq.Progress):
+                last = message
+            else:
+                finished = True
+                end_message = "Sequence finished" if message is None else f"Sequence stopped: {message}"
+
+        if last is not None:
+            self.__plotter.set_cursor(last.time)
+            self.__status.set(f"Step {last.steps_done}/{last.steps} - lateness {last.lateness:.3f} ms - "
+                              f"{last.late_steps} late steps, max {last.max_lateness:.3f} ms")
+        if finished:
+            self.__end_run()
+            self.__status.set(f"{end_message}. {self.__status.get()}")
+        else:
+            self.after(PROGRESS_REFRESH, self.__poll_progress)
+
+    def __end_run(self) -> None:
+        """ Restore the GUI after the worker thread ended
+        """
+        sys.setswitchinterval(self.__switch_interval)
+        self.__worker = None
+        self.__btn_change.configure(state="normal")
+        self.__btn_save.configure(state="normal")
+        self.__btn_export.configure(state="normal")
+        self.__btn_abort.configure(state="disabled")
+        self.__plotter.set_cursor(None)
+
+    def __btn_abort(self) -> None:
+        """ Callback to abort the running sequence, outputs are reset to 0 by the worker
+        """
+        self.__cancel_event.set()
 
     def __btn_change_sequence_file(self) -> None:
         """Callback for changing the selected sequence file
         """
-        # Get a new sequence
-        self.__sequence_path = self.__get_sequence_file_from_user()
-
-        # Load new sequence file into stimseq backend
-        self.__stimseq.seq_path = self.__sequence_path
+        # Get a new sequence, nothing changes if the dialog is cancelled
+        path = self.__get_sequence_file_from_user()
+        if not path:
+            return
+
+        # Load new sequence file into stimseq backend, parsed once by the watcher. The previous sequence is kept if it can not be loaded
+        try:
+            watcher = SequenceWatcher(path, self.__stimseq.min_timestep)
+            self.__stimseq.set_parsed_sequence(path, watcher.compiled, watcher.report)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Invalid sequence file", f"Could not load {os.path.basename(path)}: {error}")
+            return
+        self.__sequence_path = path
+        self.__watcher = watcher
 
         # plot new sequence
         self.__plot_sequence()
 
     def __btn_exit_no_run(self) -> None:
-        """ Callback for quitiing without reunning the sequence
+        """ Callback for quitiing, a running sequence is aborted
         """
-        self.__run_sequence = False
         self.__quit()
 
 
@@ -0,0 +1,324 @@
+#pylint: disable=line-too-long
+"""Run sequences on several DAQs at once
+
+Each device is wired as DAQ_WIRING, with its own name in NI MAX, and runs one
+sequence (the same one or one per device) from its own worker thread, so the write
+latencies of the devices add up in parallel rather than in series.
+
+All workers share the start of the run:
+- trigger: every device waits for the trigger signal on its TTL_DI, the same TTL being
+  wired to all devices. Steps are timed from the first detection of the edge, so the
+  detection jitter of each device does not delay its outputs
+- software: devices start together once all of them are armed, without trigger signal
+
+The start skew between devices, and the timing of each device, are logged at the end
+of the run.
+"""
+import argparse
+import logging
+import os
+from threading import Condition, Event, Thread
+from time import perf_counter_ns
+from typing import NamedTuple
+
+from stimseq import (AO_MAX_SAMPLE_RATE, CANCEL_CHECK_INTERVAL, LATE_CATCH_UP, LATE_POLICIES, LOG_FILE, LOG_LEVELS,
+                     RunTiming, SequenceAbortedError, StimSeqSession)
+from stimseq_daq import DaqBackend
+
+START_MODES = [
+    START_TRIGGER := "trigger",
+    START_SOFTWARE := "software",
+]
+
+# Time in ms between the release of a software start and the start of the sequences,
+# so every worker is waiting for its first step when the sequences start
+SOFTWARE_START_DELAY = 5
+
+DEVICE_STATUSES = [
+    DEVICE_DONE := "done",
+    DEVICE_ABORTED := "aborted",
+    DEVICE_FAILED := "failed",
+]
+
+
+class DeviceResult(NamedTuple):
+    """ Outcome of the run of one device """
+    device:str
+    path:str
+    status:str
+    message:str = ""
+    timing:RunTiming | None = None
+    detection_ns:int | None = None
+
+
+class SharedStart():
+    """ Start shared by the workers of several devices
+
+    Each worker calls wait() instead of waiting for its own trigger. All of them are
+    released together with the same start time, once every device is armed (software
+    mode) or has detected the trigger signal (trigger mode).
+    """
+    def __init__(self, devices:list[str], mode:str=START_TRIGGER, start_delay:float=SOFTWARE_START_DELAY) -> None:
+        """
+        Args:
+            devices (list[str]): Name of each device taking part in the start
+            mode (str, optional): One of START_MODES. Defaults to START_TRIGGER.
+            start_delay (float, optional): Time in ms between the release and the start in software mode.
+                Defaults to SOFTWARE_START_DELAY.
+        """
+        if mode not in START_MODES:
+            raise ValueError(f"Start mode must be one of {START_MODES}, got {mode}")
+        self.__devices = list(devices)
+        self.__mode = mode
+        self.__start_delay = start_delay
+        self.__condition = Condition()
+        self.__detections:dict[str, int] = {}
+        self.__start_ns:int | None = None
+        self.__aborted = False
+
+    @property
+    def mode(self) -> str:
+        """ Reader for __mode """
+        return self.__mode
+
+    @property
+    def start_ns(self) -> int | None:
+        """ Reader for __start_ns, shared start time (perf_counter_ns), None before the release """
+        return self.__start_ns
+
+    @property
+    def detections(self) -> dict[str, int]:
+        """ Reader for __detections, time at which each device detected the trigger or was armed (perf_counter_ns) """
+        return dict(self.__detections)
+
+    def abort(self) -> None:
+        """ Release every waiting worker without start, ex: when a device failed """
+        with self.__condition:
+            self.__aborted = True
+            self.__condition.notify_all()
+
+    def waiter(self, device:str):
+        """ Function waiting for the start of a device, to give as wait_start to StimSeq.run_sequence
+
+        Args:
+            device (str): Name of the device
+
+        Returns:
+            Callable[[DaqBackend, float | None, Event | None], int | None]: The function
+        """
+        return lambda daq, timeout, cancel_event: self.wait(device, daq, timeout, cancel_event)
+
+    def wait(self, device:str, daq:DaqBackend, timeout:float|None=None, cancel_event:Event|None=None) -> int | None:
+        """ Wait for the trigger signal or the arming of all devices
+
+        Args:
+            device (str): Name of the device
+            daq (DaqBackend): Opened backend of the device
+            timeout (float | None, optional): Time in s to wait for the start. Defaults to None (no timeout).
+            cancel_event (Event | None, optional): Event stopping the wait when set. Defaults to None.
+
+        Returns:
+            int | None: Shared start time (perf_counter_ns), None if aborted, cancelled or timed out
+        """
+        deadline_ns = None if timeout is None else perf_counter_ns() + int(timeout * 1e9)
+        if self.__mode == START_TRIGGER:
+            detection_ns = daq.wait_trigger(timeout=timeout, cancel_event=cancel_event)
+            if detection_ns is None:
+                self.abort()
+                return None
+        else:
+            detection_ns = perf_counter_ns()
+
+        with self.__condition:
+            self.__detections[device] = detection_ns
+            if len(self.__detections) == len(self.__devices) and not self.__aborted:
+                # Last device to arrive releases the others
+                if self.__mode == START_TRIGGER:
+                    self.__start_ns = min(self.__detections.values())
+                else:
+                    self.__start_ns = perf_counter_ns() + int(self.__start_delay * 1e6)
+                self.__condition.notify_all()
+
+            # Waits in slices, so cancellation and timeout are checked
+            while self.__start_ns is None and not self.__aborted:
+                if (cancel_event is not None and cancel_event.is_set()) or (deadline_ns is not None and perf_counter_ns() > deadline_ns):
+                    self.__aborted = True
+                    self.__condition.notify_all()
+                    break
+                self.__condition.wait(CANCEL_CHECK_INTERVAL / 1000)
+            return None if self.__aborted else self.__start_ns
+
+
+class MultiDeviceRunner():
+    """ Run sequences on several devices at once, one worker thread per device
+    """
+    def __init__(
+            self,
+            sequences:dict[str, str],
+            start_mode:str=START_TRIGGER,
+            enable_heartbeat:bool=True,
+            log_file:str=os.path.join(os.path.dirname(__file__), LOG_FILE),
+            log_lvl=logging.INFO,
+            use_cache:bool=True,
+            backends:dict[str, DaqBackend]|None=None,
+        ) -> None:
+        """
+        Args:
+            sequences (dict[str, str]): Path of the sequence file of each device, by device name
+            start_mode (str, optional): Start shared by the devices, one of START_MODES. Defaults to START_TRIGGER.
+            enable_heartbeat (bool, optional): Enables the heartbeat signal of each device. Defaults to True.
+            log_file (str, optional): Path of the log file, shared by the devices. Defaults to LOG_FILE next to this file.
+            log_lvl (optional): Logging level. Defaults to logging.INFO.
+            use_cache (bool, optional): Use the cache of parsed sequences. Defaults to True.
+            backends (dict[str, DaqBackend] | None, optional): Access to each DAQ, by device name. Defaults to NidaqmxBackend.
+        """
+        if not sequences:
+            raise ValueError("No devices given")
+        if start_mode not in START_MODES:
+            raise ValueError(f"Start mode must be one of {START_MODES}, got {start_mode}")
+        backends = backends if backends is not None else {}
+
+        self.__start_mode = start_mode
+        self.__results:list[DeviceResult] = []
+        self.__sessions = {device: StimSeqSession(path, enable_heartbeat=enable_heartbeat, log_file=log_file, log_lvl=log_lvl,
+                                                  use_cache=use_cache, backend=backends.get(device), device=device)
+                           for device, path in sequences.items()}
+        self.__logger = next(iter(self.__sessions.values())).logger.logger
+
+    @property
+    def devices(self) -> list[str]:
+        """ Names of the devices """
+        return list(self.__sessions)
+
+    @property
+    def sessions(self) -> dict[str, StimSeqSession]:
+        """ Reader for __sessions, session of each device """
+        return dict(self.__sessions)
+
+    @property
+    def results(self) -> list[DeviceResult]:
+        """ Reader for __results, result of each device for the last run """
+        return list(self.__results)
+
+    def run(self, cancel_event:Event|None=None, **run_kwargs) -> list[DeviceResult]:
+        """ Run the sequence of each device, starting together
+
+        When a device fails or is aborted, cancel_event is set so the other devices stop and reset their outputs.
+
+        Args:
+            cancel_event (Event | None, optional): Event stopping every device when set. Defaults to None.
+            **run_kwargs: Arguments of StimSeqSession.run_sequence, used for every device
+
+        Raises:
+            ValueError: If hardware timed AO is used with a software start, the AO generation being started by the trigger signal
+
+        Returns:
+            list[DeviceResult]: Result of each device
+        """
+        if self.__start_mode == START_SOFTWARE and run_kwargs.get("ao_sample_rate") is not None:
+            raise ValueError("Hardware timed AO needs the trigger signal, it can not be used with a software start")
+        cancel_event = cancel_event if cancel_event is not None else Event()
+        start = SharedStart(self.devices, mode=self.__start_mode)
+        results:dict[str, DeviceResult] = {}
+
+        def worker(device:str, session:StimSeqSession) -> None:
+            try:
+                session.run_sequence(cancel_event=cancel_event, wait_start=start.waiter(device), **run_kwargs)
+                results[device] = DeviceResult(device, session.seq_path, DEVICE_DONE, timing=session.last_run)
+            except SequenceAbortedError as error:
+                results[device] = DeviceResult(device, session.seq_path, DEVICE_ABORTED, str(error))
+            except Exception as error: #pylint: disable=broad-exception-caught
+                session.logger.exception("Run failed")
+                results[device] = DeviceResult(device, session.seq_path, DEVICE_FAILED, str(error))
+            if results[device].status != DEVICE_DONE:
+                # Devices run one experiment, the others are stopped too
+                cancel_event.set()
+                start.abort()
+
+        self.__logger.info("Starting %i devices (%s start): %s", len(self.__sessions), self.__start_mode, ", ".join(self.devices))
+        opened = []
+        try:
+            for session in self.__sessions.values():
+                session.open()
+                opened.append(session)
+            workers = [Thread(target=worker, args=(device, session), name=f"Device {device}")
+                       for device, session in self.__sessions.items()]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            for session in opened:
+                session.close()
+
+        detections = start.detections
+        self.__results = [results[device]._replace(detection_ns=detections.get(device)) for device in self.devices]
+        self.__log_summary(start)
+        return self.results
+
+    def __log_summary(self, start:SharedStart) -> None:
+        # Skews are measured on the host clock, between the fastest and the slowest device
+        counts = {status: sum(result.status == status for result in self.__results) for status in DEVICE_STATUSES}
+        self.__logger.info("Devices finished: %s", ", ".join(f"{count} {status}" for status, count in counts.items()))
+        for result in self.__results:
+            if result.status != DEVICE_DONE:
+                self.__logger.warning("%s (%s) %s: %s", result.device, result.path, result.status, result.message)
+            else:
+                self.__logger.info("%s: first write %.3f ms late, %i late steps, max lateness %.3f ms", result.device,
+                                   result.timing.first_write_lateness or 0, result.timing.late_steps, result.timing.max_lateness)
+
+        detections = [result.detection_ns for result in self.__results if result.detection_ns is not None]
+        if start.mode == START_TRIGGER and len(detections) > 1:
+            self.__logger.info("Trigger detection skew between devices: %.3f ms", (max(detections) - min(detections)) / 1e6)
+        first_writes = [result.timing.first_write_lateness for result in self.__results
+                        if result.timing is not None and result.timing.first_write_lateness is not None]
+        if len(first_writes) > 1:
+            self.__logger.info("Start skew between devices (first writes): %.3f ms", max(first_writes) - min(first_writes))
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Run stimulation sequences on several DAQs at once")
+    parser.add_argument('--devices', dest="devices", nargs='+', type=str, required=True,
+                        help="Names of the devices as defined in NI MAX, each one wired as DAQ_WIRING")
+    parser.add_argument('--paths', dest="paths", nargs='+', type=str, required=True,
+                        help="Sequence file run by every device, or one sequence file per device")
+    parser.add_argument('--start', dest="start_mode", type=str, default=START_TRIGGER,
+                        choices=START_MODES,
+                        help="Wait for the trigger signal wired to every device, or start once every device is armed")
+    parser.add_argument('--log', dest="log_lvl", type=str,
+                        choices=LOG_LEVELS.keys(),
+                        help="Select the logging level")
+    parser.add_argument('--disable-heartbeat', dest="disable_heartbeat",
+                        help="Used to disable heartbeat output",
+                        action='store_true')
+    parser.add_argument('--no-cache', dest="no_cache",
+                        help="Used to parse the sequence files even if they are in the cache",
+                        action='store_true')
+    parser.add_argument('--late-policy', dest="late_policy", type=str, default=LATE_CATCH_UP,
+                        choices=LATE_POLICIES,
+                        help="Handling of late steps")
+    parser.add_argument('--ao-rate', dest="ao_sample_rate", type=float,
+                        help=f"Sample rate (S/s) for hardware timed analog outputs, max {AO_MAX_SAMPLE_RATE}. Analog outputs are software timed if not given")
+    parser.add_argument('--trigger-timeout', dest="trigger_timeout", type=float,
+                        help="Time in s to wait for the start before aborting. Waits forever if not given")
+    parser.add_argument('--timing-report', dest="timing_report",
+                        help="Used to export the timing records of each device next to the log file",
+                        action='store_true')
+    args = parser.parse_args()
+
+    if len(args.paths) not in (1, len(args.devices)):
+        parser.error("Give one sequence file, or one per device")
+    if len(set(args.devices)) != len(args.devices):
+        parser.error("Devices must be different")
+    paths = args.paths * len(args.devices) if len(args.paths) == 1 else args.paths
+
+    runner = MultiDeviceRunner(dict(zip(args.devices, paths)),
+                               start_mode=args.start_mode,
+                               enable_heartbeat=not args.disable_heartbeat,
+                               log_lvl=LOG_LEVELS[args.log_lvl or "INFO"],
+                               log_file=os.path.join(os.path.dirname(__file__), LOG_FILE),
+                               use_cache=not args.no_cache)
+    runner.run(late_policy=args.late_policy, ao_sample_rate=args.ao_sample_rate,
+               trigger_timeout=args.trigger_timeout, timing_report=args.timing_report)
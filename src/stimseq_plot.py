@@ -0,0 +1,323 @@
+#pylint: disable=line-too-long
+"""Plotting of sequences as step waveforms, decimated to the pixel width of the axes
+
+Each channel is reduced to its transitions when a sequence is set. Drawn lines only
+hold the first, min, max and last values of the transitions falling in each pixel of
+the visible time range, and are recomputed when the time range or the size of the
+axes changes. Lines and the cursor showing the progress of a run are animated artists,
+drawn over cached backgrounds (blitting).
+
+matplotlib is not imported when this module is loaded, figures and axes are given by the caller.
+Updates of a time span (update_sequence) only redraw this span.
+"""
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import stimseq
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.backend_bases import DrawEvent
+    from matplotlib.figure import Figure
+
+# Const for plotting sequence
+PLOT_STYLE = 'b-'  # blue, contiguous line (see matplolib documention)
+PLOT_COLUMNS = stimseq.SEQUENCE_COLUMNS[1:]  # One axes per column, first column is for timestamps
+PLOT_MARGIN = 0.1  # Fraction of the value range added above and below the lines
+CURSOR_STYLE = {"color": "r", "linewidth": 1}  # Vertical line showing the progress of a run
+
+# Number of transitions per pixel above which lines are decimated
+DECIMATION_THRESHOLD = 4
+
+# Pixels shown again on each side of an updated time span, lines are decimated per pixel
+UPDATE_MARGIN = 2
+
+
+# Method to keep only the steps changing a value
+def step_transitions(timestamps:np.ndarray, values:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Keep the first step and the steps changing the value
+
+    Args:
+        timestamps (np.ndarray): Timestamp of each step, of shape (steps,)
+        values (np.ndarray): Value of each step, of shape (steps,)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Timestamps and float64 values of the transitions
+    """
+    changes = np.ones(len(values), dtype=bool)
+    changes[1:] = values[1:] != values[:-1]
+    return timestamps[changes], values[changes].astype(np.float64)
+
+
+# Method to reduce the transitions of a time range to a few points per pixel
+def decimate_steps(times:np.ndarray, values:np.ndarray, t_min:float, t_max:float, n_bins:int) -> tuple[np.ndarray, np.ndarray]:
+    """ Reduce the transitions in [t_min, t_max] to the first, min, max and last values of each bin
+
+    The value in effect at t_min is kept. Points are meant to be drawn with drawstyle="steps-post".
+
+    Args:
+        times (np.ndarray): Time of each transition, sorted
+        values (np.ndarray): Value after each transition
+        t_min (float): Start of the visible range
+        t_max (float): End of the visible range
+        n_bins (int): Number of bins, usually the width of the axes in pixels
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Times and values of the points to draw
+    """
+    first = max(int(np.searchsorted(times, t_min, side='right')) - 1, 0)
+    last = int(np.searchsorted(times, t_max, side='right'))
+    times, values = times[first:last], values[first:last]
+    if len(times) <= DECIMATION_THRESHOLD * n_bins or t_max <= t_min:
+        return times, values
+
+    # Transitions are sorted, so each bin is a contiguous group
+    bins = np.clip(((times - t_min) * (n_bins / (t_max - t_min))).astype(np.int64), -1, n_bins)
+    starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+    ends = np.append(starts[1:], len(times)) - 1
+
+    decimated = np.empty((len(starts), 4))
+    decimated[:, 0] = values[starts]
+    decimated[:, 1] = np.minimum.reduceat(values, starts)
+    decimated[:, 2] = np.maximum.reduceat(values, starts)
+    decimated[:, 3] = values[ends]
+    return np.repeat(times[starts], 4), decimated.ravel()
+
+
+class SequencePlotter():
+    """ Draw the columns of a sequence on stacked axes sharing the time axis
+    """
+    def __init__(self, figure:"Figure", axes:"list[Axes]") -> None:
+        """
+        Args:
+            figure (Figure): Figure holding the axes
+            axes (list[Axes]): One axes per PLOT_COLUMNS, sharing the x axis
+        """
+        if len(axes) != len(PLOT_COLUMNS):
+            raise ValueError(f"Expected {len(PLOT_COLUMNS)} axes, got {len(axes)}")
+
+        self.__figure = figure
+        self.__axes = list(axes)
+        self.__lines = [ax.plot([], [], PLOT_STYLE, drawstyle="steps-post", animated=True)[0] for ax in self.__axes]
+        self.__cursors = [ax.axvline(0, visible=False, animated=True, **CURSOR_STYLE) for ax in self.__axes]
+        self.__transitions:list[tuple[np.ndarray, np.ndarray]] = []
+        self.__end_time = 0
+        self.__title = ""
+        # Backgrounds without the animated artists, and with the lines only
+        self.__background = None
+        self.__lines_background = None
+        self.__exporting = False
+
+        for ax, title in zip(self.__axes, PLOT_COLUMNS):
+            ax.set_ylabel(title)
+
+        self.__figure.canvas.mpl_connect('draw_event', self.__on_draw)
+        self.__figure.canvas.mpl_connect('resize_event', lambda event: self.__decimate())
+        self.__axes[0].callbacks.connect('xlim_changed', lambda ax: self.__decimate())
+
+    @property
+    def lines(self) -> list:
+        """ Reader for __lines, the line of each column """
+        return list(self.__lines)
+
+    @property
+    def end_time(self) -> int:
+        """ Reader for __end_time, time in ms at which outputs are reset """
+        return self.__end_time
+
+    def set_sequence(self, sequence:"stimseq.CompiledSequence", title:str="") -> None:
+        """ Replace the plotted sequence, and show it whole
+
+        Args:
+            sequence (stimseq.CompiledSequence): Sequence to plot
+            title (str, optional): Title of the figure. Defaults to "".
+        """
+        do_values = sequence.do_values()
+        self.__transitions = []
+        for ax, key in zip(self.__axes, PLOT_COLUMNS):
+            if key in stimseq.DO_DATA_KEYS:
+                values = do_values[:, stimseq.DO_DATA_KEYS.index(key)]
+            else:
+                values = sequence.ao[:, stimseq.AO_DATA_KEYS.index(key)]
+            self.__transitions.append(step_transitions(sequence.timestamps, values))
+
+            # Lines are animated, so axes are not autoscaled on them
+            low, high = (float(values.min()), float(values.max())) if len(values) else (0, 1)
+            margin = PLOT_MARGIN * ((high - low) or 1)
+            ax.set_ylim(low - margin, high + margin)
+
+        # Outputs are reset after a pause equal to the last time step
+        self.__end_time = self.__sequence_end(sequence)
+        self.__title = title
+        self.__figure.suptitle(title, fontsize=16)
+
+        # Setting the limits decimates the lines
+        self.__axes[0].set_xlim(0, max(self.__end_time, 1))
+        self.__figure.canvas.draw_idle()
+
+    def update_sequence(self, sequence:"stimseq.CompiledSequence", t_start:float, t_end:float) -> None:
+        """ Replace the steps of the plotted sequence in a time span, only this span is redrawn
+
+        Steps outside [t_start, t_end] must be the steps of the plotted sequence (see stimseq_watch).
+        The whole figure is redrawn when the value range or the end of the sequence changes.
+
+        Args:
+            sequence (stimseq.CompiledSequence): The new sequence
+            t_start (float): Time in ms of the first changed step
+            t_end (float): Time in ms of the last changed step
+        """
+        if not self.__transitions or not len(sequence):
+            self.set_sequence(sequence, title=self.__title)
+            return
+
+        # Steps of the span, with the step before (value in effect at t_start) and the step after (its transition may change)
+        timestamps = sequence.timestamps
+        first = int(np.searchsorted(timestamps, t_start, side='left'))
+        after = int(np.searchsorted(timestamps, t_end, side='right'))
+        steps = slice(max(first - 1, 0), min(after + 1, len(sequence)))
+        span_end = timestamps[after] if after < len(sequence) else np.inf
+        part = stimseq.CompiledSequence(timestamps=timestamps[steps], ao=sequence.ao[steps], do_ports=sequence.do_ports[steps])
+        do_values = part.do_values()
+
+        redraw = False
+        for i, (ax, key) in enumerate(zip(self.__axes, PLOT_COLUMNS)):
+            if key in stimseq.DO_DATA_KEYS:
+                values = do_values[:, stimseq.DO_DATA_KEYS.index(key)]
+            else:
+                values = part.ao[:, stimseq.AO_DATA_KEYS.index(key)]
+            new_times, new_values = step_transitions(part.timestamps, values)
+            keep = new_times >= t_start
+            times, old_values = self.__transitions[i]
+            low = int(np.searchsorted(times, t_start, side='left'))
+            high = int(np.searchsorted(times, span_end, side='right'))
+            times = np.concatenate((times[:low], new_times[keep], times[high:]))
+            values = np.concatenate((old_values[:low], new_values[keep], old_values[high:]))
+            self.__transitions[i] = (times, values)
+
+            # Transitions hold every value of the column
+            margin = PLOT_MARGIN * ((float(values.max()) - float(values.min())) or 1)
+            ylim = (float(values.min()) - margin, float(values.max()) + margin)
+            if not np.allclose(ax.get_ylim(), ylim):
+                ax.set_ylim(*ylim)
+                redraw = True
+
+        end_time = self.__sequence_end(sequence)
+        if end_time != self.__end_time:
+            # The whole sequence stays visible if it was
+            if self.__axes[0].get_xlim()[1] >= self.__end_time:
+                self.__axes[0].set_xlim(self.__axes[0].get_xlim()[0], max(end_time, 1))
+            self.__end_time = end_time
+            redraw = True
+
+        self.__decimate()
+        if redraw:
+            self.__figure.canvas.draw_idle()
+        else:
+            self.update_lines(t_start, t_end)
+
+    def update_lines(self, t_start:float|None=None, t_end:float|None=None) -> None:
+        """ Redraw the lines over the cached background, without redrawing the axes
+
+        Args:
+            t_start (float | None, optional): Start in ms of the time span shown again, None for the whole figure. Defaults to None.
+            t_end (float | None, optional): End in ms of the time span shown again, None for the whole figure. Defaults to None.
+        """
+        canvas = self.__figure.canvas
+        if self.__background is None or not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.__background)
+        self.__draw_lines()
+        bbox = self.__span_bbox(t_start, t_end)
+        if bbox is not None:
+            canvas.blit(bbox)
+
+    def set_cursor(self, time:float|None) -> None:
+        """ Move the cursor, only the cursor is redrawn
+
+        Args:
+            time (float | None): Time of the cursor in ms, None to hide it
+        """
+        for cursor in self.__cursors:
+            cursor.set_visible(time is not None)
+            if time is not None:
+                cursor.set_xdata([time, time])
+
+        canvas = self.__figure.canvas
+        if self.__lines_background is None or not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.__lines_background)
+        self.__draw_cursors()
+        canvas.blit(self.__figure.bbox)
+
+    def savefig(self, path:str, **kwargs) -> None:
+        """ Save the figure with its lines, animated artists are not drawn by Figure.savefig
+
+        Args:
+            path (str): Path of the image
+            **kwargs: Arguments of Figure.savefig
+        """
+        self.__exporting = True
+        try:
+            for line in self.__lines + self.__cursors:
+                line.set_animated(False)
+            self.__figure.savefig(path, **kwargs)
+        finally:
+            for line in self.__lines + self.__cursors:
+                line.set_animated(True)
+            self.__exporting = False
+
+    @staticmethod
+    def __sequence_end(sequence:"stimseq.CompiledSequence") -> int:
+        # Outputs are reset after a pause equal to the last time step
+        return int(sequence.timestamps[-1] + sequence.time_increments[-1]) if len(sequence) else 0
+
+    def __span_bbox(self, t_start:float|None, t_end:float|None):
+        # Region of the figure holding a time span on every axes, None if the span is not visible
+        if t_start is None or t_end is None:
+            return self.__figure.bbox
+        from matplotlib.transforms import Bbox #pylint: disable=import-outside-toplevel
+        x = self.__axes[0].transData.transform([(t_start, 0), (t_end, 0)])[:, 0]
+        axes_box = self.__axes[0].bbox
+        x0 = max(float(x.min()) - UPDATE_MARGIN, axes_box.x0)
+        x1 = min(float(x.max()) + UPDATE_MARGIN, axes_box.x1)
+        if x1 <= x0:
+            return None
+        figure_box = self.__figure.bbox
+        return Bbox.from_extents(x0, figure_box.y0, x1, figure_box.y1)
+
+    def __decimate(self) -> None:
+        # Recompute the points of each line for the visible range and the width of the axes
+        if not self.__transitions:
+            return
+        t_min, t_max = self.__axes[0].get_xlim()
+        n_bins = max(int(self.__axes[0].get_window_extent().width), 1)
+        for line, (times, values) in zip(self.__lines, self.__transitions):
+            x, y = decimate_steps(times, values, t_min, t_max, n_bins)
+            # Last value lasts until the outputs are reset
+            line.set_data(np.append(x, self.__end_time), np.append(y, y[-1:]))
+
+    def __draw_lines(self) -> None:
+        # Lines, then the cursor over them
+        for ax, line in zip(self.__axes, self.__lines):
+            ax.draw_artist(line)
+        if self.__figure.canvas.supports_blit:
+            self.__lines_background = self.__figure.canvas.copy_from_bbox(self.__figure.bbox)
+        self.__draw_cursors()
+
+    def __draw_cursors(self) -> None:
+        for ax, cursor in zip(self.__axes, self.__cursors):
+            ax.draw_artist(cursor)
+
+    def __on_draw(self, event:"DrawEvent") -> None:
+        # The axes were drawn without the animated artists, keep them as background then draw the artists
+        if self.__exporting:
+            return
+        canvas = self.__figure.canvas
+        if canvas.supports_blit:
+            self.__background = canvas.copy_from_bbox(self.__figure.bbox)
+        self.__draw_lines()
+        if canvas.supports_blit:
+            canvas.blit(self.__figure.bbox)
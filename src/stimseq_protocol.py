@@ -0,0 +1,286 @@
+#pylint: disable=line-too-long
+"""Procedural sequence definitions
+
+A protocol file (.toml) describes a sequence with named blocks of steps, instead of
+spelling out every step as in csv sequence files:
+
+    seed = 42
+
+    [blocks.odor]
+    steps = [
+        { duration = 2000 },
+        { duration = 500, V1 = 1, Piezo = 1 },
+    ]
+
+    [blocks.light]
+    sweep = { level = [1, 2.5, 5] }
+    shuffle = true
+    steps = [
+        { duration = 1000, LED = "level" },
+        { duration = 1000 },
+    ]
+
+    [[protocol]]
+    blocks = ["odor", "light"]
+    repeat = 40
+    shuffle = true
+
+Each step lasts its duration in ms, outputs not given are 0. A block with a sweep is
+expanded once per value of its parameters, steps using the parameter name as value.
+Sweep values are a list, or evenly spaced values given as { start, stop, num }.
+Protocol entries are expanded in order, each one repeating its blocks, in a random
+order for each repetition if shuffled. Random orders are drawn from the seed, so a
+protocol file always gives the same sequence.
+
+Protocols are fully expanded: every step is held in memory, as the rows of a parsed
+sequence file, and validated with the rules of csv sequence files (minimum time step,
+AO_RANGE).
+"""
+import random
+import tomllib
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+import stimseq
+
+# Keys of protocol files
+DURATION = "duration"
+OUTPUT_COLUMNS = stimseq.SEQUENCE_COLUMNS[1:]  # Columns given by steps, first column is for timestamps
+BLOCK_KEYS = ["steps", "sweep", "shuffle"]
+SWEEP_RANGE_KEYS = ["start", "stop", "num"]
+ENTRY_KEYS = ["block", "blocks", "repeat", "shuffle"]
+PROTOCOL_KEYS = ["seed", "blocks", "protocol"]
+
+
+class Block(NamedTuple):
+    """ Block of steps of a protocol
+
+    Attributes:
+        name (str): Name of the block
+        durations (np.ndarray): Duration of each step in ms, float64 of shape (steps,)
+        values (np.ndarray): Output values of each step in OUTPUT_COLUMNS order, float64 of shape (steps, len(OUTPUT_COLUMNS)).
+            NaN where a sweep parameter is used
+        parameters (dict[tuple[int, int], str]): Sweep parameter used by (step, column) cells
+        sweep (dict[str, list[float]]): Values of each sweep parameter, all with the same length
+        shuffle (bool): Random order of the sweep values
+    """
+    name: str
+    durations: np.ndarray
+    values: np.ndarray
+    parameters: dict[tuple[int, int], str]
+    sweep: dict[str, list[float]]
+    shuffle: bool
+
+    def instances(self, rng:random.Random) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """ Steps of the block for each sweep value
+
+        Args:
+            rng (random.Random): Random generator for shuffled sweeps
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: Durations and values of the steps
+        """
+        n_values = len(next(iter(self.sweep.values()))) if self.sweep else 1
+        order = list(range(n_values))
+        if self.shuffle:
+            rng.shuffle(order)
+        for index in order:
+            values = self.values.copy()
+            for (step, column), parameter in self.parameters.items():
+                values[step, column] = self.sweep[parameter][index]
+            yield self.durations, values
+
+
+class ProtocolEntry(NamedTuple):
+    """ Blocks run in order by a protocol, repeated """
+    blocks: list[str]
+    repeat: int
+    shuffle: bool
+
+
+class Protocol(NamedTuple):
+    """ Definition of a protocol, read from a protocol file """
+    blocks: dict[str, Block]
+    entries: list[ProtocolEntry]
+    seed: int
+
+    def instances(self) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """ Expand the protocol block by block
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: Durations and values of the steps of each block instance
+        """
+        rng = random.Random(self.seed)
+        for entry in self.entries:
+            for _ in range(entry.repeat):
+                names = list(entry.blocks)
+                if entry.shuffle:
+                    rng.shuffle(names)
+                for name in names:
+                    yield from self.blocks[name].instances(rng)
+
+
+# Method to check the keys of a table of a protocol file
+def _check_keys(table:dict, allowed:list[str], where:str) -> None:
+    if unknown := set(table) - set(allowed):
+        raise ValueError(f"Unknown keys in {where}: {sorted(unknown)}, expected some of {allowed}")
+
+
+# Method to convert a value of a protocol file to a number
+def _number(value, where:str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Expected a number in {where}, got {value!r}")
+    return float(value)
+
+
+# Method to read the values of a sweep parameter, a list or evenly spaced values
+def _read_sweep(values:list|dict, where:str) -> list[float]:
+    if isinstance(values, dict):
+        _check_keys(values, SWEEP_RANGE_KEYS, where)
+        if set(values) != set(SWEEP_RANGE_KEYS) or not isinstance(values["num"], int) or values["num"] < 1:
+            raise ValueError(f"Expected {SWEEP_RANGE_KEYS} with a positive integer num in {where}")
+        return np.linspace(_number(values["start"], where), _number(values["stop"], where), values["num"]).tolist()
+    return [_number(value, where) for value in values]
+
+
+def _read_block(name:str, table:dict) -> Block:
+    """ Read and check a block of a protocol file
+
+    Raises:
+        ValueError: If the block is not valid
+
+    Returns:
+        Block: The block
+    """
+    where = f"block {name}"
+    _check_keys(table, BLOCK_KEYS, where)
+
+    sweep = {parameter: _read_sweep(values, f"sweep {parameter} of {where}")
+             for parameter, values in table.get("sweep", {}).items()}
+    if len({len(values) for values in sweep.values()}) > 1:
+        raise ValueError(f"Sweep parameters of {where} must have the same number of values")
+    if any(not values for values in sweep.values()):
+        raise ValueError(f"Sweep parameters of {where} must have values")
+
+    steps = table.get("steps", [])
+    if not steps:
+        raise ValueError(f"No steps in {where}")
+    durations = np.empty(len(steps))
+    values = np.zeros((len(steps), len(OUTPUT_COLUMNS)))
+    parameters:dict[tuple[int, int], str] = {}
+    for i, step in enumerate(steps):
+        step_where = f"step {i} of {where}"
+        _check_keys(step, [DURATION, *OUTPUT_COLUMNS], step_where)
+        if DURATION not in step:
+            raise ValueError(f"No {DURATION} in {step_where}")
+        durations[i] = _number(step[DURATION], step_where)
+        if durations[i] < 0:
+            raise ValueError(f"Negative {DURATION} in {step_where}")
+        if not durations[i].is_integer():
+            # Timestamps are whole ms, as in sequence files
+            raise ValueError(f"{DURATION} of {step_where} must be a whole number of ms, got {step[DURATION]!r}")
+        for column, value in step.items():
+            if column == DURATION:
+                continue
+            if isinstance(value, str):
+                if value not in sweep:
+                    raise ValueError(f"Unknown sweep parameter {value!r} in {step_where}")
+                parameters[(i, OUTPUT_COLUMNS.index(column))] = value
+                values[i, OUTPUT_COLUMNS.index(column)] = np.nan
+            else:
+                values[i, OUTPUT_COLUMNS.index(column)] = _number(value, step_where)
+
+    return Block(name=name, durations=durations, values=values, parameters=parameters,
+                 sweep=sweep, shuffle=bool(table.get("shuffle", False)))
+
+
+def read_protocol(path:str) -> Protocol:
+    """ Read and check a protocol file
+
+    Args:
+        path (str): Path to the protocol file
+
+    Raises:
+        ValueError: If the file is not a valid protocol
+
+    Returns:
+        Protocol: The protocol definition
+    """
+    with open(path, 'rb') as f:
+        try:
+            table = tomllib.load(f)
+        except tomllib.TOMLDecodeError as error:
+            raise ValueError(f"Invalid protocol file {path}: {error}") from error
+    _check_keys(table, PROTOCOL_KEYS, "protocol file")
+
+    blocks = {name: _read_block(name, block) for name, block in table.get("blocks", {}).items()}
+    entries = []
+    for i, entry in enumerate(table.get("protocol", [])):
+        where = f"protocol entry {i}"
+        _check_keys(entry, ENTRY_KEYS, where)
+        names = [entry["block"]] if "block" in entry else entry.get("blocks", [])
+        if not names or ("block" in entry and "blocks" in entry):
+            raise ValueError(f"{where} must have either block or blocks")
+        if unknown := [name for name in names if name not in blocks]:
+            raise ValueError(f"Unknown blocks in {where}: {unknown}")
+        repeat = entry.get("repeat", 1)
+        if isinstance(repeat, bool) or not isinstance(repeat, int) or repeat < 0:
+            raise ValueError(f"repeat of {where} must be a non-negative integer, got {repeat!r}")
+        entries.append(ProtocolEntry(blocks=names, repeat=repeat, shuffle=bool(entry.get("shuffle", False))))
+    if not entries:
+        raise ValueError(f"No protocol entries in {path}")
+
+    seed = table.get("seed", 0)
+    if not isinstance(seed, int):
+        raise ValueError(f"seed must be an integer, got {seed!r}")
+    return Protocol(blocks=blocks, entries=entries, seed=seed)
+
+
+def expand_protocol(protocol:Protocol, min_timestep:int|None=None) -> tuple["stimseq.CompiledSequence", "stimseq.ValidationReport"]:
+    """ Expand a protocol into validated steps
+
+    Every step of the protocol is held in memory at once, as the rows of a parsed sequence
+    file. A step setting every output to 0 is added at the end of the protocol, so the last
+    step lasts its duration.
+
+    Args:
+        protocol (Protocol): The protocol
+        min_timestep (int | None, optional): Minimum time step in ms. Defaults to stimseq.MIN_TIMESTEP.
+
+    Raises:
+        ValueError: If the protocol has no step
+
+    Returns:
+        tuple[stimseq.CompiledSequence, stimseq.ValidationReport]: The valid steps and the skipped rows,
+            numbered from the start of the protocol
+    """
+    instances = list(protocol.instances())
+    if not instances:
+        # Ex: every entry repeated 0 times
+        raise ValueError("Protocol has no step")
+    durations = np.concatenate([durations for durations, _ in instances])
+
+    # Outputs go back to 0 at the end of the last step, even if already 0
+    rows = np.zeros((len(durations) + 1, len(stimseq.SEQUENCE_COLUMNS)))
+    rows[:, stimseq.SEQUENCE_COLUMNS.index(stimseq.TIMESTAMP)] = np.concatenate(([0], np.cumsum(durations)))
+    rows[:-1, [stimseq.SEQUENCE_COLUMNS.index(column) for column in OUTPUT_COLUMNS]] = np.concatenate([values for _, values in instances])
+    sequence, report = stimseq._validate_values(rows, min_timestep=min_timestep) #pylint: disable=protected-access
+    # Protocols start at 0 by definition, no timestamp is forced
+    return sequence, stimseq.ValidationReport(rows=report.rows, reasons=report.reasons, first_timestamp_forced=False)
+
+
+def parse_protocol_file(path:str, min_timestep:int|None=None) -> tuple["stimseq.CompiledSequence", "stimseq.ValidationReport"]:
+    """ Read, expand and validate a protocol file
+
+    Args:
+        path (str): Path to the protocol file
+        min_timestep (int | None, optional): Minimum time step in ms. Defaults to stimseq.MIN_TIMESTEP.
+
+    Raises:
+        ValueError: If the file is not a valid protocol, or has no step
+
+    Returns:
+        tuple[stimseq.CompiledSequence, stimseq.ValidationReport]: The valid steps and the skipped rows
+    """
+    return expand_protocol(read_protocol(path), min_timestep=min_timestep)
@@ -0,0 +1,195 @@
+#pylint: disable=line-too-long
+"""Rendering of sequences into sampled timelines
+
+A timeline holds the value of every output at regularly spaced sample times, as sent
+by run_sequence: DO and AO columns, and the heartbeat line toggling at every DO write.
+Each sample holds the outputs of the last step started at or before its time, outputs
+are 0 before the first step and at the last sample, when they are reset.
+
+Timelines are numpy structured arrays with one field per channel (TIMELINE_CHANNELS),
+rendered in chunks of samples and exported to .npy files, which can be memory mapped
+with np.load(path, mmap_mode='r'). At RENDER_SAMPLE_RATE, samples fall on the ms
+timestamps of the steps and the timeline is exact.
+"""
+import argparse
+import logging
+import os
+from typing import Iterator
+
+import numpy as np
+
+import stimseq
+
+# Default sample rate of timelines, in samples per second
+RENDER_SAMPLE_RATE = 1000
+
+# Number of samples rendered at once
+RENDER_CHUNK_SAMPLES = 1 << 20
+
+# Channels of a timeline, in order: columns of the sequence, then the heartbeat
+TIMELINE_CHANNELS = [
+    *stimseq.SEQUENCE_COLUMNS[1:],
+    HEARTBEAT := "Heartbeat",
+]
+
+# Field types of a timeline, SEQUENCE_TYPES of the columns. The heartbeat is a digital output
+TIMELINE_DTYPE = np.dtype([*[(key, stimseq.SEQUENCE_TYPES[key]) for key in stimseq.SEQUENCE_COLUMNS[1:]], (HEARTBEAT, bool)])
+
+
+# Method to get the outputs sent at each step of the dispatch plan
+def _step_outputs(sequence:stimseq.CompiledSequence, enable_heartbeat:bool) -> tuple[np.ndarray, np.ndarray]:
+    """ Outputs after each dispatched step, with all outputs at 0 before the first step
+
+    Args:
+        sequence (stimseq.CompiledSequence): The sequence
+        enable_heartbeat (bool): Toggle the heartbeat at every DO write, as run_sequence
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Timestamp of each dispatched step, and TIMELINE_DTYPE array
+            of 0 outputs then one row per dispatched step
+    """
+    plan = stimseq._plan_dispatch(sequence, enable_heartbeat=enable_heartbeat) #pylint: disable=protected-access
+    outputs = np.zeros(len(plan) + 1, dtype=TIMELINE_DTYPE)
+    for key in stimseq.DO_DATA_KEYS:
+        port, line = stimseq.DO_LINES[key]
+        outputs[key][1:] = (plan.do_ports[:, stimseq.DO_PORTS.index(port)] >> line) & 1
+    for i, key in enumerate(stimseq.AO_DATA_KEYS):
+        outputs[key][1:] = plan.ao[:, i]
+    port, line = stimseq.HEARTBEAT_LINE
+    outputs[HEARTBEAT][1:] = (plan.do_ports[:, stimseq.DO_PORTS.index(port)] >> line) & 1
+    return plan.timestamps, outputs
+
+
+class TimelineRenderer():
+    """ Render a sequence into a sampled timeline, chunk by chunk
+
+    Outputs are computed once per dispatched step, each sample then only takes the
+    outputs of its step, without Python objects per sample.
+    """
+    def __init__(self, sequence:stimseq.CompiledSequence, sample_rate:float=RENDER_SAMPLE_RATE,
+                 enable_heartbeat:bool=True) -> None:
+        """
+        Args:
+            sequence (stimseq.CompiledSequence): The sequence to render
+            sample_rate (float, optional): Samples per second. Defaults to RENDER_SAMPLE_RATE.
+            enable_heartbeat (bool, optional): Render the heartbeat of run_sequence, 0 otherwise. Defaults to True.
+        """
+        if sample_rate <= 0:
+            raise ValueError(f"Sample rate must be positive, got {sample_rate}")
+        if not len(sequence):
+            raise ValueError("Sequence has no steps")
+        self.__sample_rate = sample_rate
+        self.__n_samples = stimseq._ao_waveform_size(sequence, sample_rate) #pylint: disable=protected-access
+        self.__timestamps, self.__outputs = _step_outputs(sequence, enable_heartbeat)
+
+    @property
+    def sample_rate(self) -> float:
+        """ Reader for __sample_rate """
+        return self.__sample_rate
+
+    def __len__(self) -> int:
+        """ Number of samples of the timeline, including the final reset sample """
+        return self.__n_samples
+
+    def sample_times(self, first_sample:int=0, last_sample:int|None=None) -> np.ndarray:
+        """ Time of samples in ms from the trigger
+
+        Args:
+            first_sample (int, optional): Index of the first sample. Defaults to 0.
+            last_sample (int | None, optional): Index after the last sample. Defaults to the end of the timeline.
+
+        Returns:
+            np.ndarray: float64 times
+        """
+        last_sample = self.__n_samples if last_sample is None else min(last_sample, self.__n_samples)
+        return np.arange(first_sample, last_sample, dtype=np.float64) * 1000 / self.__sample_rate
+
+    def render(self, first_sample:int=0, last_sample:int|None=None) -> np.ndarray:
+        """ Render a range of samples
+
+        Args:
+            first_sample (int, optional): Index of the first sample. Defaults to 0.
+            last_sample (int | None, optional): Index after the last sample. Defaults to the end of the timeline.
+
+        Returns:
+            np.ndarray: TIMELINE_DTYPE array, one row per sample
+        """
+        last_sample = self.__n_samples if last_sample is None else min(last_sample, self.__n_samples)
+        steps = stimseq._sample_steps(self.__timestamps, self.__sample_rate, first_sample, last_sample) #pylint: disable=protected-access
+        # Row 0 of the outputs is before the first step
+        timeline = self.__outputs[steps + 1]
+        if last_sample == self.__n_samples and len(timeline):
+            timeline[-1] = self.__outputs[0]
+        return timeline
+
+    def chunks(self, chunk_samples:int=RENDER_CHUNK_SAMPLES) -> Iterator[tuple[int, np.ndarray]]:
+        """ Render the whole timeline, chunk by chunk
+
+        Args:
+            chunk_samples (int, optional): Number of samples per chunk. Defaults to RENDER_CHUNK_SAMPLES.
+
+        Yields:
+            tuple[int, np.ndarray]: Index of the first sample of the chunk, and its samples
+        """
+        for first_sample in range(0, self.__n_samples, chunk_samples):
+            yield first_sample, self.render(first_sample, first_sample + chunk_samples)
+
+    def export(self, path:str, chunk_samples:int=RENDER_CHUNK_SAMPLES) -> np.memmap:
+        """ Render the timeline into a .npy file, chunk by chunk
+
+        Args:
+            path (str): Path of the file
+            chunk_samples (int, optional): Number of samples rendered at once. Defaults to RENDER_CHUNK_SAMPLES.
+
+        Returns:
+            np.memmap: The timeline, memory mapped from the file
+        """
+        timeline = np.lib.format.open_memmap(path, mode='w+', dtype=TIMELINE_DTYPE, shape=(self.__n_samples,))
+        for first_sample, chunk in self.chunks(chunk_samples):
+            timeline[first_sample:first_sample + len(chunk)] = chunk
+        timeline.flush()
+        return timeline
+
+
+# Method to render a sequence file into a timeline file
+def export_timeline(sequence:stimseq.CompiledSequence, path:str, sample_rate:float=RENDER_SAMPLE_RATE,
+                    enable_heartbeat:bool=True) -> np.memmap:
+    """ Render a sequence into a .npy timeline file, see TimelineRenderer
+
+    Args:
+        sequence (stimseq.CompiledSequence): The sequence to render
+        path (str): Path of the file
+        sample_rate (float, optional): Samples per second. Defaults to RENDER_SAMPLE_RATE.
+        enable_heartbeat (bool, optional): Render the heartbeat of run_sequence. Defaults to True.
+
+    Returns:
+        np.memmap: The timeline, memory mapped from the file
+    """
+    return TimelineRenderer(sequence, sample_rate=sample_rate, enable_heartbeat=enable_heartbeat).export(path)
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Render a sequence into a sampled timeline of its outputs, saved as a .npy file")
+    parser.add_argument('path', type=str,
+                        help="Sequence or protocol file")
+    parser.add_argument('output', type=str,
+                        help="Path of the .npy timeline file")
+    parser.add_argument('--rate', dest="sample_rate", type=float, default=RENDER_SAMPLE_RATE,
+                        help="Samples per second")
+    parser.add_argument('--disable-heartbeat', dest="disable_heartbeat",
+                        help="Used to render the heartbeat as disabled",
+                        action='store_true')
+    parser.add_argument('--no-cache', dest="no_cache",
+                        help="Used to parse the sequence file even if it is in the cache",
+                        action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        parser.error(f"{args.path} is not a valid path")
+    compiled, report = stimseq.load_sequence(args.path, not args.no_cache, logging.getLogger(__name__))
+    if len(report):
+        print(report.summary())
+    rendered = export_timeline(compiled, args.output, sample_rate=args.sample_rate, enable_heartbeat=not args.disable_heartbeat)
+    print(f"Rendered {len(rendered)} samples of {', '.join(TIMELINE_CHANNELS)} at {args.sample_rate} S/s to {args.output}")
@@ -0,0 +1,213 @@
+#pylint: disable=line-too-long
+"""Validation of many sequence files at once, without DAQ nor GUI
+
+Files are parsed by a pool of processes, one file at a time per process, with the
+rules of StimSeq (see stimseq._parse_sequence_file): values must be numbers, AO values
+within AO_RANGE, time steps at least the minimum time step apart, and a negative first
+timestamp is forced to 0. Protocol files are expanded and validated the same way.
+
+The parsing cache is not used, and only numpy is imported by the processes: neither
+the DAQ driver, nor tkinter, nor matplotlib. The result of every file is written to a
+JSON summary:
+
+    {"min_timestep": ..., "files": ..., "valid": ..., "skipped": ..., "failed": ..., "duration": ...,
+     "results": [{"path", "status", "steps", "duration", "skipped_rows", "skipped", "first_timestamp_forced", "error"}, ...]}
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from typing import NamedTuple
+
+import stimseq
+
+# Extensions of the files validated in a directory
+SEQUENCE_EXTENSIONS = [".csv", stimseq.PROTOCOL_EXTENSION]
+
+# Status of a validated file
+VALIDATION_STATUSES = [
+    VALID := "valid",  # No row skipped
+    SKIPPED := "skipped",  # Some rows skipped, the other steps can be run
+    FAILED := "failed",  # File not readable, invalid protocol, or no valid step
+]
+
+
+class FileValidation(NamedTuple):
+    """ Validation of one file
+
+    Attributes:
+        path (str): Path of the file
+        status (str): One of VALIDATION_STATUSES
+        steps (int): Number of valid steps
+        duration (float): Duration of the sequence in ms, from the trigger to the reset of the outputs
+        skipped_rows (int): Number of skipped rows
+        skipped (dict[str, list[int]]): Skipped rows for each reason of SKIP_REASONS, counted as in ValidationReport
+        first_timestamp_forced (bool): True if the first valid row had a negative timestamp, forced to 0
+        error (str): Error of a failed file
+    """
+    path: str
+    status: str
+    steps: int = 0
+    duration: float = 0
+    skipped_rows: int = 0
+    skipped: dict[str, list[int]] = {}
+    first_timestamp_forced: bool = False
+    error: str = ""
+
+
+# Method to validate a file, run by the processes of the pool
+def validate_file(path:str, min_timestep:int|None=None) -> FileValidation:
+    """ Parse and validate a sequence or protocol file
+
+    Args:
+        path (str): Path of the file
+        min_timestep (int | None, optional): Minimum time step in ms. Defaults to MIN_TIMESTEP.
+
+    Returns:
+        FileValidation: The validation of the file, failed if it can not be parsed
+    """
+    try:
+        # Parsed without the check of load_sequence, so the skipped rows of a file without any valid step are reported
+        sequence, report = stimseq._parse_file(path, stimseq.MIN_TIMESTEP if min_timestep is None else min_timestep) #pylint: disable=protected-access
+    except Exception as error: #pylint: disable=broad-exception-caught
+        # A file failing does not stop the validation of the others
+        return FileValidation(path=path, status=FAILED, error=str(error))
+
+    skipped = {reason: report.skipped_rows(reason).tolist() for reason in stimseq.SKIP_REASONS if len(report.skipped_rows(reason))}
+    if not len(sequence):
+        return FileValidation(path=path, status=FAILED, skipped_rows=len(report), skipped=skipped, error="No valid step")
+    # Outputs are reset after a pause equal to the last time step, as run_sequence does
+    duration = float(sequence.timestamps[-1] + sequence.time_increments[-1])
+    return FileValidation(path=path, status=SKIPPED if len(report) else VALID, steps=len(sequence), duration=duration,
+                          skipped_rows=len(report), skipped=skipped, first_timestamp_forced=report.first_timestamp_forced)
+
+
+# Method to list the sequence files of directories
+def find_sequence_files(paths:list[str], recursive:bool=False) -> list[str]:
+    """ Files given, and files of the directories given with an extension of SEQUENCE_EXTENSIONS
+
+    Args:
+        paths (list[str]): Files and directories
+        recursive (bool, optional): Also list the files of subdirectories. Defaults to False.
+
+    Returns:
+        list[str]: Paths of the files, in order, without duplicates
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            files.extend(os.path.join(directory, name) for name in sorted(names)
+                         if os.path.splitext(name)[1].lower() in SEQUENCE_EXTENSIONS)
+            if not recursive:
+                break
+            subdirectories.sort()
+    return list(dict.fromkeys(files))
+
+
+def validate_files(paths:list[str], min_timestep:int|None=None, jobs:int|None=None) -> list[FileValidation]:
+    """ Validate files in parallel, with a pool of processes
+
+    Largest files are started first, so the processes end together. Processes are
+    spawned on every platform, as on Windows: forking a caller running threads (ex: the
+    logging thread of a StimSeq) could deadlock them.
+
+    Args:
+        paths (list[str]): Paths of the files
+        min_timestep (int | None, optional): Minimum time step in ms. Defaults to MIN_TIMESTEP.
+        jobs (int | None, optional): Number of processes. Defaults to the number of processors.
+
+    Returns:
+        list[FileValidation]: The validation of each file, in the order of paths
+    """
+    def size(path:str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    min_timestep = stimseq.MIN_TIMESTEP if min_timestep is None else min_timestep
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    if jobs == 1:
+        return [validate_file(path, min_timestep) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {path: pool.submit(validate_file, path, min_timestep) for path in sorted(paths, key=size, reverse=True)}
+        return [futures[path].result() for path in paths]
+
+
+# Method to build the summary of a validation
+def validation_summary(results:list[FileValidation], min_timestep:int, duration:float) -> dict:
+    """ Summary of a validation, as written to the JSON file
+
+    Args:
+        results (list[FileValidation]): Validation of each file
+        min_timestep (int): Minimum time step the files were validated against, in ms
+        duration (float): Time taken by the validation in s
+
+    Returns:
+        dict: Counts of each status and validation of each file
+    """
+    return {"date": datetime.now().isoformat(timespec="seconds"),
+            "min_timestep": min_timestep,
+            "files": len(results),
+            **{status: sum(result.status == status for result in results) for status in VALIDATION_STATUSES},
+            "duration": duration,
+            "results": [result._asdict() for result in results]}
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Validate sequence and protocol files with a pool of processes, and write a JSON summary. "
+                                                 "Exits with 1 if a file has skipped rows or failed")
+    parser.add_argument('paths', nargs='+', type=str,
+                        help=f"Sequence files, or directories of sequence files ({', '.join(SEQUENCE_EXTENSIONS)})")
+    parser.add_argument('--recursive', dest="recursive",
+                        help="Used to validate the files of subdirectories",
+                        action='store_true')
+    parser.add_argument('--output', dest="output", type=str,
+                        help="Path of the JSON summary. Printed if not given")
+    parser.add_argument('--jobs', dest="jobs", type=int,
+                        help="Number of processes. Defaults to the number of processors")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--device', dest="device", type=str,
+                       help="Device whose timing profile gives the minimum time step (see stimseq_calibrate)")
+    group.add_argument('--min-timestep', dest="min_timestep", type=int,
+                       help=f"Minimum time step in ms. Defaults to {stimseq.MIN_TIMESTEP}")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("Number of processes must be positive")
+    sequence_files = find_sequence_files(args.paths, recursive=args.recursive)
+    if not sequence_files:
+        parser.error("No sequence file found")
+
+    timestep = args.min_timestep if args.min_timestep is not None else stimseq.MIN_TIMESTEP
+    if args.device is not None:
+        try:
+            profile = stimseq.load_timing_profile(args.device)
+        except ValueError as error:
+            parser.error(str(error))
+        if profile is None:
+            parser.error(f"No timing profile for {args.device}")
+        timestep = profile["min_timestep"]
+
+    start = perf_counter()
+    validations = validate_files(sequence_files, min_timestep=timestep, jobs=args.jobs)
+    summary = validation_summary(validations, timestep, perf_counter() - start)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    print(f"{summary['files']} files validated in {summary['duration']:.2f} s (min time step: {timestep} ms): "
+          + ", ".join(f"{summary[status]} {status}" for status in VALIDATION_STATUSES), file=sys.stderr)
+    sys.exit(0 if summary[VALID] == summary["files"] else 1)
@@ -0,0 +1,265 @@
+#pylint: disable=line-too-long
+"""Watching of sequence files, parsed again only where they changed
+
+A SequenceWatcher keeps the rows of a csv sequence file with their values and their
+validation. When the file changes, only the rows between the unchanged first and last
+lines are parsed again. The rows following them are validated again against the
+minimum time step until the last kept step before a row is the same as before the edit,
+the validation of the rest of the file is kept.
+
+Each update gives the time span of the steps that changed, so plots only redraw this
+span (see SequencePlotter.update_sequence). Protocol files are parsed again whole.
+"""
+import argparse
+import logging
+import os
+from time import perf_counter, sleep
+from typing import NamedTuple
+
+import numpy as np
+
+import stimseq
+
+# Time in ms between two checks of the watched file
+WATCH_INTERVAL = 500
+
+# Number of lines compared at once when looking for the unchanged first and last lines
+LINE_BLOCK = 4096
+
+# Number of rows validated again at once after the edited rows, doubled until the validation is the same as before
+REVALIDATION_CHUNK = 16
+
+
+class SequenceUpdate(NamedTuple):
+    """ Change of a watched sequence file
+
+    Attributes:
+        first_row (int): Index of the first row parsed again
+        parsed_rows (int): Number of rows parsed again
+        validated_rows (int): Number of rows validated again, parsed rows included
+        t_start (float | None): Time in ms of the first changed step, None if no step changed
+        t_end (float | None): Time in ms of the last changed step, None if no step changed
+        full (bool): True if the whole file was parsed again
+    """
+    first_row: int
+    parsed_rows: int
+    validated_rows: int
+    t_start: float | None
+    t_end: float | None
+    full: bool = False
+
+
+# Method to count the equal first items of two lists of lines
+def _common_prefix(a:list[str], b:list[str]) -> int:
+    # Blocks of lines are compared in C, the first differing block is then scanned line by line
+    n = min(len(a), len(b))
+    i = 0
+    while i + LINE_BLOCK <= n and a[i:i + LINE_BLOCK] == b[i:i + LINE_BLOCK]:
+        i += LINE_BLOCK
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+# Method to validate rows, keeping the validation of each row
+def _validate_rows(values:np.ndarray, last_timestamp:int|None, first_row:int, min_timestep:int|None) -> tuple[np.ndarray, np.ndarray]:
+    """ Validate rows against the last kept step before them, see stimseq._validate_values
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Index in SKIP_REASONS of the reason each row is skipped (-1 for kept rows),
+            and the int64 timestamp of each kept row (0 for skipped rows)
+    """
+    sequence, report = stimseq._validate_values(values, last_timestamp=last_timestamp, first_row=first_row, #pylint: disable=protected-access
+                                                min_timestep=min_timestep)
+    reasons = np.full(len(values), -1, dtype=np.int8)
+    reasons[report.rows - first_row] = report.reasons
+    timestamps = np.zeros(len(values), dtype=np.int64)
+    timestamps[reasons < 0] = sequence.timestamps
+    return reasons, timestamps
+
+
+# Method to get the time span of the steps differing between two versions of a sequence
+def _changed_span(old:stimseq.CompiledSequence, new:stimseq.CompiledSequence, first:int, last:int) -> tuple[float, float] | None:
+    """ Time span of the steps that differ, among the steps from first to the last-th from the end
+
+    Returns:
+        tuple[float, float] | None: Time in ms of the first and last differing steps, None if no step differs
+    """
+    steps = [np.column_stack([array[first:len(sequence) - last] for array in (sequence.timestamps, sequence.ao, sequence.do_ports)])
+             for sequence in (old, new)]
+    n = min(len(steps[0]), len(steps[1]))
+    # Equal steps at the start and at the end of the compared steps are not changed
+    equal = (steps[0][:n] == steps[1][:n]).all(axis=1)
+    start = int(np.argmin(equal)) if not equal.all() else n
+    equal = (steps[0][len(steps[0]) - n:] == steps[1][len(steps[1]) - n:]).all(axis=1)[::-1]
+    end = min(int(np.argmin(equal)) if not equal.all() else n, n - start)
+    changed = np.concatenate([rows[start:len(rows) - end, 0] for rows in steps])
+    return (float(changed.min()), float(changed.max())) if len(changed) else None
+
+
+# Method to get the timestamp of the last kept row before a row
+def _last_kept(kept_rows:np.ndarray, timestamps:np.ndarray, row:int) -> int | None:
+    i = int(np.searchsorted(kept_rows, row)) - 1
+    return int(timestamps[kept_rows[i]]) if i >= 0 else None
+
+
+class SequenceWatcher():
+    """ Sequence file parsed again where it changed, see update()
+    """
+    def __init__(self, path:str, min_timestep:int|None=None) -> None:
+        """
+        Args:
+            path (str): Path to the sequence or protocol file, parsed whole
+            min_timestep (int | None, optional): Minimum time step in ms, ex: StimSeq.min_timestep. Defaults to stimseq.MIN_TIMESTEP.
+        """
+        self.__path = path
+        self.__min_timestep = min_timestep
+        self.__protocol = os.path.splitext(path)[1].lower() == stimseq.PROTOCOL_EXTENSION
+        self.__stat = self.__file_stat()
+        self.__lines:list[str] = []
+        self.__values = np.empty((0, len(stimseq.SEQUENCE_COLUMNS)))
+        self.__reasons = np.empty(0, dtype=np.int8)
+        self.__timestamps = np.empty(0, dtype=np.int64)
+        self.__compiled:stimseq.CompiledSequence
+        self.__report:stimseq.ValidationReport
+        self.__parse()
+
+    @property
+    def path(self) -> str:
+        """ Reader for __path """
+        return self.__path
+
+    @property
+    def compiled(self) -> stimseq.CompiledSequence:
+        """ Reader for __compiled, the valid steps of the file """
+        return self.__compiled
+
+    @property
+    def report(self) -> stimseq.ValidationReport:
+        """ Reader for __report, the skipped rows of the file """
+        return self.__report
+
+    def __file_stat(self) -> tuple[int, int] | None:
+        # Modification time and size, None while the file is missing (ex: replaced by an editor)
+        try:
+            stat = os.stat(self.__path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """ True if the file changed since the last parse """
+        stat = self.__file_stat()
+        return stat is not None and stat != self.__stat
+
+    def __parse(self) -> None:
+        # Whole file
+        if self.__protocol:
+            self.__compiled, self.__report = stimseq.load_sequence(self.__path, False, logging.getLogger(stimseq.LOGGER_NAME),
+                                                                       self.__min_timestep)
+            return
+        self.__lines = stimseq._read_sequence_lines(self.__path) #pylint: disable=protected-access
+        self.__values = stimseq._parse_sequence_lines(self.__lines) #pylint: disable=protected-access
+        self.__reasons, self.__timestamps = _validate_rows(self.__values, None, 0, self.__min_timestep)
+        self.__compile()
+
+    def __compile(self) -> None:
+        # Steps and report of the file, from the validation of each row
+        kept = self.__reasons < 0
+        ts_col = stimseq.SEQUENCE_COLUMNS.index(stimseq.TIMESTAMP)
+        ao_cols = [stimseq.SEQUENCE_COLUMNS.index(key) for key in stimseq.AO_DATA_KEYS]
+        do_cols = [stimseq.SEQUENCE_COLUMNS.index(key) for key in stimseq.DO_DATA_KEYS]
+        kept_values = self.__values[kept]
+        self.__compiled = stimseq._compile_sequence(timestamps=self.__timestamps[kept], #pylint: disable=protected-access
+                                                    ao_values=kept_values[:, ao_cols],
+                                                    do_values=kept_values[:, do_cols] != 0)
+        # First kept row is never skipped for its time step, its timestamp is forced to 0 if not positive
+        self.__report = stimseq.ValidationReport(rows=np.flatnonzero(~kept), reasons=self.__reasons[~kept],
+                                                 first_timestamp_forced=bool(len(kept_values) and kept_values[0, ts_col] <= 0))
+
+    def update(self) -> SequenceUpdate | None:
+        """ Parse the file again where it changed
+
+        Raises:
+            ValueError: If a protocol file is not valid
+
+        Returns:
+            SequenceUpdate | None: The change, None if the file did not change
+        """
+        if not self.changed():
+            return None
+        self.__stat = self.__file_stat()
+        old_compiled = self.__compiled
+
+        if self.__protocol:
+            self.__parse()
+            return SequenceUpdate(first_row=0, parsed_rows=len(self.__compiled), validated_rows=len(self.__compiled),
+                                  t_start=None, t_end=None, full=True)
+
+        # Rows between the unchanged first and last lines are parsed again
+        lines = stimseq._read_sequence_lines(self.__path) #pylint: disable=protected-access
+        n_old, n_new = len(self.__lines), len(lines)
+        prefix = _common_prefix(self.__lines, lines)
+        suffix = min(_common_prefix(self.__lines[::-1], lines[::-1]), n_old - prefix, n_new - prefix)
+        edit_end = n_new - suffix
+        parsed = stimseq._parse_sequence_lines(lines[prefix:edit_end]) #pylint: disable=protected-access
+        values = np.concatenate((self.__values[:prefix], parsed, self.__values[n_old - suffix:]))
+
+        # Parsed rows are validated against the last kept row before them
+        old_kept = np.flatnonzero(self.__reasons < 0)
+        last_timestamp = _last_kept(old_kept, self.__timestamps, prefix)
+        reasons, timestamps = _validate_rows(parsed, last_timestamp, prefix, self.__min_timestep)
+        if (kept := np.flatnonzero(reasons < 0)).size:
+            last_timestamp = int(timestamps[kept[-1]])
+
+        # Following rows are validated again until the last kept row before them is the same as before the edit
+        revalidated = 0
+        chunk = REVALIDATION_CHUNK
+        new_reasons, new_timestamps = [reasons], [timestamps]
+        while revalidated < suffix and last_timestamp != _last_kept(old_kept, self.__timestamps, n_old - suffix + revalidated):
+            chunk_values = values[edit_end + revalidated:edit_end + revalidated + chunk]
+            reasons, timestamps = _validate_rows(chunk_values, last_timestamp, edit_end + revalidated, self.__min_timestep)
+            if (kept := np.flatnonzero(reasons < 0)).size:
+                last_timestamp = int(timestamps[kept[-1]])
+            new_reasons.append(reasons)
+            new_timestamps.append(timestamps)
+            revalidated += len(chunk_values)
+            chunk *= 2
+
+        unchanged = n_old - suffix + revalidated
+        kept_before = int(np.searchsorted(old_kept, prefix))
+        kept_after = len(old_kept) - int(np.searchsorted(old_kept, unchanged))
+        self.__lines = lines
+        self.__values = values
+        self.__reasons = np.concatenate((self.__reasons[:prefix], *new_reasons, self.__reasons[unchanged:]))
+        self.__timestamps = np.concatenate((self.__timestamps[:prefix], *new_timestamps, self.__timestamps[unchanged:]))
+        self.__compile()
+
+        # Steps before and after the validated rows are the same
+        span = _changed_span(old_compiled, self.__compiled, kept_before, kept_after)
+        return SequenceUpdate(first_row=prefix, parsed_rows=len(parsed), validated_rows=len(parsed) + revalidated,
+                              t_start=span[0] if span else None, t_end=span[1] if span else None)
+
+
+if __name__ == "__main__" :
+
+    # Init Argument Parser
+    parser = argparse.ArgumentParser(description="Watch a sequence file, and print the rows parsed again at each change")
+    parser.add_argument('path', type=str,
+                        help="Sequence or protocol file")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        parser.error(f"{args.path} is not a valid path")
+    watcher = SequenceWatcher(args.path)
+    print(f"Watching {args.path}: {len(watcher.compiled)} steps, {len(watcher.report)} skipped rows")
+    try:
+        while True:
+            sleep(WATCH_INTERVAL / 1000)
+            start = perf_counter()
+            if (update := watcher.update()) is not None:
+                span = "no step changed" if update.t_start is None else f"steps changed from {update.t_start:.0f} to {update.t_end:.0f} ms"
+                print(f"Parsed {update.parsed_rows} rows from row {update.first_row}, validated {update.validated_rows} rows, "
+                      f"{span}, in {(perf_counter() - start) * 1000:.1f} ms: {len(watcher.compiled)} steps, {len(watcher.report)} skipped rows")
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,72 @@
+#pylint: disable=line-too-long
+"""Shared fixtures of the tests, run from the repository root with python -m pytest
+
+Tests use the simulated DAQ and temporary files only, neither a DAQ nor NI-DAQmx is needed.
+"""
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+
+#pylint: disable=wrong-import-position
+import stimseq
+from stimseq_daq import SimulatedBackend
+
+# Minimum time step of the tests in ms, short so runs of a few steps are quick
+TEST_MIN_TIMESTEP = 10
+
+# Header line of the written sequence files, a comment as in doc/sequence_template.csv
+SEQUENCE_HEADER = "*" + ",".join([*stimseq.SEQUENCE_COLUMNS, "comment"])
+
+
+@pytest.fixture(autouse=True)
+def isolated_files(tmp_path, monkeypatch) -> None:
+    """ Cache and timing profiles of each test in its own temporary directory """
+    monkeypatch.setattr(stimseq, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(stimseq, "TIMING_PROFILE_DIR", str(tmp_path / "timing_profiles"))
+
+
+@pytest.fixture(scope="session")
+def log_file(tmp_path_factory) -> str:
+    """ Log file shared by the tests, so the logging thread is started once """
+    return str(tmp_path_factory.mktemp("log") / "stimseq.log")
+
+
+@pytest.fixture
+def write_sequence(tmp_path):
+    """ Write a sequence file from rows of values in SEQUENCE_COLUMNS order, returns its path """
+    def write(rows:list, name:str="sequence.csv") -> str:
+        path = tmp_path / name
+        lines = [SEQUENCE_HEADER, *(",".join(str(value) for value in row) + "," for row in rows)]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def make_stimseq(log_file):
+    """ StimSeq of a sequence file on a SimulatedBackend triggered right away, returns the StimSeq and its backend """
+    def make(path:str, cls:type=stimseq.StimSeq, **kwargs) -> tuple[stimseq.StimSeq, SimulatedBackend]:
+        backend = kwargs.pop("backend", None) or SimulatedBackend(trigger_delay=5)
+        kwargs = {"log_file": log_file, "log_lvl": logging.WARNING, "use_cache": False,
+                  "min_timestep": TEST_MIN_TIMESTEP, **kwargs}
+        return cls(path, backend=backend, **kwargs), backend
+    return make
+
+
+# Method to get the transitions of a run, in ms from the trigger
+def relative_transitions(backend:SimulatedBackend) -> list[tuple[float, str, int | float]]:
+    """ Transitions after the trigger, as (time in ms from the trigger, channel name, value)
+
+    Args:
+        backend (SimulatedBackend): Backend of a run
+
+    Returns:
+        list[tuple[float, str, int | float]]: Transitions in time order
+    """
+    return [((time_ns - backend.trigger_ns) / 1e6, name, value)
+            for time_ns, name, value in backend.transitions if time_ns >= backend.trigger_ns]
@@ -0,0 +1,66 @@
+#pylint: disable=line-too-long
+"""Runs driven from an event loop, cancelled by the caller"""
+import asyncio
+import logging
+from time import perf_counter
+
+import pytest
+
+from conftest import TEST_MIN_TIMESTEP, relative_transitions
+from stimseq_async import AsyncStimSeq
+from stimseq_daq import SimulatedBackend
+
+# Rows in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo. 2 s long
+ROWS = [[100 * i, i % 2, 0, 0, 0, 0, 0, 0, 0, i % 3 + 1, 0] for i in range(20)]
+
+
+def _rig(path:str, backend:SimulatedBackend, log_file:str) -> AsyncStimSeq:
+    return AsyncStimSeq(path, backend=backend, log_file=log_file, log_lvl=logging.CRITICAL, use_cache=False,
+                        min_timestep=TEST_MIN_TIMESTEP)
+
+
+def _last_values(backend:SimulatedBackend) -> dict[str, int | float]:
+    return {name: value for _, name, value in relative_transitions(backend)}
+
+
+def test_timeout_cancels_the_run(write_sequence, log_file):
+    backend = SimulatedBackend(trigger_delay=5)
+
+    async def main() -> None:
+        async with _rig(write_sequence(ROWS), backend, log_file) as rig:
+            with pytest.raises(TimeoutError):
+                async with asyncio.timeout(0.3):
+                    await rig.run()
+            # Cancellation is raised once the run ended
+            assert not rig.is_armed
+
+    start = perf_counter()
+    asyncio.run(main())
+    assert perf_counter() - start < 1.5
+    # Steps were sent, then outputs were reset to 0
+    assert [time for time, name, _ in relative_transitions(backend) if name == "LED"][1] >= 100
+    assert _last_values(backend) == {"Port0": 0, "Port1": 0, "LED": 0}
+
+
+def test_cancelled_rig_runs_again(write_sequence, log_file):
+    backend = SimulatedBackend(trigger_delay=None)
+
+    async def main() -> None:
+        async with _rig(write_sequence(ROWS[:3]), backend, log_file) as rig:
+            # Cancelled while waiting for the trigger
+            task = asyncio.create_task(rig.run(trigger_timeout=2))
+            await asyncio.sleep(0.1)
+            start = perf_counter()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # Stopped by the cancellation, not by the trigger timeout
+            assert perf_counter() - start < 1 and not rig.is_armed
+
+            await rig.arm()
+            backend.fire_trigger()
+            timing = await rig.run()
+            assert timing.late_steps == 0
+
+    asyncio.run(main())
+    assert _last_values(backend) == {"Port0": 0, "Port1": 0, "LED": 0}
@@ -0,0 +1,54 @@
+#pylint: disable=line-too-long
+"""Playlists of trials run in a single session"""
+import logging
+
+import numpy as np
+import pytest
+
+from stimseq_batch import TRIAL_DONE, TRIAL_FAILED, BatchRunner
+from stimseq_daq import SimulatedBackend
+
+ROWS = [[0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0], [60, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]]
+
+
+class FailingBackend(SimulatedBackend):
+    """ Simulated DAQ failing the DO writes of one trial """
+    def __init__(self, failing_trial:int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.trials = 0
+        self.failing_trial = failing_trial
+
+    def wait_trigger(self, *args, **kwargs) -> int | None:
+        self.trials += 1
+        return super().wait_trigger(*args, **kwargs)
+
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        if self.trials == self.failing_trial:
+            raise RuntimeError("DAQ not answering")
+        super().write_do(words, timeout)
+
+
+@pytest.fixture
+def playlist(write_sequence) -> list[str]:
+    """ Trials of valid sequences, the third one without any valid step """
+    valid = write_sequence(ROWS)
+    return [valid, valid, write_sequence([[0, "x", 0, 0, 0, 0, 0, 0, 0, 0, 0]], name="empty.csv"), valid]
+
+
+def _run(playlist:list[str], log_file:str, stop_on_abort:bool) -> list[tuple[int, str]]:
+    runner = BatchRunner(playlist, inter_trial_interval=0, stop_on_abort=stop_on_abort, log_file=log_file,
+                         log_lvl=logging.CRITICAL, use_cache=False, backend=FailingBackend(2, trigger_delay=5))
+    return [(result.index, result.status) for result in runner.run()]
+
+
+def test_failed_trials_do_not_stop_the_batch(playlist, log_file):
+    # Second trial fails while running, third one can not be loaded
+    assert _run(playlist, log_file, stop_on_abort=False) == [(0, TRIAL_DONE), (1, TRIAL_FAILED), (2, TRIAL_FAILED), (3, TRIAL_DONE)]
+
+
+def test_failed_trial_stops_the_batch_with_stop_on_abort(playlist, log_file):
+    assert _run(playlist, log_file, stop_on_abort=True) == [(0, TRIAL_DONE), (1, TRIAL_FAILED)]
+
+
+def test_failed_load_stops_the_batch_with_stop_on_abort(playlist, log_file):
+    assert _run([playlist[0], *playlist[2:]], log_file, stop_on_abort=True) == [(0, TRIAL_DONE), (1, TRIAL_FAILED)]
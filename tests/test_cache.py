@@ -0,0 +1,97 @@
+#pylint: disable=line-too-long,protected-access
+"""On-disk cache of parsed sequences"""
+import logging
+import os
+
+import numpy as np
+import pytest
+
+import stimseq
+
+LOGGER = logging.getLogger(stimseq.LOGGER_NAME)
+
+ROWS = [[0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0], [100, 0, 1, 0, 0, 0, 0, 0, 0, 2, 1], [130, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]]
+
+
+def _entries() -> list[str]:
+    return sorted(os.listdir(stimseq.CACHE_DIR)) if os.path.isdir(stimseq.CACHE_DIR) else []
+
+
+def _assert_same(parsed, expected) -> None:
+    for name in stimseq.CompiledSequence._fields:
+        np.testing.assert_array_equal(getattr(parsed[0], name), getattr(expected[0], name))
+    np.testing.assert_array_equal(parsed[1].rows, expected[1].rows)
+    np.testing.assert_array_equal(parsed[1].reasons, expected[1].reasons)
+    assert parsed[1].first_timestamp_forced == expected[1].first_timestamp_forced
+
+
+def test_cached_sequence_is_the_parsed_one(write_sequence):
+    path = write_sequence(ROWS)
+    parsed = stimseq.load_sequence(path, True, LOGGER, min_timestep=50)
+    assert len(_entries()) == 1
+
+    cached = stimseq.load_sequence(path, True, LOGGER, min_timestep=50)
+    # Loaded from the cache, memory mapped
+    assert isinstance(cached[0].timestamps, np.memmap)
+    _assert_same(cached, parsed)
+    _assert_same(cached, stimseq._parse_sequence_file(path, min_timestep=50))
+
+
+def test_content_change_invalidates_the_entry(write_sequence):
+    path = write_sequence(ROWS)
+    stimseq.load_sequence(path, True, LOGGER, min_timestep=50)
+
+    write_sequence([*ROWS, [200, 1, 1, 0, 0, 0, 0, 0, 0, 3, 0]])
+    parsed = stimseq.load_sequence(path, True, LOGGER, min_timestep=50)
+    assert parsed[0].timestamps.tolist() == [0, 100, 200]
+    assert len(_entries()) == 2
+
+
+def test_configuration_change_invalidates_the_entry(write_sequence, monkeypatch):
+    path = write_sequence(ROWS)
+    key = stimseq._cache_key(path, 50)
+    # 30 ms between the last two rows, kept with a smaller minimum time step only
+    assert stimseq.load_sequence(path, True, LOGGER, min_timestep=50)[0].timestamps.tolist() == [0, 100]
+    assert stimseq._cache_key(path, 20) != key
+    assert stimseq.load_sequence(path, True, LOGGER, min_timestep=20)[0].timestamps.tolist() == [0, 100, 130]
+
+    monkeypatch.setattr(stimseq, "AO_RANGE", [-5, 5])
+    assert stimseq._cache_key(path, 50) != key
+    monkeypatch.setattr(stimseq, "CACHE_VERSION", stimseq.CACHE_VERSION + 1)
+    assert stimseq._cache_key(path, 50) != key
+
+
+def test_invalid_entry_is_replaced(write_sequence):
+    path = write_sequence(ROWS)
+    parsed = stimseq.load_sequence(path, True, LOGGER, min_timestep=50)
+    entry = os.path.join(stimseq.CACHE_DIR, stimseq._cache_key(path, 50))
+    with open(os.path.join(entry, "timestamps.npy"), 'wb') as f:
+        f.write(b"not an array")
+
+    assert stimseq._cache_load(stimseq._cache_key(path, 50)) is None
+    _assert_same(stimseq.load_sequence(path, True, LOGGER, min_timestep=50), parsed)
+    assert stimseq._cache_load(stimseq._cache_key(path, 50)) is not None
+
+
+def test_least_recently_used_entries_are_evicted(write_sequence, monkeypatch):
+    paths = [write_sequence([[0, i, 0, 0, 0, 0, 0, 0, 0, i, 0]], name=f"sequence_{i}.csv") for i in range(3)]
+    entries = [os.path.join(stimseq.CACHE_DIR, stimseq._cache_key(path, stimseq.MIN_TIMESTEP)) for path in paths]
+    stimseq.load_sequence(paths[0], True, LOGGER)
+    entry_size = sum(f.stat().st_size for f in os.scandir(entries[0]))
+    monkeypatch.setattr(stimseq, "CACHE_MAX_SIZE", 2.5 * entry_size)
+
+    # Entries used in order, then the first one is used again
+    stimseq.load_sequence(paths[1], True, LOGGER)
+    os.utime(entries[0], (0, 0))
+    os.utime(entries[1], (1, 1))
+    stimseq.load_sequence(paths[0], True, LOGGER)
+    stimseq.load_sequence(paths[2], True, LOGGER)
+    assert os.path.isdir(entries[0]) and os.path.isdir(entries[2])
+    assert not os.path.exists(entries[1])
+
+
+def test_sequence_without_valid_step_is_not_cached(write_sequence):
+    path = write_sequence([[0, "x", 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+    with pytest.raises(ValueError):
+        stimseq.load_sequence(path, True, LOGGER)
+    assert not _entries()
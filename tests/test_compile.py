@@ -0,0 +1,49 @@
+#pylint: disable=line-too-long
+"""Compiled sequences, with DO values packed in port words"""
+import numpy as np
+
+import stimseq
+
+
+def _compile(timestamps:list[int], do_values:np.ndarray, ao_values:np.ndarray|None=None) -> stimseq.CompiledSequence:
+    ao_values = np.zeros((len(timestamps), len(stimseq.AO_DATA_KEYS))) if ao_values is None else ao_values
+    return stimseq._compile_sequence(timestamps=np.array(timestamps), ao_values=ao_values, do_values=do_values) #pylint: disable=protected-access
+
+
+def test_do_values_are_packed_by_port_and_line():
+    do_values = np.zeros((len(stimseq.DO_DATA_KEYS), len(stimseq.DO_DATA_KEYS)), dtype=bool)
+    np.fill_diagonal(do_values, True)
+    sequence = _compile(list(range(0, 10 * len(do_values), 10)), do_values)
+
+    assert sequence.do_ports.dtype == np.uint32
+    assert sequence.do_ports.shape == (len(do_values), len(stimseq.DO_PORTS))
+    # Each step sets a single line, on its port only
+    for step, key in enumerate(stimseq.DO_DATA_KEYS):
+        port, line = stimseq.DO_LINES[key]
+        expected = np.zeros(len(stimseq.DO_PORTS), dtype=np.uint32)
+        expected[stimseq.DO_PORTS.index(port)] = 1 << line
+        np.testing.assert_array_equal(sequence.do_ports[step], expected)
+
+
+def test_do_values_are_unpacked_back():
+    rng = np.random.default_rng(0)
+    do_values = rng.integers(0, 2, size=(100, len(stimseq.DO_DATA_KEYS))).astype(bool)
+    sequence = _compile(list(range(0, 1000, 10)), do_values)
+    np.testing.assert_array_equal(sequence.do_values(), do_values)
+
+
+def test_heartbeat_bit_is_not_set_by_the_sequence():
+    do_values = np.ones((3, len(stimseq.DO_DATA_KEYS)), dtype=bool)
+    sequence = _compile([0, 10, 20], do_values)
+    port, line = stimseq.HEARTBEAT_LINE
+    assert not np.any(sequence.do_ports[:, stimseq.DO_PORTS.index(port)] & (1 << line))
+
+
+def test_columns_and_time_increments():
+    ao_values = np.array([[1.5], [-2.0], [0.0]])
+    sequence = _compile([0, 15, 40], np.zeros((3, len(stimseq.DO_DATA_KEYS))), ao_values)
+    assert len(sequence) == 3
+    assert sequence.timestamps.dtype == np.int64
+    np.testing.assert_array_equal(sequence.ao, ao_values)
+    # First increment is counted from the trigger
+    np.testing.assert_array_equal(sequence.time_increments, [0, 15, 25])
@@ -0,0 +1,70 @@
+#pylint: disable=line-too-long,protected-access
+"""Dispatch plan of compiled sequences, writing only the tasks of changed outputs"""
+import numpy as np
+
+import stimseq
+from conftest import relative_transitions
+
+# Rows in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo
+ROWS = [
+    [0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+    [20, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0],  # Changes no output
+    [40, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],  # Changes DO only
+    [60, 0, 0, 0, 0, 0, 0, 0, 0, 2, 0],  # Changes AO only
+    [80, 0, 0, 0, 0, 0, 0, 0, 0, 2, 1],  # Changes DO on the port of the heartbeat
+]
+
+HEARTBEAT_PORT, HEARTBEAT_BIT = stimseq.DO_PORTS.index(stimseq.HEARTBEAT_LINE[0]), 1 << stimseq.HEARTBEAT_LINE[1]
+
+
+def _sequence() -> stimseq.CompiledSequence:
+    return stimseq._validate_values(np.array(ROWS, dtype=np.float64), min_timestep=10)[0]
+
+
+def test_steps_changing_no_output_are_merged():
+    plan = stimseq._plan_dispatch(_sequence(), enable_heartbeat=False)
+    assert plan.steps.tolist() == [0, 2, 3, 4]
+    assert plan.timestamps.tolist() == [0, 40, 60, 80]
+    assert plan.write_do.tolist() == [True, True, False, True]
+    assert plan.write_ao.tolist() == [True, False, True, False]
+    np.testing.assert_array_equal(plan.do_ports, _sequence().do_ports[plan.steps])
+
+
+def test_ao_is_not_planned_with_hardware_timed_ao():
+    plan = stimseq._plan_dispatch(_sequence(), enable_heartbeat=False, include_ao=False)
+    assert plan.steps.tolist() == [0, 2, 4]
+    assert not np.any(plan.write_ao)
+
+
+def test_heartbeat_toggles_at_each_do_write():
+    plan = stimseq._plan_dispatch(_sequence())
+    heartbeat = (plan.do_ports[:, HEARTBEAT_PORT] & HEARTBEAT_BIT) != 0
+    # High after the 1st and 3rd DO writes, kept at the step writing AO only
+    assert heartbeat.tolist() == [True, False, False, True]
+    # Other bits are the ones of the sequence
+    np.testing.assert_array_equal(plan.do_ports & ~np.uint32(HEARTBEAT_BIT), _sequence().do_ports[plan.steps])
+
+    plan = stimseq._plan_dispatch(_sequence(), enable_heartbeat=False)
+    assert not np.any(plan.do_ports[:, HEARTBEAT_PORT] & HEARTBEAT_BIT)
+
+
+def test_stats_count_the_saved_writes():
+    plan = stimseq._plan_dispatch(_sequence())
+    do_bytes, ao_bytes = len(stimseq.DO_PORTS) * 4, len(stimseq.AO_DATA_KEYS) * 8
+    assert plan.stats() == {"steps": 5, "dispatched_steps": 4, "do_writes": 3, "ao_writes": 2, "writes_saved": 5,
+                            "bytes_saved": 2 * do_bytes + 3 * ao_bytes}
+
+
+def test_run_outputs_match_the_sequence(write_sequence, make_stimseq):
+    session, backend = make_stimseq(write_sequence(ROWS))
+    session.run_sequence()
+    transitions = relative_transitions(backend)
+
+    # Each output changes at the step changing it only, then is reset at the end of the sequence
+    expected = {"Port0": [(0, 1), (40, 0)], "LED": [(0, 1.0), (60, 2.0), (100, 0.0)],
+                "Port1": [(0, HEARTBEAT_BIT), (40, 0), (80, HEARTBEAT_BIT | 1), (100, 0)]}
+    for name, changes in expected.items():
+        sent = [(time, value) for time, channel, value in transitions if channel == name]
+        assert [value for _, value in sent] == [value for _, value in changes]
+        for (time, _), (deadline, _) in zip(sent, changes):
+            assert deadline <= time < deadline + 20
@@ -0,0 +1,145 @@
+#pylint: disable=line-too-long
+"""Hardware timed AO generation on the simulated DAQ"""
+from threading import Event, Timer
+from time import perf_counter, sleep
+
+import numpy as np
+import pytest
+
+import stimseq
+from conftest import relative_transitions
+from stimseq_daq import SimulatedBackend
+
+# Rows with LED steps, in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo
+LED_ROWS = [
+    [0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+    [20, 0, 0, 0, 0, 0, 0, 0, 0, 2.5, 0],
+    [40, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
+    [70, 1, 0, 0, 0, 0, 0, 0, 0, 4, 0],
+]
+
+
+class StreamingBackend(SimulatedBackend):
+    """ Simulated DAQ with slow waveform writes, failing from a given one """
+    def __init__(self, failing_write:int|None=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.failing_write = failing_write
+        self.writes = 0
+        self.writing = False
+        self.stopped_while_writing = False
+
+    def write_ao_waveform(self, data:np.ndarray, timeout:float) -> None:
+        self.writes += 1
+        if self.writes == self.failing_write:
+            raise OSError("AO buffer write failed")
+        self.writing = True
+        sleep(0.01)
+        super().write_ao_waveform(data, timeout)
+        self.writing = False
+
+    def stop_ao(self) -> None:
+        self.stopped_while_writing |= self.writing
+        super().stop_ao()
+
+
+def _led_transitions(backend) -> list[tuple[float, float]]:
+    return [(time, value) for time, name, value in relative_transitions(backend) if name == "LED"]
+
+
+def test_ao_waveform_holds_each_step_until_the_next_one():
+    sequence = stimseq._compile_sequence(timestamps=np.array([10, 20]), ao_values=np.array([[1.0], [2.0]]), #pylint: disable=protected-access
+                                         do_values=np.zeros((2, len(stimseq.DO_DATA_KEYS))))
+    waveform = stimseq._ao_waveform(sequence, 1000) #pylint: disable=protected-access
+    assert waveform.shape == (1, stimseq._ao_waveform_size(sequence, 1000)) == (1, 31) #pylint: disable=protected-access
+    assert np.all(waveform[0, :10] == 0)
+    assert np.all(waveform[0, 10:20] == 1)
+    assert np.all(waveform[0, 20:30] == 2)
+    # Outputs are reset with the last sample, one last time step after the last step
+    assert waveform[0, -1] == 0
+
+
+def test_ao_waveform_chunks_match_the_whole_waveform():
+    sequence, _ = stimseq._validate_values(np.array(LED_ROWS, dtype=np.float64), min_timestep=10) #pylint: disable=protected-access
+    whole = stimseq._ao_waveform(sequence, 1000) #pylint: disable=protected-access
+    chunks = [stimseq._ao_waveform(sequence, 1000, first_sample=first, last_sample=first + 16) #pylint: disable=protected-access
+              for first in range(0, whole.shape[1], 16)]
+    np.testing.assert_array_equal(np.concatenate(chunks, axis=1), whole)
+
+
+def test_run_generates_ao_from_the_trigger(write_sequence, make_stimseq):
+    session, backend = make_stimseq(write_sequence(LED_ROWS))
+    session.run_sequence(ao_sample_rate=1000)
+
+    # Waveform samples are timed by the sample clock, exactly from the trigger
+    assert _led_transitions(backend) == [(0, 1.0), (20, 2.5), (40, 0.0), (70, 4.0), (100, 0.0)]
+    # The waveform starts with the terminal of the trigger line
+    port, line = stimseq._port_lines(stimseq.TTL_DI)[0] #pylint: disable=protected-access
+    assert port == 2
+    assert backend.ao_trigger_source == f"/{stimseq.DAQ_NAME}/PFI{line}" == stimseq.TTL_PFI
+
+
+def test_streamed_waveform_matches_a_single_write(write_sequence, make_stimseq, monkeypatch):
+    path = write_sequence(LED_ROWS)
+    session, backend = make_stimseq(path)
+    session.run_sequence(ao_sample_rate=1000)
+    expected = _led_transitions(backend)
+
+    # The waveform is longer than the buffer, it is streamed by chunks during the run
+    monkeypatch.setattr(stimseq, "AO_BUFFER_SIZE", 16)
+    session, backend = make_stimseq(path)
+    session.run_sequence(ao_sample_rate=1000)
+    assert _led_transitions(backend) == expected
+
+
+def test_digital_outputs_are_still_sent_by_the_computer(write_sequence, make_stimseq):
+    session, backend = make_stimseq(write_sequence(LED_ROWS))
+    session.run_sequence(ao_sample_rate=1000, enable_heartbeat=False)
+    port0 = [(time, value) for time, name, value in relative_transitions(backend) if name == "Port0"]
+    assert [value for _, value in port0] == [1, 0, 1, 0]
+    # Sent at their deadline from the trigger, never before
+    for (time, _), deadline in zip(port0, [0, 20, 70, 100]):
+        assert deadline <= time < deadline + 20
+
+
+def test_failed_streaming_stops_the_run_with_its_error(write_sequence, make_stimseq, monkeypatch):
+    monkeypatch.setattr(stimseq, "AO_BUFFER_SIZE", 16)
+    session, backend = make_stimseq(write_sequence([*LED_ROWS, [2000, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0]]),
+                                    backend=StreamingBackend(failing_write=2, trigger_delay=5))
+    start = perf_counter()
+    # Error of the streaming thread, not a later timeout of the generation
+    with pytest.raises(OSError, match="AO buffer write failed"):
+        session.run_sequence(ao_sample_rate=1000)
+    # Run stopped when the write failed, not at the end of the 2 s sequence
+    assert perf_counter() - start < 1
+    assert backend.transitions[-1][2] == 0
+    assert [value for _, name, value in backend.transitions if name == "Port0"][-1] == 0
+
+
+def test_streamer_ends_before_the_waveform_is_stopped(write_sequence, make_stimseq, monkeypatch):
+    monkeypatch.setattr(stimseq, "AO_BUFFER_SIZE", 16)
+    session, backend = make_stimseq(write_sequence([*LED_ROWS, [2000, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0]]),
+                                    backend=StreamingBackend(trigger_delay=5))
+    cancel_event = Event()
+    Timer(0.05, cancel_event.set).start()
+    with pytest.raises(stimseq.SequenceAbortedError):
+        session.run_sequence(ao_sample_rate=1000, cancel_event=cancel_event)
+    # Streaming stopped after a few chunks, none being written when the task is stopped
+    assert 0 < backend.writes < 2000 // 16
+    assert not backend.stopped_while_writing
+    assert _led_transitions(backend)[-1][1] == 0
+
+
+def test_cancelled_run_stops_the_waveform_and_resets_ao(write_sequence, make_stimseq):
+    # Cancelled while waiting for the trigger, the armed waveform is never generated
+    session, backend = make_stimseq(write_sequence(LED_ROWS), backend=SimulatedBackend(trigger_delay=None))
+    cancel_event = Event()
+    cancel_event.set()
+    with pytest.raises(stimseq.SequenceAbortedError):
+        session.run_sequence(ao_sample_rate=1000, cancel_event=cancel_event, trigger_timeout=1)
+    assert all(value == 0 for _, name, value in backend.transitions if name == "LED")
+
+
+def test_invalid_sample_rate_is_rejected(write_sequence, make_stimseq):
+    session, _ = make_stimseq(write_sequence(LED_ROWS))
+    with pytest.raises(ValueError):
+        session.run_sequence(ao_sample_rate=stimseq.AO_MAX_SAMPLE_RATE + 1)
@@ -0,0 +1,83 @@
+#pylint: disable=line-too-long
+"""Sequences run several times back to back from the trigger"""
+import pytest
+
+import stimseq
+from conftest import relative_transitions
+
+HEARTBEAT_BIT = 1 << stimseq.HEARTBEAT_LINE[1]
+
+# Rows in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo. 3 DO writes, iterations of 60 ms from the trigger
+ODD_ROWS = [
+    [0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+    [20, 0, 0, 0, 0, 0, 0, 0, 0, 2, 0],
+    [40, 0, 0, 0, 0, 0, 0, 0, 0, 2, 1],
+]
+
+# Rows with LED steps, iterations of 100 ms
+LED_ROWS = [
+    [0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+    [20, 0, 0, 0, 0, 0, 0, 0, 0, 2.5, 0],
+    [40, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
+    [70, 1, 0, 0, 0, 0, 0, 0, 0, 4, 0],
+]
+
+
+def _sent(backend, channel:str) -> list[tuple[float, int | float]]:
+    return [(time, value) for time, name, value in relative_transitions(backend) if name == channel]
+
+
+def _assert_sent(backend, channel:str, expected:list[tuple[int, int | float]]) -> None:
+    sent = _sent(backend, channel)
+    assert [value for _, value in sent] == [value for _, value in expected]
+    for (time, _), (deadline, _) in zip(sent, expected):
+        assert deadline <= time < deadline + 20
+
+
+@pytest.mark.parametrize("loops", [2, 3])
+def test_heartbeat_toggles_across_iterations(write_sequence, make_stimseq, loops):
+    session, backend = make_stimseq(write_sequence(ODD_ROWS))
+    session.run_sequence(loops=loops)
+    assert session.last_run.iterations == loops
+
+    # An odd number of DO writes per iteration, odd iterations are sent with the heartbeat inverted
+    iteration, inverted = [(0, 2), (20, 0), (40, 3)], [(0, 0), (20, 2), (40, 1)]
+    expected = [(offset + time, value) for i, offset in enumerate(range(0, loops * 60, 60))
+                for time, value in (inverted if i % 2 else iteration)]
+    _assert_sent(backend, "Port1", [*expected, (loops * 60, 0)])
+    heartbeat = [bool(value & HEARTBEAT_BIT) for _, value in _sent(backend, "Port1")]
+    assert heartbeat == [i % 2 == 0 for i in range(3 * loops)] + [False]
+
+    # First step at the trigger, iterations follow each other without reset
+    _assert_sent(backend, "LED", [value for offset in range(0, loops * 60, 60) for value in [(offset, 1.0), (offset + 20, 2.0)]] + [(loops * 60, 0.0)])
+
+
+def test_outputs_are_reset_between_iterations(write_sequence, make_stimseq):
+    # Steps from 20 ms, iterations of 80 ms
+    rows = [[time + 20, *values] for time, *values in ODD_ROWS]
+    session, backend = make_stimseq(write_sequence(rows))
+    session.run_sequence(loops=2)
+
+    # Reset at the start of the next iteration as before the first one, the heartbeat is not inverted
+    _assert_sent(backend, "LED", [(20, 1.0), (40, 2.0), (80, 0.0), (100, 1.0), (120, 2.0), (160, 0.0)])
+    _assert_sent(backend, "Port1", [(20, 2), (40, 0), (60, 3), (80, 0), (100, 2), (120, 0), (140, 3), (160, 0)])
+    _assert_sent(backend, "Port0", [(20, 1), (40, 0), (100, 1), (120, 0)])
+
+
+def test_ao_waveform_is_regenerated_over_loops(write_sequence, make_stimseq):
+    session, backend = make_stimseq(write_sequence(LED_ROWS))
+    session.run_sequence(ao_sample_rate=1000, loops=3)
+
+    # Generated by the sample clock from the trigger, then reset by a write once the generation ended
+    led = _sent(backend, "LED")
+    assert led[:-1] == [(offset + time, value) for offset in (0, 100, 200) for time, value in [(0, 1.0), (20, 2.5), (40, 0.0), (70, 4.0)]]
+    time, value = led[-1]
+    assert value == 0.0 and 300 <= time < 320
+    # DO steps are still sent by the run loop, valve 1 stays open from the last step to the first one of the next iteration
+    _assert_sent(backend, "Port0", [(0, 1), (20, 0), (70, 1), (120, 0), (170, 1), (220, 0), (270, 1), (300, 0)])
+
+
+def test_looped_ao_waveform_lasts_whole_samples(write_sequence, make_stimseq):
+    session, _ = make_stimseq(write_sequence(LED_ROWS))
+    with pytest.raises(ValueError, match="whole number of AO samples"):
+        session.run_sequence(ao_sample_rate=15, loops=2)
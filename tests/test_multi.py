@@ -0,0 +1,100 @@
+#pylint: disable=line-too-long
+"""Sequences run on several simulated DAQs sharing their start"""
+import logging
+from threading import Thread
+from time import perf_counter
+
+import numpy as np
+
+from conftest import relative_transitions
+from stimseq_daq import SimulatedBackend
+from stimseq_multi import DEVICE_ABORTED, DEVICE_DONE, DEVICE_FAILED, START_SOFTWARE, MultiDeviceRunner, SharedStart
+
+# Rows in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo. Steps of the default minimum time step, 2 s long
+ROWS = [[100 * i, i % 2, 0, 0, 0, 0, 0, 0, 0, i % 3, 0] for i in range(20)]
+
+
+class FailingBackend(SimulatedBackend):
+    """ Simulated DAQ failing one DO write """
+    def __init__(self, failing_write:int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.failing_write = failing_write
+        self.writes = 0
+
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        self.writes += 1
+        if self.writes == self.failing_write:
+            raise RuntimeError("DAQ not answering")
+        super().write_do(words, timeout)
+
+
+def _armed(trigger_delay:float|None) -> SimulatedBackend:
+    backend = SimulatedBackend(trigger_delay=trigger_delay)
+    backend.open()
+    backend.add_trigger("Dev1/port2/line0", "TTL")
+    return backend
+
+
+def _wait_all(start:SharedStart, backends:dict[str, SimulatedBackend], timeout:float) -> dict[str, int | None]:
+    starts = {}
+
+    def wait(device:str) -> None:
+        starts[device] = start.wait(device, backends[device], timeout=timeout)
+
+    threads = [Thread(target=wait, args=(device,)) for device in backends]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return starts
+
+
+def test_start_is_the_first_trigger_detection():
+    backends = {"Dev1": _armed(50), "Dev2": _armed(5)}
+    start = SharedStart(list(backends))
+    starts = _wait_all(start, backends, timeout=1)
+
+    # Every device is released with the earliest detection, steps are not delayed by the slowest device
+    assert start.detections == {device: backend.trigger_ns for device, backend in backends.items()}
+    assert start.start_ns == min(start.detections.values()) == backends["Dev2"].trigger_ns
+    assert starts == {"Dev1": start.start_ns, "Dev2": start.start_ns}
+
+
+def test_software_start_follows_the_arming_of_every_device():
+    backends = {"Dev1": _armed(None), "Dev2": _armed(None)}
+    start = SharedStart(list(backends), mode=START_SOFTWARE, start_delay=5)
+    starts = _wait_all(start, backends, timeout=1)
+    assert set(starts.values()) == {start.start_ns}
+    assert start.start_ns >= max(start.detections.values()) + 5_000_000
+
+
+def test_missing_trigger_releases_every_device():
+    backends = {"Dev1": _armed(5), "Dev2": _armed(None)}
+    start = SharedStart(list(backends))
+    assert _wait_all(start, backends, timeout=0.2) == {"Dev1": None, "Dev2": None}
+    assert start.start_ns is None
+
+
+def test_devices_share_their_start(write_sequence, log_file):
+    backends = {"Dev1": SimulatedBackend(trigger_delay=15), "Dev2": SimulatedBackend(trigger_delay=5)}
+    runner = MultiDeviceRunner({device: write_sequence(ROWS[:3]) for device in backends}, log_file=log_file,
+                               log_lvl=logging.CRITICAL, use_cache=False, backends=backends)
+    results = runner.run()
+    assert [(result.device, result.status) for result in results] == [("Dev1", DEVICE_DONE), ("Dev2", DEVICE_DONE)]
+    assert [result.detection_ns for result in results] == [backends["Dev1"].trigger_ns, backends["Dev2"].trigger_ns]
+    assert {result.timing.start_ns for result in results} == {min(result.detection_ns for result in results)}
+
+
+def test_failed_device_stops_the_others(write_sequence, log_file):
+    backends = {"Dev1": SimulatedBackend(trigger_delay=5), "Dev2": FailingBackend(failing_write=3, trigger_delay=5)}
+    runner = MultiDeviceRunner({device: write_sequence(ROWS) for device in backends}, log_file=log_file,
+                               log_lvl=logging.CRITICAL, use_cache=False, backends=backends)
+    start = perf_counter()
+    results = runner.run()
+    assert perf_counter() - start < 1
+
+    assert [(result.device, result.status) for result in results] == [("Dev1", DEVICE_ABORTED), ("Dev2", DEVICE_FAILED)]
+    assert results[1].message == "DAQ not answering"
+    # Outputs of the cancelled device are reset
+    for name in ("Port0", "LED"):
+        assert [value for _, channel, value in relative_transitions(backends["Dev1"]) if channel == name][-1] == 0
@@ -0,0 +1,101 @@
+#pylint: disable=line-too-long
+"""Column by column parser of sequence files, and its validation report"""
+import logging
+
+import numpy as np
+import pytest
+
+import stimseq
+from bench_parser import generate_sequence_file, legacy_parse
+
+
+def _row(timestamp:int|float|str, led:float|str=0, v1:int|str=0) -> list:
+    # Row in SEQUENCE_COLUMNS order
+    return [timestamp, v1, 0, 0, 0, 0, 0, 0, 0, led, 0]
+
+
+@pytest.mark.parametrize("invalid_rate", [0, 0.01, 0.1])
+def test_parser_keeps_the_steps_of_the_row_by_row_parser(tmp_path, invalid_rate):
+    path = str(tmp_path / "generated.csv")
+    generate_sequence_file(path, 2000, invalid_rate, seed=3)
+
+    legacy = legacy_parse(path)
+    sequence, report = stimseq._parse_sequence_file(path) #pylint: disable=protected-access
+
+    assert len(sequence) == len(legacy)
+    assert sequence.timestamps.tolist() == [step[stimseq.TIMESTAMP] for step in legacy]
+    np.testing.assert_array_equal(sequence.ao, [[step[key] for key in stimseq.AO_DATA_KEYS] for step in legacy])
+    np.testing.assert_array_equal(sequence.do_values(), [[step[key] for key in stimseq.DO_DATA_KEYS] for step in legacy])
+    assert (len(report) == 0) == (invalid_rate == 0)
+
+
+def test_report_gives_the_reason_of_each_skipped_row(write_sequence):
+    path = write_sequence([
+        _row(0, led=1),
+        _row(100, v1="x"),  # Not a number
+        _row(200, led=max(stimseq.AO_RANGE) + 1),  # Out of AO range
+        _row(220),
+        _row(240),  # 20 ms after the last kept row
+        _row(280, led=2),  # 40 ms after the skipped row, 60 ms after the last kept row
+        _row(320),
+        _row(360),  # 40 ms after the skipped row, 80 ms after the last kept row
+        [400, 1, 0],  # Missing values
+        _row(450.5),  # Timestamps are whole ms
+    ])
+    sequence, report = stimseq._parse_sequence_file(path, min_timestep=50) #pylint: disable=protected-access
+
+    assert sequence.timestamps.tolist() == [0, 220, 280, 360]
+    assert report.skipped_rows(stimseq.SKIP_INVALID_VALUE).tolist() == [1, 8, 9]
+    assert report.skipped_rows(stimseq.SKIP_AO_RANGE).tolist() == [2]
+    assert report.skipped_rows(stimseq.SKIP_TIMESTEP).tolist() == [4, 6]
+    assert report.rows.tolist() == [1, 2, 4, 6, 8, 9]
+    assert report.summary() == (f"Skipped 6 rows: 3 because {stimseq.SKIP_INVALID_VALUE}, 1 because {stimseq.SKIP_AO_RANGE}, "
+                                f"2 because {stimseq.SKIP_TIMESTEP}")
+
+
+def test_comments_and_empty_lines_are_not_rows(tmp_path):
+    path = tmp_path / "comments.csv"
+    path.write_text("*header\n0,1,0,0,0,0,0,0,0,1,0,first\n\n*comment\n100,x,0,0,0,0,0,0,0,0,0,\n200,0,0,0,0,0,0,0,0,0,0,\"quoted, comment\"\n",
+                    encoding="utf-8")
+    sequence, report = stimseq._parse_sequence_file(str(path), min_timestep=50) #pylint: disable=protected-access
+    assert sequence.timestamps.tolist() == [0, 200]
+    # Rows are counted without the comments and empty lines
+    assert report.rows.tolist() == [1]
+
+
+def test_negative_first_timestamp_is_forced_to_zero(write_sequence):
+    sequence, report = stimseq._parse_sequence_file(write_sequence([_row(-100, led=1), _row(100)]), min_timestep=50) #pylint: disable=protected-access
+    assert report.first_timestamp_forced
+    assert sequence.timestamps.tolist() == [0, 100]
+    assert len(report) == 0
+
+
+def test_min_timestep_is_applied(write_sequence):
+    path = write_sequence([_row(0), _row(20), _row(40), _row(60)])
+    assert stimseq._parse_sequence_file(path, min_timestep=10)[0].timestamps.tolist() == [0, 20, 40, 60] #pylint: disable=protected-access
+    assert stimseq._parse_sequence_file(path, min_timestep=30)[0].timestamps.tolist() == [0, 40] #pylint: disable=protected-access
+
+
+def test_chunked_validation_matches_a_single_one():
+    rng = np.random.default_rng(1)
+    values = np.zeros((500, len(stimseq.SEQUENCE_COLUMNS)))
+    values[:, 0] = np.cumsum(rng.integers(0, 80, size=500))
+    values[rng.integers(0, 500, size=20), 1] = np.nan
+    whole, whole_report = stimseq._validate_values(values, min_timestep=50) #pylint: disable=protected-access
+
+    timestamps, rows, last_timestamp = [], [], None
+    for first in range(0, 500, 64):
+        sequence, report = stimseq._validate_values(values[first:first + 64], last_timestamp=last_timestamp, #pylint: disable=protected-access
+                                                    first_row=first, min_timestep=50)
+        if len(sequence):
+            last_timestamp = int(sequence.timestamps[-1])
+        timestamps += sequence.timestamps.tolist()
+        rows += report.rows.tolist()
+    assert timestamps == whole.timestamps.tolist()
+    assert rows == whole_report.rows.tolist()
+
+
+def test_sequence_without_valid_step_is_rejected(write_sequence):
+    path = write_sequence([_row(0, v1="x")])
+    with pytest.raises(ValueError, match="No valid step"):
+        stimseq.load_sequence(path, False, logging.getLogger(stimseq.LOGGER_NAME))
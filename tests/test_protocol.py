@@ -0,0 +1,117 @@
+#pylint: disable=line-too-long
+"""Expansion of protocol files into sequences"""
+import numpy as np
+import pytest
+
+import stimseq
+import stimseq_protocol
+
+LED = stimseq.AO_DATA_KEYS.index(stimseq.LED)
+V1 = stimseq.DO_DATA_KEYS.index(stimseq.VALVE1)
+
+PROTOCOL = """
+[blocks.odor]
+steps = [{ duration = 100, V1 = 1 }, { duration = 200 }]
+
+[blocks.light]
+sweep = { level = [1, 2.5] }
+steps = [{ duration = 100, LED = "level" }, { duration = 100 }]
+
+[[protocol]]
+blocks = ["odor", "light"]
+repeat = 2
+"""
+
+
+@pytest.fixture
+def write_protocol(tmp_path):
+    """ Write a protocol file, returns its path """
+    def write(text:str) -> str:
+        path = tmp_path / "protocol.toml"
+        path.write_text(text, encoding="utf-8")
+        return str(path)
+    return write
+
+
+def test_blocks_are_expanded_in_order(write_protocol):
+    sequence, report = stimseq_protocol.parse_protocol_file(write_protocol(PROTOCOL), min_timestep=10)
+    assert len(report) == 0
+    assert sequence.timestamps.tolist() == [0, 100, 300, 400, 500, 600, 700, 800, 1000, 1100, 1200, 1300, 1400]
+    assert sequence.ao[:, LED].tolist() == [0, 0, 1, 0, 2.5, 0] * 2 + [0]
+    assert sequence.do_values()[:, V1].tolist() == [True, False, False, False, False, False] * 2 + [False]
+    # Last step already sets every output to 0, it still lasts its duration
+    assert sequence.time_increments[-1] == 100
+
+
+def test_outputs_are_reset_after_the_last_step(write_protocol):
+    sequence, _ = stimseq_protocol.parse_protocol_file(write_protocol("""
+        [blocks.on]
+        sweep = { level = { start = 0, stop = 1, num = 3 } }
+        steps = [{ duration = 100, LED = "level", Piezo = 1 }]
+
+        [[protocol]]
+        block = "on"
+    """), min_timestep=10)
+    assert sequence.timestamps.tolist() == [0, 100, 200, 300]
+    assert sequence.ao[:, LED].tolist() == [0, 0.5, 1, 0]
+    # Last step lasts its duration
+    assert sequence.time_increments[-1] == 100
+
+
+def test_shuffled_orders_are_drawn_from_the_seed(write_protocol):
+    text = """
+        seed = 7
+
+        [blocks.a]
+        steps = [{ duration = 100, LED = 1 }]
+
+        [blocks.b]
+        steps = [{ duration = 100, LED = 2 }]
+
+        [blocks.c]
+        steps = [{ duration = 100, LED = 3 }]
+
+        [[protocol]]
+        blocks = ["a", "b", "c"]
+        repeat = 20
+        shuffle = true
+    """
+    levels = stimseq_protocol.parse_protocol_file(write_protocol(text), min_timestep=10)[0].ao[:-1, LED].reshape(20, 3)
+    # Each repetition runs every block, not always in the same order
+    assert all(sorted(repetition) == [1, 2, 3] for repetition in levels.tolist())
+    assert len({tuple(repetition) for repetition in levels.tolist()}) > 1
+    # The same file always gives the same sequence
+    np.testing.assert_array_equal(stimseq_protocol.parse_protocol_file(write_protocol(text), min_timestep=10)[0].ao[:-1, LED].reshape(20, 3), levels)
+
+
+def test_steps_too_short_are_skipped(write_protocol):
+    sequence, report = stimseq_protocol.parse_protocol_file(write_protocol(PROTOCOL + """
+        [blocks.short]
+        steps = [{ duration = 5, V1 = 1 }, { duration = 100 }]
+
+        [[protocol]]
+        block = "short"
+        repeat = 3
+    """), min_timestep=10)
+    # Steps of 5 ms are followed by a step too close, skipped
+    assert report.skipped_rows(stimseq.SKIP_TIMESTEP).tolist() == [13, 15, 17]
+    assert sequence.timestamps[12:].tolist() == [1400, 1505, 1610, 1715]
+    assert not report.first_timestamp_forced
+
+
+@pytest.mark.parametrize("text, match", [
+    ('[blocks.a]\nsteps = [{ duration = 100.5 }]\n[[protocol]]\nblock = "a"', "step 0 of block a must be a whole number of ms"),
+    ('[blocks.a]\nsteps = [{ duration = 100 }]\n[[protocol]]\nblock = "a"\nrepeat = -1', "non-negative integer"),
+    ('[blocks.a]\nsteps = [{ duration = 100 }]\n[[protocol]]\nblock = "b"', "Unknown blocks"),
+    ('[blocks.a]\nsteps = [{ duration = 100, LED = "level" }]\n[[protocol]]\nblock = "a"', "Unknown sweep parameter"),
+    ('[blocks.a]\nsteps = [{ duration = 100, V9 = 1 }]\n[[protocol]]\nblock = "a"', "Unknown keys"),
+])
+def test_invalid_protocols_are_rejected(write_protocol, text, match):
+    with pytest.raises(ValueError, match=match):
+        stimseq_protocol.read_protocol(write_protocol(text))
+
+
+def test_protocol_without_step_is_rejected(write_protocol):
+    path = write_protocol('[blocks.a]\nsteps = [{ duration = 100, LED = 1 }]\n[[protocol]]\nblock = "a"\nrepeat = 0')
+    with pytest.raises(ValueError, match="Protocol has no step"):
+        stimseq_protocol.parse_protocol_file(path)
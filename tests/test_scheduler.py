@@ -0,0 +1,99 @@
+#pylint: disable=line-too-long
+"""Late steps handled by each policy of the deadline scheduler"""
+from time import perf_counter_ns, sleep
+
+import numpy as np
+import pytest
+
+import stimseq
+from conftest import relative_transitions
+from stimseq import LATE_ABORT, LATE_CATCH_UP, LATE_SKIP, DeadlineScheduler, SequenceAbortedError
+from stimseq_daq import SimulatedBackend
+
+# Rows in SEQUENCE_COLUMNS order: timestamp, V1 to V8, LED, Piezo. Each step opens its own valve only
+ROWS = [[20 * i, *(int(valve == i) for valve in range(8)), 0, 0] for i in range(5)]
+
+# Step late by about 15 ms, after the slow write of the previous one
+LATE_STEP = 2
+
+
+class SlowBackend(SimulatedBackend):
+    """ Simulated DAQ with one slow DO write """
+    def __init__(self, slow_write:int, duration:float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.slow_write = slow_write
+        self.duration = duration
+        self.writes = 0
+
+    def write_do(self, words:np.ndarray, timeout:float) -> None:
+        self.writes += 1
+        if self.writes == self.slow_write:
+            sleep(self.duration / 1000)
+        super().write_do(words, timeout)
+
+
+def _late_run(write_sequence, make_stimseq, late_policy:str, **kwargs):
+    backend = SlowBackend(slow_write=LATE_STEP, duration=35, trigger_delay=5)
+    session, _ = make_stimseq(write_sequence(ROWS), backend=backend)
+    session.run_sequence(late_policy=late_policy, **kwargs)
+    return session, [value for _, name, value in relative_transitions(backend) if name == "Port0"]
+
+
+@pytest.mark.parametrize("late_policy, sent", [(LATE_CATCH_UP, True), (LATE_SKIP, False)])
+def test_late_step_is_counted_by_the_scheduler(late_policy, sent):
+    scheduler = DeadlineScheduler(late_policy=late_policy)
+    scheduler.start(perf_counter_ns() - 50_000_000)
+    assert scheduler.wait(0) is sent
+    assert scheduler.late_steps == 1 and scheduler.max_lateness >= 50
+    # Steps within the tolerance are sent
+    assert scheduler.wait(60)
+    assert scheduler.late_steps == 1
+
+
+def test_late_step_aborts_the_scheduler():
+    scheduler = DeadlineScheduler(late_policy=LATE_ABORT)
+    scheduler.start(perf_counter_ns() - 50_000_000)
+    with pytest.raises(SequenceAbortedError, match="Step at 0 ms is late"):
+        scheduler.wait(0)
+    assert scheduler.late_steps == 1
+
+
+def test_abort_stops_the_waits():
+    scheduler = DeadlineScheduler()
+    scheduler.start()
+    scheduler.abort("AO streaming failed")
+    with pytest.raises(SequenceAbortedError, match="AO streaming failed"):
+        scheduler.wait(1000)
+
+
+def test_late_step_is_sent_with_catch_up(write_sequence, make_stimseq):
+    session, port0 = _late_run(write_sequence, make_stimseq, LATE_CATCH_UP, timing_report=True)
+    assert port0 == [1, 2, 4, 8, 16, 0]
+    assert session.last_run.late_steps == 1 and session.last_run.max_lateness >= 10
+
+    # Every step is recorded, the late one in the histogram bins from the tolerance
+    summary = session.last_run.summary
+    assert (summary["steps"], summary["sent"], summary["do_writes"]) == (5, 5, 5)
+    assert sum(summary["lateness_histogram"][stimseq.TIMING_HISTOGRAM_BINS.index(stimseq.LATE_TOLERANCE):]) == 1
+
+
+def test_late_step_is_skipped(write_sequence, make_stimseq):
+    session, port0 = _late_run(write_sequence, make_stimseq, LATE_SKIP, timing_report=True)
+    # Outputs keep the previous step until the next one
+    assert port0 == [1, 2, 8, 16, 0]
+    assert session.last_run.late_steps == 1
+
+    # Skipped step is not recorded, the others are on time
+    summary = session.last_run.summary
+    assert (summary["steps"], summary["sent"], summary["do_writes"]) == (5, 4, 4)
+    assert sum(summary["lateness_histogram"][stimseq.TIMING_HISTOGRAM_BINS.index(stimseq.LATE_TOLERANCE):]) == 0
+
+
+def test_late_step_aborts_the_run(write_sequence, make_stimseq):
+    backend = SlowBackend(slow_write=LATE_STEP, duration=35, trigger_delay=5)
+    session, _ = make_stimseq(write_sequence(ROWS), backend=backend)
+    with pytest.raises(SequenceAbortedError, match="Step at 40 ms is late"):
+        session.run_sequence(late_policy=LATE_ABORT)
+    # Outputs are reset without sending the following steps
+    assert [value for _, name, value in relative_transitions(backend) if name == "Port0"] == [1, 2, 0]
+    assert session.last_run is None
@@ -0,0 +1,61 @@
+#pylint: disable=line-too-long
+"""Validation of sequence files with a pool of processes"""
+import json
+import os
+
+import pytest
+
+import stimseq
+import stimseq_validate
+from stimseq_validate import FAILED, SKIPPED, VALID
+
+
+@pytest.fixture
+def sequence_files(tmp_path, write_sequence) -> dict[str, str]:
+    """ Files of each status, by name """
+    (tmp_path / "protocol.toml").write_text('[blocks.a]\nsteps = [{ duration = 100, LED = 1 }]\n[[protocol]]\nblock = "a"\n', encoding="utf-8")
+    (tmp_path / "invalid.toml").write_text('[blocks.a]\nsteps = [{ duration = 100.5 }]\n[[protocol]]\nblock = "a"\n', encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("not a sequence\n", encoding="utf-8")
+    return {"valid": write_sequence([[0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0], [100, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], name="valid.csv"),
+            "skipped": write_sequence([[0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0], [20, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                                       [100, "x", 0, 0, 0, 0, 0, 0, 0, 0, 0]], name="skipped.csv"),
+            "empty": write_sequence([[0, "x", 0, 0, 0, 0, 0, 0, 0, 0, 0]], name="empty.csv"),
+            "protocol": str(tmp_path / "protocol.toml"),
+            "invalid": str(tmp_path / "invalid.toml"),
+            "missing": str(tmp_path / "missing.csv")}
+
+
+def test_each_file_gets_its_status(sequence_files):
+    results = {name: stimseq_validate.validate_file(path, min_timestep=50) for name, path in sequence_files.items()}
+    assert {name: result.status for name, result in results.items()} == {
+        "valid": VALID, "skipped": SKIPPED, "empty": FAILED, "protocol": VALID, "invalid": FAILED, "missing": FAILED}
+
+    assert (results["valid"].steps, results["valid"].duration) == (2, 200)
+    assert results["skipped"].skipped == {stimseq.SKIP_TIMESTEP: [1], stimseq.SKIP_INVALID_VALUE: [2]}
+    # Skipped rows of a file without valid step are reported with its error
+    assert results["empty"].skipped == {stimseq.SKIP_INVALID_VALUE: [0]}
+    assert results["empty"].error == "No valid step"
+    assert "whole number of ms" in results["invalid"].error
+
+
+def test_pool_matches_a_single_process(sequence_files):
+    paths = list(sequence_files.values())
+    assert stimseq_validate.validate_files(paths, min_timestep=50, jobs=2) == stimseq_validate.validate_files(paths, min_timestep=50, jobs=1)
+
+
+def test_summary_counts_each_status(sequence_files):
+    results = stimseq_validate.validate_files(list(sequence_files.values()), min_timestep=50, jobs=2)
+    summary = stimseq_validate.validation_summary(results, 50, 0.5)
+    assert (summary["files"], summary[VALID], summary[SKIPPED], summary[FAILED]) == (6, 2, 1, 3)
+    assert summary["min_timestep"] == 50
+    assert [result["path"] for result in summary["results"]] == list(sequence_files.values())
+    # Written as JSON by the command line
+    assert json.loads(json.dumps(summary)) == summary
+
+
+def test_directories_give_their_sequence_files(tmp_path, sequence_files):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "nested.csv").write_text("0,0,0,0,0,0,0,0,0,0,0\n", encoding="utf-8")
+    found = stimseq_validate.find_sequence_files([str(tmp_path), sequence_files["valid"]])
+    assert [os.path.basename(path) for path in found] == ["empty.csv", "invalid.toml", "protocol.toml", "skipped.csv", "valid.csv"]
+    assert str(tmp_path / "sub" / "nested.csv") in stimseq_validate.find_sequence_files([str(tmp_path)], recursive=True)
@@ -0,0 +1,116 @@
+#pylint: disable=line-too-long,protected-access
+"""Sequence files parsed again where they changed, compared to a full parse"""
+import os
+
+import numpy as np
+import pytest
+
+import stimseq
+from bench_parser import generate_sequence_file
+from stimseq_watch import SequenceWatcher
+
+
+@pytest.fixture
+def sequence_file(tmp_path) -> str:
+    """ Generated sequence file of 500 rows, some of them skipped """
+    path = str(tmp_path / "watched.csv")
+    generate_sequence_file(path, 500, 0.05, seed=5)
+    return path
+
+
+# Method to edit the lines of a file, the header being line 0
+def _edit(path:str, edit) -> None:
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = f.readlines()
+    edit(lines)
+    mtime_ns = os.stat(path).st_mtime_ns
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.writelines(lines)
+    # Modification time always changes, even within the resolution of the file system
+    os.utime(path, ns=(mtime_ns + 1_000_000, mtime_ns + 1_000_000))
+
+
+def _set_timestamp(lines:list[str], row:int, timestamp:int) -> None:
+    lines[row + 1] = ",".join([str(timestamp), *lines[row + 1].split(",")[1:]])
+
+
+def _timestamp(lines:list[str], row:int) -> int:
+    return int(lines[row + 1].split(",")[0])
+
+
+def _toggle_valve(lines:list[str], row:int) -> None:
+    values = lines[row + 1].split(",")
+    values[1] = "0" if values[1] == "1" else "1"
+    lines[row + 1] = ",".join(values)
+
+
+def _assert_parsed(watcher:SequenceWatcher) -> None:
+    sequence, report = stimseq._parse_sequence_file(watcher.path)
+    for name in stimseq.CompiledSequence._fields:
+        np.testing.assert_array_equal(getattr(watcher.compiled, name), getattr(sequence, name))
+    np.testing.assert_array_equal(watcher.report.rows, report.rows)
+    np.testing.assert_array_equal(watcher.report.reasons, report.reasons)
+    assert watcher.report.first_timestamp_forced == report.first_timestamp_forced
+
+
+EDITS = {
+    "value": lambda lines: _toggle_valve(lines, 250),
+    "insert": lambda lines: lines.insert(200, lines[200]),
+    "delete": lambda lines: lines.pop(300),
+    "later_timestamp": lambda lines: _set_timestamp(lines, 100, _timestamp(lines, 110)),
+    "earlier_timestamp": lambda lines: _set_timestamp(lines, 400, _timestamp(lines, 399) + 1),
+    "first_row": lambda lines: lines.pop(1),
+    "last_row": lambda lines: lines.append(f"{_timestamp(lines, len(lines) - 2) + 100},1,0,0,0,0,0,0,0,1,0,end\n"),
+    "comment": lambda lines: lines.insert(50, "*comment\n"),
+    "invalid_value": lambda lines: lines.__setitem__(150, "x" + lines[150]),
+}
+
+
+@pytest.mark.parametrize("edit", EDITS)
+def test_update_matches_a_full_parse(sequence_file, edit):
+    watcher = SequenceWatcher(sequence_file)
+    _assert_parsed(watcher)
+    _edit(sequence_file, EDITS[edit])
+    assert watcher.update() is not None
+    _assert_parsed(watcher)
+
+
+def test_successive_updates_match_a_full_parse(sequence_file):
+    watcher = SequenceWatcher(sequence_file)
+    for edit in EDITS.values():
+        _edit(sequence_file, edit)
+        assert watcher.update() is not None
+        _assert_parsed(watcher)
+
+
+def test_update_parses_the_edited_rows_only(sequence_file):
+    watcher = SequenceWatcher(sequence_file)
+    assert watcher.update() is None
+
+    # First kept row from row 250
+    row = next(row for row in range(250, 500) if row not in watcher.report.rows)
+    timestamp = int(watcher.compiled.timestamps[row - int(np.searchsorted(watcher.report.rows, row))])
+    _edit(sequence_file, lambda lines: _toggle_valve(lines, row))
+    update = watcher.update()
+    assert (update.first_row, update.parsed_rows, update.full) == (row, 1, False)
+    # Only the edited step changed
+    assert update.t_start == update.t_end == timestamp
+    _assert_parsed(watcher)
+
+
+def test_unchanged_steps_give_no_span(sequence_file):
+    watcher = SequenceWatcher(sequence_file)
+    _edit(sequence_file, EDITS["comment"])
+    update = watcher.update()
+    assert update.parsed_rows == 0
+    assert update.t_start is None and update.t_end is None
+
+
+def test_rows_after_a_moved_step_are_validated_again(sequence_file):
+    watcher = SequenceWatcher(sequence_file)
+    _edit(sequence_file, EDITS["later_timestamp"])
+    update = watcher.update()
+    # Rows until the one of the new timestamp are now too close to the edited row
+    assert update.parsed_rows == 1 and update.validated_rows > 10
+    assert update.validated_rows < 500 - update.first_row
+    _assert_parsed(watcher)